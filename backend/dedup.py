@@ -0,0 +1,73 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from backend.sqlite import TableImportedFile, TableSegmentDigest, \
+                           TableTrackSegment, TableSegmentPoint
+from processing.dedup import SegmentDigest
+
+
+class DedupStore:
+    """Look up files and segments that are already stored"""
+    def __init__(self, session):
+        self.session = session
+
+    def find_file(self, sha1):
+        """Get the imported_files row with a content hash, or None."""
+        return self.session.query(TableImportedFile).filter(
+                TableImportedFile.sha1 == sha1).first()
+
+    def create_file_row(self, path, sha1, size, imported):
+        f = TableImportedFile()
+        f.path = path
+        f.sha1 = sha1
+        f.size = size
+        f.imported = imported
+        return f
+
+    def find_segment(self, digest):
+        """Get the id of a stored segment matching a SegmentDigest, or
+           None. Segments stored more than once (before dedup, or by two
+           imports at the same time) all match; any of them is returned."""
+        d = TableSegmentDigest
+        return self.session.query(d.segment_id).filter(
+                d.first_time == digest.first_time).filter(
+                d.num_points == digest.num_points).filter(
+                d.coord_hash == digest.coord_hash).filter(
+                d.last_time == digest.last_time).filter(
+                d.first_lat == digest.first_lat).filter(
+                d.first_lon == digest.first_lon).filter(
+                d.last_lat == digest.last_lat).filter(
+                d.last_lon == digest.last_lon).limit(1).scalar()
+
+    def create_segment_row(self, segid, digest):
+        d = TableSegmentDigest(**digest.as_dict())
+        d.segment_id = segid
+        return d
+
+    def rebuild(self, batch_size=100):
+        """Compute the digest of every stored segment that has none. Rows
+           are inserted with OR IGNORE, so digests added meanwhile (e.g. by
+           an import) are kept."""
+        have = set(s for (s,) in self.session.query(
+                   TableSegmentDigest.segment_id))
+        segids = [s for (s,) in self.session.query(TableTrackSegment.id
+                  ).order_by(TableTrackSegment.id) if s not in have]
+        insert = TableSegmentDigest.__table__.insert().prefix_with('OR IGNORE')
+        rows = []
+        for segid in segids:
+            points = self.session.query(TableSegmentPoint.lat,
+                    TableSegmentPoint.lon, TableSegmentPoint.time).filter(
+                    TableSegmentPoint.segment_id == segid).order_by(
+                    TableSegmentPoint.id).all()
+            row = SegmentDigest(points).as_dict()
+            row['segment_id'] = segid
+            rows.append(row)
+            if len(rows) == batch_size:
+                self.session.execute(insert, rows)
+                self.session.commit()
+                rows = []
+        if rows:
+            self.session.execute(insert, rows)
+        self.session.commit()
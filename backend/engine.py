@@ -0,0 +1,140 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import sys
+import threading
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+BULK_LOAD = 'bulk-load'
+INTERACTIVE = 'interactive'
+READ_ONLY = 'read-only'
+
+#PRAGMA settings for each profile. cache_size is negative for KiB.
+#bulk-load trades durability for speed. A crash of the program is safe, but
+#with synchronous=OFF an OS crash or power loss can lose committed
+#transactions or corrupt the file, WAL or not. Only use it for a database
+#that can be rebuilt, such as a first import into a new file.
+PROFILES = {
+    BULK_LOAD: (('journal_mode', 'WAL'), ('synchronous', 'OFF'),
+                ('cache_size', -262144), ('temp_store', 'MEMORY'),
+                ('mmap_size', 1 << 30)),
+    INTERACTIVE: (('journal_mode', 'WAL'), ('synchronous', 'NORMAL'),
+                  ('cache_size', -65536), ('temp_store', 'MEMORY'),
+                  ('mmap_size', 256 << 20)),
+    #journal_mode is a property of the file, readers don't change it.
+    #query_only only matters where create_engine can't open the file
+    #read-only.
+    READ_ONLY: (('query_only', 'ON'), ('cache_size', -131072),
+                ('temp_store', 'MEMORY'), ('mmap_size', 1 << 30)),
+}
+#Whether the sqlite3 module can open URIs, for mode=ro
+READ_ONLY_URI = sys.version_info >= (3, 4)
+
+
+def apply_profile(engine, profile):
+    """Run a profile's PRAGMAs on every new connection of an engine. None
+       leaves the SQLite defaults."""
+    if profile is None:
+        return engine
+    pragmas = PROFILES[profile]
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        cursor.close()
+    return engine
+
+
+def create_engine(path, profile=INTERACTIVE, echo=False, **kwargs):
+    """Create an engine for a database file with one of the PROFILES. With
+       READ_ONLY the file is opened read-only (mode=ro) on Python 3.4 and
+       later. The sqlite3 module of older versions can't open URIs, so
+       there it is opened read-write with PRAGMA query_only, which stops
+       writes through the engine but not SQLite's own (e.g. rolling back
+       a hot journal)."""
+    url = 'sqlite:///' + path
+    if profile == READ_ONLY and READ_ONLY_URI:
+        url = 'sqlite:///file:%s?mode=ro&uri=true' % quote(path)
+    engine = sqlalchemy.create_engine(url, echo=echo, **kwargs)
+    return apply_profile(engine, profile)
+
+
+def get_pragmas(engine):
+    """Get the current value of every PRAGMA set by the profiles."""
+    names = set(name for pragmas in PROFILES.values() for name, v in pragmas)
+    conn = engine.connect()
+    try:
+        return dict((name, conn.execute('PRAGMA %s' % name).scalar())
+                    for name in sorted(names))
+    finally:
+        conn.close()
+
+
+class ReadPool:
+    """A pool of read-only connections for running queries in parallel.
+       SQLite releases the GIL while it works, so queries that spend their
+       time in SQLite (scans, aggregates) overlap; ones that spend it
+       building Python objects gain little. With WAL (set by the other
+       profiles) readers also don't wait for a writer."""
+    def __init__(self, path, size=4, profile=READ_ONLY):
+        self.size = size
+        self.engine = create_engine(path, profile, poolclass=QueuePool,
+                                    pool_size=size, max_overflow=0,
+                                    connect_args={'check_same_thread': False})
+
+    def execute(self, function, *args):
+        """Call function(connection, *args) with a pooled connection."""
+        conn = self.engine.connect()
+        try:
+            return function(conn, *args)
+        finally:
+            conn.close()
+
+    def map(self, function, items):
+        """Call function(connection, item) for every item, spread over the
+           pool's connections, and return the results in order."""
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+        lock = threading.Lock()
+        todo = list(range(len(items)))
+
+        def work():
+            conn = self.engine.connect()
+            try:
+                while True:
+                    with lock:
+                        if not todo or errors:
+                            return
+                        i = todo.pop(0)
+                    try:
+                        results[i] = function(conn, items[i])
+                    except Exception as e:
+                        with lock:
+                            errors.append(e)
+            finally:
+                conn.close()
+        threads = [threading.Thread(target=work)
+                   for n in range(min(self.size, len(items)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def dispose(self):
+        self.engine.dispose()
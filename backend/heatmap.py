@@ -0,0 +1,96 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from sqlalchemy import and_, or_, bindparam, case
+
+from backend.sqlite import TableHeatmapCell, TableSegmentPoint
+from processing.heatmap import count_cells, empty_tile, HEATMAP_ZOOMS, \
+                               TILE_CELLS
+
+
+class HeatmapStore:
+    """Maintain and query the heatmap_cells table. Counts are added as
+       points are imported, so the heatmap never needs a full scan except
+       through rebuild."""
+    def __init__(self, session, zooms=HEATMAP_ZOOMS, tile_cells=TILE_CELLS):
+        self.session = session
+        self.zooms = zooms
+        self.tile_cells = tile_cells
+
+    def count_points(self, points):
+        """Get the cell counts of a list of points, for merge."""
+        return count_cells(((p.lat, p.lon, p.time) for p in points),
+                           self.zooms, self.tile_cells)
+
+    def add_points(self, points):
+        """Add a list of points to the stored counts."""
+        self.merge(self.count_points(points))
+
+    def merge(self, cells):
+        """Add the counts from count_cells to the stored cells. Only the
+           touched rows are written, without reading any: missing cells are
+           inserted with a zero count, then every cell gets its count added
+           in one batched UPDATE."""
+        if not cells:
+            return
+        h = TableHeatmapCell.__table__
+        self.session.execute(h.insert().prefix_with('OR IGNORE'),
+                             [dict(zoom=zoom, x=x, y=y, count=0)
+                              for zoom, x, y in cells])
+        last = bindparam('b_last')
+        update = h.update().where(and_(h.c.zoom == bindparam('b_zoom'),
+                                       h.c.x == bindparam('b_x'),
+                                       h.c.y == bindparam('b_y'))).values(
+                count=h.c.count + bindparam('b_count'),
+                last_visit=case([(and_(last != None, or_(
+                    h.c.last_visit == None, h.c.last_visit < last)), last)],
+                    else_=h.c.last_visit))
+        self.session.execute(update, [dict(b_zoom=zoom, b_x=x, b_y=y,
+                                           b_count=count, b_last=visit)
+                                      for (zoom, x, y), (count, visit)
+                                      in cells.items()])
+
+    def rebuild(self, batch_size=10000):
+        """Recount every stored point, streaming segment_points in batches
+           and committing after each one."""
+        self.session.query(TableHeatmapCell).delete(synchronize_session=False)
+        self.session.commit()
+        last_id = 0
+        while True:
+            rows = self.session.query(TableSegmentPoint.id,
+                    TableSegmentPoint.lat, TableSegmentPoint.lon,
+                    TableSegmentPoint.time).filter(
+                    TableSegmentPoint.id > last_id).order_by(
+                    TableSegmentPoint.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            self.merge(count_cells((r[1:] for r in rows), self.zooms,
+                                   self.tile_cells))
+            self.session.commit()
+
+    def tile(self, zoom, x, y):
+        """Get the counts of a map tile as a row-major array of
+           tile_cells * tile_cells, e.g. for processing.heatmap.shade."""
+        n = self.tile_cells
+        counts = empty_tile(n)
+        h = TableHeatmapCell
+        for cx, cy, count in self.session.query(h.x, h.y, h.count).filter(
+                h.zoom == zoom).filter(
+                h.x.between(x * n, x * n + n - 1)).filter(
+                h.y.between(y * n, y * n + n - 1)):
+            counts[(cy - y * n) * n + (cx - x * n)] = count
+        return counts
+
+    def last_visits(self, zoom, x, y):
+        """Get {(column, row): last visit time} for the visited cells of a
+           map tile."""
+        n = self.tile_cells
+        h = TableHeatmapCell
+        return dict(((cx - x * n, cy - y * n), last)
+                    for cx, cy, last in self.session.query(h.x, h.y,
+                    h.last_visit).filter(h.zoom == zoom).filter(
+                    h.x.between(x * n, x * n + n - 1)).filter(
+                    h.y.between(y * n, y * n + n - 1)))
@@ -0,0 +1,93 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from array import array
+
+from backend.sqlite import TableSegmentSimplification, TableSegmentPoint, \
+                           TableTrackSegment
+from processing.geo import pack_doubles, unpack_doubles
+from processing.lod import LOD_TOLERANCES, build_pyramid, choose_level
+
+
+class LodStore:
+    """Save and query the per-segment LOD pyramids used for drawing"""
+    def __init__(self, session, tolerances=LOD_TOLERANCES):
+        self.session = session
+        self.tolerances = tolerances
+
+    def create_levels(self, segid, points):
+        """Get table rows for every level of a segment's pyramid."""
+        rows = []
+        for lod in build_pyramid(points, self.tolerances):
+            s = TableSegmentSimplification()
+            s.segment_id = segid
+            s.level = lod.level
+            s.tolerance = lod.tolerance
+            s.num_points = len(lod.lats)
+            s.minlat = lod.minlat
+            s.minlon = lod.minlon
+            s.maxlat = lod.maxlat
+            s.maxlon = lod.maxlon
+            s.extent = lod.get_extent()
+            s.lats = pack_doubles(lod.lats)
+            s.lons = pack_doubles(lod.lons)
+            rows.append(s)
+        return rows
+
+    def save_pyramid(self, segid, points):
+        """Replace the stored pyramid of a segment."""
+        self.session.query(TableSegmentSimplification).filter(
+                TableSegmentSimplification.segment_id == segid).filter(
+                TableSegmentSimplification.level != None).delete(
+                synchronize_session=False)
+        for row in self.create_levels(segid, points):
+            self.session.add(row)
+
+    def rebuild(self):
+        """Rebuild the pyramids of every stored segment."""
+        for (segid,) in self.session.query(TableTrackSegment.id):
+            self.save_pyramid(segid, list(self.session.query(
+                    TableSegmentPoint.lat, TableSegmentPoint.lon).filter(
+                    TableSegmentPoint.segment_id == segid).order_by(
+                    TableSegmentPoint.id)))
+        self.session.commit()
+
+    def visible(self, minlat, minlon, maxlat, maxlon, metres_per_pixel):
+        """Get the level to draw a viewport at and the segments inside it, as
+           (level, [(segment_id, lats, lons), ...]). Level is None when the
+           view is zoomed in past the finest level, in which case the full
+           resolution points are returned. Segments smaller than a pixel are
+           left out, so the amount of data drawn depends on the viewport
+           rather than on the size of the library."""
+        level = choose_level(metres_per_pixel, self.tolerances)
+        t = TableSegmentSimplification
+        if level is None:
+            #Only the bounding boxes of level 0 are needed, not its points
+            q = self.session.query(t.segment_id)
+        else:
+            q = self.session.query(t.segment_id, t.lats, t.lons)
+        q = q.filter(t.level == (level or 0)).filter(
+                t.maxlat >= minlat).filter(t.minlat <= maxlat).filter(
+                t.maxlon >= minlon).filter(t.minlon <= maxlon).filter(
+                t.extent >= metres_per_pixel)
+        segments = []
+        for row in q:
+            if level is None:
+                lats, lons = self.__load_points(row.segment_id)
+            else:
+                lats, lons = unpack_doubles(row.lats), unpack_doubles(row.lons)
+            segments.append((row.segment_id, lats, lons))
+        return level, segments
+
+    def __load_points(self, segid):
+        """Load the full-resolution coordinates of a segment."""
+        lats, lons = array('d'), array('d')
+        for lat, lon in self.session.query(
+                TableSegmentPoint.lat, TableSegmentPoint.lon).filter(
+                TableSegmentPoint.segment_id == segid).order_by(
+                TableSegmentPoint.id):
+            lats.append(float(lat))
+            lons.append(float(lon))
+        return lats, lons
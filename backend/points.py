@@ -0,0 +1,138 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from array import array
+
+from sqlalchemy import func, or_
+
+from backend.sqlite import TableSegmentPoint, TableTrackSegment, TableTrack, \
+                           TableGpx
+from processing.geo import to_timestamp
+
+NAN = float('nan')
+BATCH_SIZE = 5000
+
+
+def to_seconds(value):
+    """Accept epoch seconds or a GPX time string for a query bound."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    seconds = to_timestamp(value)
+    if seconds is None:
+        raise ValueError('Not a time: %r' % (value,))
+    return seconds
+
+
+class PointBatch:
+    """One batch of query results as parallel columns. timestamps, lats,
+       lons and eles are float arrays (eles NaN where missing), segment_ids
+       and ids integer arrays."""
+    def __init__(self):
+        self.ids = array('l')
+        self.segment_ids = array('l')
+        self.timestamps = array('d')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.eles = array('d')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return "POINTS - %s points, from %s to %s" % (
+                    len(self.ids), self.timestamps[0] if self.ids else None,
+                    self.timestamps[-1] if self.ids else None)
+
+
+class PointQuery:
+    """Time-range and device queries over segment_points. Results come in
+       time order as PointBatches, each fetched by a keyset seek on the
+       (device_id, timestamp) covering index, so the first batch is as quick
+       on a large database as on a small one. Time bounds are inclusive and
+       can be epoch seconds or GPX time strings."""
+    def __init__(self, session, batch_size=BATCH_SIZE):
+        self.session = session
+        self.batch_size = batch_size
+
+    def batches(self, device_id=None, start=None, end=None):
+        """Yield PointBatches of the points of a device (any device if
+           None) between start and end. Points without a time are left
+           out."""
+        start = to_seconds(start)
+        end = to_seconds(end)
+        p = TableSegmentPoint
+        last = None
+        while True:
+            q = self.session.query(p.id, p.segment_id, p.timestamp, p.lat,
+                                   p.lon, p.ele)
+            if device_id is not None:
+                q = q.filter(p.device_id == device_id)
+            if last is not None:
+                q = q.filter(p.timestamp >= last[0]).filter(
+                        or_(p.timestamp > last[0], p.id > last[1]))
+            elif start is not None:
+                q = q.filter(p.timestamp >= start)
+            else:
+                q = q.filter(p.timestamp != None)
+            if end is not None:
+                q = q.filter(p.timestamp <= end)
+            rows = q.order_by(p.timestamp, p.id).limit(self.batch_size).all()
+            if not rows:
+                return
+            batch = PointBatch()
+            for id, segid, t, lat, lon, ele in rows:
+                batch.ids.append(id)
+                batch.segment_ids.append(segid)
+                batch.timestamps.append(t)
+                batch.lats.append(float(lat))
+                batch.lons.append(float(lon))
+                batch.eles.append(float(ele) if ele else NAN)
+            yield batch
+            if len(rows) < self.batch_size:
+                return
+            last = (rows[-1][2], rows[-1][0])
+
+    def count(self, device_id=None, start=None, end=None):
+        """Get the number of points a batches() call would return."""
+        start = to_seconds(start)
+        end = to_seconds(end)
+        p = TableSegmentPoint
+        q = self.session.query(func.count(p.id)).filter(p.timestamp != None)
+        if device_id is not None:
+            q = q.filter(p.device_id == device_id)
+        if start is not None:
+            q = q.filter(p.timestamp >= start)
+        if end is not None:
+            q = q.filter(p.timestamp <= end)
+        return q.scalar()
+
+    def time_range(self, device_id=None):
+        """Get the (first, last) timestamps of a device, or (None, None)."""
+        p = TableSegmentPoint
+        q = self.session.query(func.min(p.timestamp), func.max(p.timestamp))
+        if device_id is not None:
+            q = q.filter(p.device_id == device_id)
+        return tuple(q.one())
+
+    def backfill(self, batch_size=BATCH_SIZE):
+        """Fill in timestamp and device_id for points saved before those
+           columns existed, committing after each batch."""
+        p = TableSegmentPoint
+        last_id = 0
+        while True:
+            rows = self.session.query(p.id, p.time, TableGpx.device_id).join(
+                    TableTrackSegment, TableTrackSegment.id == p.segment_id
+                    ).join(TableTrack, TableTrack.id == TableTrackSegment.track_id
+                    ).join(TableGpx, TableGpx.id == TableTrack.gpx_id).filter(
+                    p.id > last_id).filter(or_(p.device_id == None,
+                    (p.timestamp == None) & (p.time != None))).order_by(
+                    p.id).limit(batch_size).all()
+            if not rows:
+                break
+            self.session.bulk_update_mappings(p, [
+                {'id': id, 'timestamp': to_timestamp(time),
+                 'device_id': device_id} for id, time, device_id in rows])
+            self.session.commit()
+            last_id = rows[-1][0]
@@ -0,0 +1,58 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from backend.sqlite import TableProximityEvent, TableWaypoint, \
+                           TableTrackSegment, TableSegmentPoint
+from processing.proximity import ProximityIndex
+
+
+class ProximityJob:
+    """Batch job filling proximity_events for every stored segment. Each
+       segment's points are streamed and swept once against an index of all
+       waypoints that have a proximity radius."""
+    def __init__(self, session, default_radius=None):
+        self.session = session
+        self.default_radius = default_radius
+
+    def run(self, batch_size=100):
+        """Replace all proximity events, committing every batch_size
+           segments. Returns the number of events written."""
+        #Plain rows rather than TableWaypoint instances, which the commits
+        #below would expire and reload one query per event
+        q = self.session.query(TableWaypoint.id, TableWaypoint.name,
+                               TableWaypoint.lat, TableWaypoint.lon,
+                               TableWaypoint.gpxx_proximity)
+        if not self.default_radius:
+            q = q.filter(TableWaypoint.gpxx_proximity != None)
+        index = ProximityIndex(q.all(), self.default_radius)
+        self.session.query(TableProximityEvent).delete(
+                synchronize_session=False)
+        count = 0
+        if not index.size:
+            self.session.commit()
+            return count
+        segids = [s for (s,) in self.session.query(TableTrackSegment.id)]
+        for i in range(0, len(segids), batch_size):
+            rows = []
+            for segid in segids[i:i + batch_size]:
+                rows.extend(self.segment_rows(index, segid))
+            if rows:
+                self.session.execute(TableProximityEvent.__table__.insert(),
+                                     rows)
+            count += len(rows)
+            self.session.commit()
+        return count
+
+    def segment_rows(self, index, segid):
+        """Get the event rows for one stored segment."""
+        points = self.session.query(TableSegmentPoint.id,
+                TableSegmentPoint.lat, TableSegmentPoint.lon,
+                TableSegmentPoint.time).filter(
+                TableSegmentPoint.segment_id == segid).order_by(
+                TableSegmentPoint.id)
+        return [dict(waypoint_id=e.waypoint.id, segment_id=segid,
+                     point_id=e.point.id, kind=e.kind, time=e.time,
+                     distance=e.distance)
+                for e in index.sweep(points.yield_per(1000))]
@@ -0,0 +1,137 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from sqlalchemy import and_, or_
+
+from backend.sqlite import TableSegmentFingerprint, TableFingerprintBand, \
+                           TableTrackSegment, TableSegmentPoint
+from processing.similarity import route_cells, minhash, similarity, \
+                                  combine_signatures, band_buckets, \
+                                  pack_signature, unpack_signature, \
+                                  hausdorff, frechet
+from processing.simplify import simplify_points
+
+HAUSDORFF = 'hausdorff'
+FRECHET = 'frechet'
+#Candidates are simplified to this tolerance (metres) before refinement
+REFINE_TOLERANCE = 20
+#Segments with fewer points aren't routes, and aren't fingerprinted
+MIN_POINTS = 2
+#Bound variables per query (track ids, or band/bucket pairs at two each),
+#under SQLite's limit of 999
+QUERY_BATCH = 500
+
+
+class SimilarityStore:
+    """Fingerprint stored segments and find tracks that follow the same
+       route. Fingerprints are stored per segment and combined into one per
+       track when comparing, so tracks are always compared as a whole.
+       Candidates come from the indexed LSH band buckets, so a query only
+       reads the fingerprints of tracks that share a bucket with it; an
+       exact Hausdorff or Frechet distance can then be computed for those
+       only."""
+    def __init__(self, session):
+        self.session = session
+
+    def create_rows(self, segid, trkid, points):
+        """Get the fingerprint and band rows for a segment, or none for a
+           segment too short to be a route."""
+        if len(points) < MIN_POINTS:
+            return []
+        cells = route_cells(points)
+        signature = minhash(cells)
+        f = TableSegmentFingerprint()
+        f.segment_id = segid
+        f.track_id = trkid
+        f.num_cells = len(cells)
+        f.signature = pack_signature(signature)
+        rows = [f]
+        for band, bucket in band_buckets(signature):
+            b = TableFingerprintBand()
+            b.segment_id = segid
+            b.track_id = trkid
+            b.band = band
+            b.bucket = bucket
+            rows.append(b)
+        return rows
+
+    def rebuild(self, batch_size=100):
+        """Fingerprint every stored segment again."""
+        self.session.query(TableFingerprintBand).delete(
+                synchronize_session=False)
+        self.session.query(TableSegmentFingerprint).delete(
+                synchronize_session=False)
+        segments = self.session.query(TableTrackSegment.id,
+                TableTrackSegment.track_id).order_by(
+                TableTrackSegment.id).all()
+        for i, (segid, trkid) in enumerate(segments):
+            for row in self.create_rows(segid, trkid, self.load_points(segid)):
+                self.session.add(row)
+            if (i + 1) % batch_size == 0:
+                self.session.commit()
+        self.session.commit()
+
+    def load_points(self, segid):
+        """Load the coordinates of a stored segment."""
+        return self.session.query(TableSegmentPoint.lat,
+                TableSegmentPoint.lon).filter(
+                TableSegmentPoint.segment_id == segid).order_by(
+                TableSegmentPoint.id).all()
+
+    def similar_tracks(self, track, limit=10, min_similarity=0.2,
+                       refine=None, exclude_track_id=None):
+        """Get the stored tracks most similar to a Track, as a list of
+           (track_id, similarity, distance) with the estimated Jaccard
+           similarity of the visited cells. With refine set to HAUSDORFF or
+           FRECHET the candidates are ranked by that distance in metres
+           instead; otherwise distance is None."""
+        points = [p for s in track.segments for p in s.points]
+        signatures = [minhash(route_cells(s.points)) for s in track.segments
+                      if len(s.points) >= MIN_POINTS]
+        signature = combine_signatures(signatures)
+        if signature is None:
+            return []
+        buckets = set()
+        for sig in signatures:
+            buckets.update(band_buckets(sig))
+        buckets = sorted(buckets)
+        b = TableFingerprintBand
+        trkids = set()
+        step = QUERY_BATCH // 2
+        for i in range(0, len(buckets), step):
+            q = self.session.query(b.track_id).filter(or_(*[
+                    and_(b.band == band, b.bucket == bucket)
+                    for band, bucket in buckets[i:i + step]])).distinct()
+            trkids.update(t for (t,) in q)
+        trkids.discard(exclude_track_id)
+        trkids = sorted(trkids)
+        stored = {}
+        f = TableSegmentFingerprint
+        for i in range(0, len(trkids), QUERY_BATCH):
+            for trkid, data in self.session.query(f.track_id,
+                    f.signature).filter(
+                    f.track_id.in_(trkids[i:i + QUERY_BATCH])):
+                stored.setdefault(trkid, []).append(unpack_signature(data))
+        scores = {}
+        for trkid, sigs in stored.items():
+            score = similarity(signature, combine_signatures(sigs))
+            if score >= min_similarity:
+                scores[trkid] = score
+        results = sorted(scores.items(), key=lambda r: -r[1])[:limit]
+        if refine is None:
+            return [(trkid, score, None) for trkid, score in results]
+        measure = {HAUSDORFF: hausdorff, FRECHET: frechet}[refine]
+        query = simplify_points(points, REFINE_TOLERANCE)
+        refined = []
+        for trkid, score in results:
+            other = []
+            for (segid,) in self.session.query(TableTrackSegment.id).filter(
+                    TableTrackSegment.track_id == trkid).order_by(
+                    TableTrackSegment.id):
+                other.extend(self.load_points(segid))
+            other = simplify_points(other, REFINE_TOLERANCE)
+            refined.append((trkid, score, measure(query, other)))
+        refined.sort(key=lambda r: r[2])
+        return refined
@@ -3,7 +3,8 @@
 @license: MIT
 '''
 
-from sqlalchemy import Column, Integer, String, Date, Boolean, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, Boolean, Float, ForeignKey, \
+                       LargeBinary, Index, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 
@@ -60,6 +61,18 @@ class TableGpxxDisplayColor(Base):
         return "GPXX_DISPLAYCOLOR - id: %s, value: %s" % (self.id, self.value)
 
 
+class TableString(Base):
+    """Table for storing the dictionary of repeated text values (sym, type,
+       links...) that other tables refer to by id (see backend.strings)"""
+    __tablename__ = 'strings'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String, unique=True)
+
+    def __repr__(self):
+        return "STRING - id: %s, value: %s" % (self.id, self.value)
+
+
 class TableDevice(Base):
     """Table for storing GPS Device info"""
     __tablename__ = 'devices'
@@ -91,6 +104,7 @@ class TableTrack(Base):
     link_type = Column(String)
     number = Column(Integer)
     type = Column(String)
+    type_id = Column(Integer, ForeignKey("strings.id"))
     gpxx_displaycolor_id = Column(Integer, ForeignKey("gpxx_displaycolors.id"))
     device = relationship("TableGpx", backref=backref("tracks"))
     displaycolor = relationship("TableGpxxDisplayColor")
@@ -111,12 +125,135 @@ class TableTrackSegment(Base):
         return "SEGMENT - id: %s, time: %s" % (self.id,  self.time)
 
 
+class TableTrackSummary(Base):
+    """Table for storing precomputed track totals (see processing.summary).
+       gpx_id and device_id are copied from gpxs so trip lists don't need
+       to join through it."""
+    __tablename__ = 'track_summaries'
+    __table_args__ = (
+        Index('ix_track_summaries_device_time', 'device_id', 'start_time'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    track_id = Column(Integer,  ForeignKey("tracks.id"), unique=True)
+    gpx_id = Column(Integer,  ForeignKey("gpxs.id"))
+    device_id = Column(Integer,  ForeignKey("devices.id"))
+    num_segments = Column(Integer)
+    num_points = Column(Integer)
+    length2d = Column(Float)
+    length3d = Column(Float)
+    start_time = Column(Float, index=True)
+    end_time = Column(Float)
+    elapsed_time = Column(Float)
+    start_lat = Column(Float)
+    start_lon = Column(Float)
+    end_lat = Column(Float)
+    end_lon = Column(Float)
+    minlat = Column(Float)
+    minlon = Column(Float)
+    maxlat = Column(Float)
+    maxlon = Column(Float)
+    minele = Column(Float)
+    maxele = Column(Float)
+    moving_time = Column(Float)
+    max_speed = Column(Float)
+    ascent = Column(Float)
+    descent = Column(Float)
+    min_grade = Column(Float)
+    max_grade = Column(Float)
+    track = relationship("TableTrack",
+                         backref=backref("summary", uselist=False))
+
+    def __repr__(self):
+        return "TRACK_SUMMARY - track: %s, points: %s, length: %s" % (
+                    self.track_id,  self.num_points,  self.length2d)
+
+
+class TableSegmentSummary(Base):
+    """Table for storing precomputed track segment totals"""
+    __tablename__ = 'segment_summaries'
+
+    id = Column(Integer, primary_key=True)
+    segment_id = Column(Integer,  ForeignKey("track_segments.id"),
+                        unique=True)
+    track_id = Column(Integer,  ForeignKey("tracks.id"), index=True)
+    num_points = Column(Integer)
+    length2d = Column(Float)
+    length3d = Column(Float)
+    start_time = Column(Float)
+    end_time = Column(Float)
+    elapsed_time = Column(Float)
+    start_lat = Column(Float)
+    start_lon = Column(Float)
+    end_lat = Column(Float)
+    end_lon = Column(Float)
+    minlat = Column(Float)
+    minlon = Column(Float)
+    maxlat = Column(Float)
+    maxlon = Column(Float)
+    minele = Column(Float)
+    maxele = Column(Float)
+    moving_time = Column(Float)
+    max_speed = Column(Float)
+    ascent = Column(Float)
+    descent = Column(Float)
+    min_grade = Column(Float)
+    max_grade = Column(Float)
+    segment = relationship("TableTrackSegment",
+                           backref=backref("summary", uselist=False))
+
+    def __repr__(self):
+        return "SEGMENT_SUMMARY - segment: %s, points: %s, length: %s" % (
+                    self.segment_id,  self.num_points,  self.length2d)
+
+
+class TableSegmentSimplification(Base):
+    """Table for storing simplified copies of track segments. Rows with a
+       level make up the segment's LOD pyramid (see processing.lod)."""
+    __tablename__ = 'segment_simplifications'
+    __table_args__ = (
+        Index('ix_segment_simplifications_lod', 'level', 'maxlat', 'minlat',
+              'maxlon', 'minlon', 'extent'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    segment_id = Column(Integer,  ForeignKey("track_segments.id"), index=True)
+    level = Column(Integer)
+    tolerance = Column(Float)
+    num_points = Column(Integer)
+    minlat = Column(Float)
+    minlon = Column(Float)
+    maxlat = Column(Float)
+    maxlon = Column(Float)
+    #Larger side of the bounding box in metres
+    extent = Column(Float)
+    #Packed arrays of doubles, see processing.geo.pack_doubles
+    lats = Column(LargeBinary)
+    lons = Column(LargeBinary)
+    segment = relationship("TableTrackSegment",
+                           backref=backref("simplifications"))
+
+    def __repr__(self):
+        return "SIMPLIFICATION - id: %s, tolerance: %s, points: %s" % (
+                    self.id,  self.tolerance,  self.num_points)
+
+
 class TableSegmentPoint(Base):
-    """Table for storing segment points data"""
+    """Table for storing segment points data. timestamp (epoch seconds) and
+       device_id are copies of time and gpxs.device_id for the indexed
+       queries in backend.points; the device index covers the columns those
+       queries return. The *_id columns of repeated text fields refer to
+       strings; the text columns are only filled by older versions."""
     __tablename__ = 'segment_points'
+    __table_args__ = (
+        Index('ix_segment_points_device_time', 'device_id', 'timestamp',
+              'id', 'lat', 'lon', 'ele', 'segment_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     segment_id = Column(Integer,  ForeignKey("track_segments.id"))
+    device_id = Column(Integer)
+    timestamp = Column(Float, index=True)
     lat = Column(String)
     lon = Column(String)
     ele = Column(String)
@@ -129,8 +266,13 @@ class TableSegmentPoint(Base):
     link_href = Column(String)
     link_text = Column(String)
     link_type = Column(String)
+    link_href_id = Column(Integer, ForeignKey("strings.id"))
+    link_text_id = Column(Integer, ForeignKey("strings.id"))
+    link_type_id = Column(Integer, ForeignKey("strings.id"))
     sym = Column(String)
     type = Column(String)
+    sym_id = Column(Integer, ForeignKey("strings.id"))
+    type_id = Column(Integer, ForeignKey("strings.id"))
     fix_id = Column(Integer, ForeignKey("fixes.id"))
     sat = Column(Integer)
     hdop = Column(String)
@@ -149,7 +291,8 @@ class TableSegmentPoint(Base):
 
 
 class TableWaypoint(Base):
-    """Table for storing waypoints data"""
+    """Table for storing waypoints data. As for segment points, repeated
+       text fields are stored as ids of strings rows."""
     __tablename__ = 'waypoints'
 
     id = Column(Integer, primary_key=True)
@@ -166,8 +309,13 @@ class TableWaypoint(Base):
     link_href = Column(String)
     link_text = Column(String)
     link_type = Column(String)
+    link_href_id = Column(Integer, ForeignKey("strings.id"))
+    link_text_id = Column(Integer, ForeignKey("strings.id"))
+    link_type_id = Column(Integer, ForeignKey("strings.id"))
     sym = Column(String)
     type = Column(String)
+    sym_id = Column(Integer, ForeignKey("strings.id"))
+    type_id = Column(Integer, ForeignKey("strings.id"))
     fix_id = Column(Integer, ForeignKey("fixes.id"))
     sat = Column(Integer)
     hdop = Column(String)
@@ -180,6 +328,7 @@ class TableWaypoint(Base):
     gpxx_depth = Column(String)
     gpxx_displaymode_id = Column(Integer, ForeignKey("gpxx_displaymodes.id"))
     gpxx_categories = Column(String)
+    gpxx_categories_id = Column(Integer, ForeignKey("strings.id"))
     gpxx_address_streetaddress = Column(String)
     gpxx_address_city = Column(String)
     gpxx_address_state = Column(String)
@@ -196,6 +345,175 @@ class TableWaypoint(Base):
                     self.id,  self.time,  self.lat,  self.lon)
 
 
+class TableSegmentFingerprint(Base):
+    """Table for storing route fingerprints (see processing.similarity)"""
+    __tablename__ = 'segment_fingerprints'
+
+    id = Column(Integer, primary_key=True)
+    segment_id = Column(Integer,  ForeignKey("track_segments.id"),
+                        unique=True)
+    track_id = Column(Integer,  ForeignKey("tracks.id"), index=True)
+    num_cells = Column(Integer)
+    signature = Column(LargeBinary)
+    segment = relationship("TableTrackSegment",
+                           backref=backref("fingerprint", uselist=False))
+
+    def __repr__(self):
+        return "FINGERPRINT - segment: %s, cells: %s" % (
+                    self.segment_id,  self.num_cells)
+
+
+class TableFingerprintBand(Base):
+    """Table for storing the LSH band buckets of each fingerprint"""
+    __tablename__ = 'fingerprint_bands'
+    __table_args__ = (
+        Index('ix_fingerprint_bands_bucket', 'band', 'bucket'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    segment_id = Column(Integer,  ForeignKey("track_segments.id"),
+                        index=True)
+    track_id = Column(Integer,  ForeignKey("tracks.id"))
+    band = Column(Integer)
+    bucket = Column(Integer)
+
+    def __repr__(self):
+        return "BAND - segment: %s, band: %s, bucket: %s" % (
+                    self.segment_id,  self.band,  self.bucket)
+
+
+class TableHeatmapCell(Base):
+    """Table for storing point counts per heatmap grid cell (see
+       processing.heatmap)"""
+    __tablename__ = 'heatmap_cells'
+    __table_args__ = (
+        Index('ix_heatmap_cells_zoom_x_y', 'zoom', 'x', 'y', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    zoom = Column(Integer)
+    x = Column(Integer)
+    y = Column(Integer)
+    count = Column(Integer)
+    last_visit = Column(String)
+
+    def __repr__(self):
+        return "HEATMAP - zoom: %s, x/y: %s/%s, count: %s" % (
+                    self.zoom,  self.x,  self.y,  self.count)
+
+
+class TableProximityEvent(Base):
+    """Table for storing when tracks entered/left waypoint proximity radii"""
+    __tablename__ = 'proximity_events'
+
+    id = Column(Integer, primary_key=True)
+    waypoint_id = Column(Integer,  ForeignKey("waypoints.id"), index=True)
+    segment_id = Column(Integer,  ForeignKey("track_segments.id"),
+                        index=True)
+    point_id = Column(Integer,  ForeignKey("segment_points.id"))
+    kind = Column(String)
+    time = Column(String)
+    distance = Column(Float)
+    waypoint = relationship("TableWaypoint")
+    segment = relationship("TableTrackSegment")
+
+    def __repr__(self):
+        return "PROXIMITY - waypoint: %s, %s, time: %s" % (
+                    self.waypoint_id,  self.kind,  self.time)
+
+
+class TableImportedFile(Base):
+    """Table for storing the content hashes of imported files"""
+    __tablename__ = 'imported_files'
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String)
+    sha1 = Column(String, index=True)
+    size = Column(Integer)
+    imported = Column(String)
+
+    def __repr__(self):
+        return "IMPORTED_FILE - id: %s, path: %s, sha1: %s" % (
+                    self.id,  self.path,  self.sha1)
+
+
+class TableSegmentDigest(Base):
+    """Table for storing segment digests used to skip duplicate segments
+       (see processing.dedup)"""
+    __tablename__ = 'segment_digests'
+    __table_args__ = (
+        Index('ix_segment_digests_lookup', 'first_time', 'num_points',
+              'coord_hash'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    segment_id = Column(Integer,  ForeignKey("track_segments.id"),
+                        unique=True)
+    num_points = Column(Integer)
+    first_time = Column(Float)
+    last_time = Column(Float)
+    first_lat = Column(Float)
+    first_lon = Column(Float)
+    last_lat = Column(Float)
+    last_lon = Column(Float)
+    coord_hash = Column(Integer)
+
+    def __repr__(self):
+        return "DIGEST - segment: %s, points: %s, hash: %s" % (
+                    self.segment_id,  self.num_points,  self.coord_hash)
+
+
+class TableImportJournal(Base):
+    """Table for storing the progress of each file in an import batch. For
+       a member of a zip archive, path is archive/member (see
+       parsers.compressed.member_path)."""
+    __tablename__ = 'import_journal'
+    __table_args__ = (
+        Index('ix_import_journal_batch_path', 'batch', 'path', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    batch = Column(String)
+    path = Column(String)
+    member = Column(String)
+    device_id = Column(Integer,  ForeignKey("devices.id"))
+    sha1 = Column(String)
+    state = Column(String)
+    gpx_id = Column(Integer,  ForeignKey("gpxs.id"))
+    num_segments = Column(Integer)
+    segments_done = Column(Integer)
+    updated = Column(String)
+    error = Column(String)
+
+    def __repr__(self):
+        return "JOURNAL - id: %s, path: %s, state: %s, segments: %s/%s" % (
+                    self.id,  self.path,  self.state,  self.segments_done,
+                    self.num_segments)
+
+
+class TableImportJournalSegment(Base):
+    """Table for storing the segments an import journal entry has saved"""
+    __tablename__ = 'import_journal_segments'
+    __table_args__ = (
+        Index('ix_import_journal_segments_position', 'journal_id',
+              'track_index', 'segment_index', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    journal_id = Column(Integer,  ForeignKey("import_journal.id"))
+    track_index = Column(Integer)
+    segment_index = Column(Integer)
+    track_id = Column(Integer,  ForeignKey("tracks.id"))
+    segment_id = Column(Integer,  ForeignKey("track_segments.id"))
+    num_points = Column(Integer)
+    checksum = Column(Integer)
+    journal = relationship("TableImportJournal",  backref=backref("segments"))
+
+    def __repr__(self):
+        return "JOURNAL_SEGMENT - journal: %s, track/segment: %s/%s" % (
+                    self.journal_id,  self.track_index,  self.segment_index)
+
+
 class TableGpx(Base):
     """Table for storing GPX data"""
     __tablename__ = 'gpxs'
@@ -217,7 +535,7 @@ class TableGpx(Base):
     link_href = Column(String)
     link_text = Column(String)
     link_type = Column(String)
-    time = Column(Date)
+    time = Column(String)
     keywords = Column(String)
     bounds_minlat = Column(String)
     bounds_minlon = Column(String)
@@ -227,3 +545,21 @@ class TableGpx(Base):
 
     def __repr__(self):
         return "GPX - id: %s, name: %s" % (self.id,  self.name)
+
+
+def create_tables(engine):
+    """Create any tables missing from the database, and add the columns and
+       indexes missing from tables created by older versions."""
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = set(c['name'] for c in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in columns:
+                engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    table.name, column.name,
+                    column.type.compile(dialect=engine.dialect)))
+        indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
@@ -0,0 +1,97 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from backend.sqlite import TableString, TableSegmentPoint, TableWaypoint, \
+                           TableTrack
+
+#Text columns stored as ids of strings rows: (table, text column, id column)
+ENCODED_COLUMNS = (
+    (TableSegmentPoint, 'sym', 'sym_id'),
+    (TableSegmentPoint, 'type', 'type_id'),
+    (TableSegmentPoint, 'link_href', 'link_href_id'),
+    (TableSegmentPoint, 'link_text', 'link_text_id'),
+    (TableSegmentPoint, 'link_type', 'link_type_id'),
+    (TableWaypoint, 'sym', 'sym_id'),
+    (TableWaypoint, 'type', 'type_id'),
+    (TableWaypoint, 'link_href', 'link_href_id'),
+    (TableWaypoint, 'link_text', 'link_text_id'),
+    (TableWaypoint, 'link_type', 'link_type_id'),
+    (TableWaypoint, 'gpxx_categories', 'gpxx_categories_id'),
+    (TableTrack, 'type', 'type_id'),
+)
+
+
+class StringDictionary:
+    """Map repeated text values to the ids of rows of a dictionary table,
+       adding rows for new values. table is any table with id and value
+       columns: strings, or one of the lookup tables like fixes and
+       gpxx_displaycolors. Ids are cached, so call clear() after a
+       rollback."""
+    def __init__(self, session, table=TableString):
+        self.session = session
+        self.table = table
+        self.codes = {}
+        self.values = {}
+
+    def clear(self):
+        self.codes = {}
+        self.values = {}
+
+    def load(self):
+        """Read the whole table into the cache."""
+        for code, value in self.session.query(self.table.id,
+                                              self.table.value):
+            self.codes[value] = code
+            self.values[code] = value
+        return self
+
+    def encode(self, value):
+        """Get the id of a value, adding a row if it is new. None stays
+           None."""
+        if value is None:
+            return None
+        code = self.codes.get(value)
+        if code is None:
+            code = self.session.query(self.table.id).filter(
+                    self.table.value == value).scalar()
+            if code is None:
+                row = self.table()
+                row.value = value
+                self.session.add(row)
+                self.session.flush()
+                code = row.id
+            self.codes[value] = code
+            self.values[code] = value
+        return code
+
+    def decode(self, code, default=None):
+        """Get the value of an id, or default if code is None (such as for
+           a row written by an older version, with the text in its own
+           column)."""
+        if code is None:
+            return default
+        value = self.values.get(code)
+        if value is None:
+            value = self.session.query(self.table.value).filter(
+                    self.table.id == code).scalar()
+            self.codes[value] = code
+            self.values[code] = value
+        return value
+
+    def encode_stored(self):
+        """Move the text of rows written by older versions into strings,
+           replacing it with ids. Returns the number of values moved."""
+        moved = 0
+        for table, name, id_name in ENCODED_COLUMNS:
+            text = getattr(table, name)
+            values = [v for (v,) in self.session.query(text).filter(
+                      text != None).distinct()]
+            for value in values:
+                moved += self.session.query(table).filter(
+                    text == value).update({id_name: self.encode(value),
+                                           name: None},
+                    synchronize_session=False)
+        self.session.commit()
+        return moved
@@ -0,0 +1,118 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import threading
+
+from sqlalchemy import func
+
+from backend.sqlite import TableTrackSummary, TableSegmentSummary, \
+                           TableTrack, TableTrackSegment, TableSegmentPoint, \
+                           TableGpx
+from processing.metrics import SegmentMetrics
+from processing.summary import segment_summary, combine_summaries
+
+
+class SummaryStore:
+    """Maintain and query the track_summaries/segment_summaries tables"""
+    def __init__(self, session):
+        self.session = session
+
+    def create_segment_row(self, segid, trkid, summary):
+        s = TableSegmentSummary(**summary.as_dict())
+        s.segment_id = segid
+        s.track_id = trkid
+        return s
+
+    def create_track_row(self, trkid, gpxid, device_id, summary,
+                         num_segments):
+        t = TableTrackSummary(**summary.as_dict())
+        t.track_id = trkid
+        t.gpx_id = gpxid
+        t.device_id = device_id
+        t.num_segments = num_segments
+        return t
+
+    def rebuild(self, batch_size=50):
+        """Recompute the summaries of every stored track from its points,
+           committing after each batch of tracks."""
+        track_ids = [t for (t,) in self.session.query(TableTrack.id).order_by(
+                     TableTrack.id)]
+        for i in range(0, len(track_ids), batch_size):
+            for trkid in track_ids[i:i + batch_size]:
+                self.rebuild_track(trkid)
+            self.session.commit()
+
+    def rebuild_track(self, trkid):
+        """Recompute the summaries of one stored track."""
+        self.session.query(TableSegmentSummary).filter(
+                TableSegmentSummary.track_id == trkid).delete(
+                synchronize_session=False)
+        self.session.query(TableTrackSummary).filter(
+                TableTrackSummary.track_id == trkid).delete(
+                synchronize_session=False)
+        summaries = []
+        segids = self.session.query(TableTrackSegment.id).filter(
+                TableTrackSegment.track_id == trkid).order_by(
+                TableTrackSegment.id)
+        for (segid,) in segids:
+            points = self.session.query(TableSegmentPoint.lat,
+                    TableSegmentPoint.lon, TableSegmentPoint.ele,
+                    TableSegmentPoint.time).filter(
+                    TableSegmentPoint.segment_id == segid).order_by(
+                    TableSegmentPoint.id).all()
+            summary = segment_summary(SegmentMetrics(points))
+            self.session.add(self.create_segment_row(segid, trkid, summary))
+            summaries.append(summary)
+        gpxid, device_id = self.session.query(TableTrack.gpx_id,
+                TableGpx.device_id).join(TableGpx,
+                TableGpx.id == TableTrack.gpx_id).filter(
+                TableTrack.id == trkid).one()
+        self.session.add(self.create_track_row(trkid, gpxid, device_id,
+                combine_summaries(summaries), len(summaries)))
+
+    def trips(self, device_id=None, start_time=None, end_time=None,
+              limit=None):
+        """Get (TableTrackSummary, track name) pairs ordered by start time,
+           optionally limited to a device and a time range (epoch seconds)."""
+        q = self.session.query(TableTrackSummary, TableTrack.name).join(
+                TableTrack, TableTrack.id == TableTrackSummary.track_id)
+        q = self.__filter(q, device_id, start_time, end_time)
+        q = q.order_by(TableTrackSummary.start_time)
+        if limit:
+            q = q.limit(limit)
+        return q.all()
+
+    def totals(self, device_id=None, start_time=None, end_time=None):
+        """Get the number of trips and their total distance, elapsed time and
+           points, as a single aggregate query."""
+        t = TableTrackSummary
+        q = self.session.query(func.count(t.id), func.sum(t.length2d),
+                               func.sum(t.elapsed_time),
+                               func.sum(t.num_points))
+        return self.__filter(q, device_id, start_time, end_time).one()
+
+    def __filter(self, q, device_id, start_time, end_time):
+        if device_id is not None:
+            q = q.filter(TableTrackSummary.device_id == device_id)
+        if start_time is not None:
+            q = q.filter(TableTrackSummary.start_time >= start_time)
+        if end_time is not None:
+            q = q.filter(TableTrackSummary.start_time < end_time)
+        return q
+
+
+def start_rebuild(sessionmaker, batch_size=50):
+    """Rebuild all summaries on a background thread. The sessionmaker should
+       be a scoped_session so the thread gets its own session."""
+    def run():
+        session = sessionmaker()
+        try:
+            SummaryStore(session).rebuild(batch_size)
+        finally:
+            session.close()
+    thread = threading.Thread(target=run, name='summary-rebuild')
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,191 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from backend.sqlite import Base
+
+
+class WriteFailed(Exception):
+    """Raised by WriteTicket.wait when a batch could not be written"""
+    pass
+
+
+class WriteTicket:
+    """Acknowledgement for one batch given to a DbWriter. wait() returns
+       the batch's result once its commit group has been committed."""
+    def __init__(self, batch):
+        self.batch = batch
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            return None
+        if self.error is not None:
+            raise WriteFailed(self.error)
+        return self.result
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+
+class DbWriter:
+    """Owns the only write connection to the database. Batches from any
+       thread are queued and written in commit groups: the writer keeps
+       adding queued batches to the open transaction until it holds
+       max_rows rows or max_latency seconds have passed since the first,
+       then commits them together. Short, bounded transactions keep
+       readers from waiting long on the write lock.
+
+       A batch is either a list of (table, rows) with table a table name or
+       Table and rows a list of dicts to insert, or a callable taking the
+       connection (see GPXImporter.save_to). If a batch fails the group is
+       rolled back and written again without it, so callables must be safe
+       to run twice. submit blocks when max_pending batches are queued."""
+    def __init__(self, engine, max_rows=5000, max_latency=0.05,
+                 max_pending=64):
+        self.engine = engine
+        self.max_rows = max_rows
+        self.max_latency = max_latency
+        self.queue = queue.Queue(max_pending)
+        self.stats = {'batches': 0, 'rows': 0, 'commits': 0, 'failed': 0}
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, batch, callback=None):
+        """Queue a batch, returning its WriteTicket. callback(ticket) is
+           called on the writer thread once the batch is done."""
+        ticket = WriteTicket(batch)
+        self.queue.put((ticket, callback))
+        return ticket
+
+    def insert(self, table, rows, callback=None):
+        """Queue inserts into one table."""
+        return self.submit([(table, rows)], callback)
+
+    def call(self, function, callback=None):
+        """Queue a function to run with the connection."""
+        return self.submit(function, callback)
+
+    def listen(self, source, replies=None):
+        """Forward (batch id, batch) items from a multiprocessing.Queue,
+           putting (batch id, error or None) on replies once each is
+           written. Table batches only, callables can't be pickled. A None
+           item ends the listener."""
+        def forward():
+            while True:
+                item = source.get()
+                if item is None:
+                    break
+                batch_id, batch = item
+                callback = None
+                if replies is not None:
+                    callback = (lambda ticket, batch_id=batch_id:
+                                replies.put((batch_id, ticket.error)))
+                self.submit(batch, callback)
+        t = threading.Thread(target=forward)
+        t.daemon = True
+        t.start()
+        return t
+
+    def close(self):
+        """Write everything queued so far and stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def __run(self):
+        connection = self.engine.connect()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                group = [item]
+                rows = count_rows(item[0].batch)
+                deadline = time.time() + self.max_latency
+                closing = False
+                while rows < self.max_rows:
+                    wait = deadline - time.time()
+                    try:
+                        item = self.queue.get(wait > 0, max(wait, 0))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        closing = True
+                        break
+                    group.append(item)
+                    rows += count_rows(item[0].batch)
+                self.__write_group(connection, group)
+                if closing:
+                    break
+        finally:
+            connection.close()
+
+    def __write_group(self, connection, group):
+        """Write and commit a group, leaving out batches that fail."""
+        while group:
+            results = []
+            trans = connection.begin()
+            try:
+                for ticket, callback in group:
+                    results.append(run_batch(connection, ticket.batch))
+            except Exception:
+                trans.rollback()
+                ticket, callback = group[len(results)]
+                self.__finish(ticket, callback, None, traceback.format_exc())
+                group = group[:len(results)] + group[len(results) + 1:]
+                continue
+            try:
+                trans.commit()
+            except Exception:
+                error = traceback.format_exc()
+                for ticket, callback in group:
+                    self.__finish(ticket, callback, None, error)
+                return
+            self.stats['commits'] += 1
+            for (ticket, callback), result in zip(group, results):
+                self.stats['rows'] += count_rows(ticket.batch)
+                self.__finish(ticket, callback, result)
+            return
+
+    def __finish(self, ticket, callback, result, error=None):
+        if error is None:
+            self.stats['batches'] += 1
+        else:
+            self.stats['failed'] += 1
+        ticket.finish(result, error)
+        if callback is not None:
+            callback(ticket)
+
+
+def count_rows(batch):
+    """Get the number of rows a batch inserts; a callable counts as one."""
+    if callable(batch):
+        return 1
+    return sum(len(rows) for table, rows in batch)
+
+
+def run_batch(connection, batch):
+    """Write one batch with the connection."""
+    if callable(batch):
+        return batch(connection)
+    for table, rows in batch:
+        if not hasattr(table, 'insert'):
+            table = Base.metadata.tables[table]
+        if rows:
+            connection.execute(table.insert(), rows)
+    return None
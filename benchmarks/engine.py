@@ -0,0 +1,132 @@
+'''
+@author: Zack Townsend
+@license: MIT
+
+Storage profile benchmark: imports a file into a fresh database with each
+profile, then times point and heatmap queries, serial and through a
+ReadPool. Run from the project root:
+    python -m benchmarks.engine [file.gpx] [imports]
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from backend.engine import create_engine, get_pragmas, ReadPool, \
+                           BULK_LOAD, INTERACTIVE, READ_ONLY
+from backend.heatmap import HeatmapStore
+from backend.points import PointQuery
+from backend.sqlite import create_tables
+from importers.gpx import GPXImporter
+from parsers.gpx import GpxXmlParser
+from processing.heatmap import cell_xy
+
+
+def import_file(path, file, profile, imports):
+    engine = create_engine(path, profile)
+    create_tables(engine)
+    Session = scoped_session(sessionmaker(bind=engine))
+    f = open(file)
+    gpx = GpxXmlParser(f).parse()
+    f.close()
+    start = time.time()
+    #Without dedup, or every import after the first would be skipped
+    for i in range(imports):
+        GPXImporter(gpx.clone(), Session, dedup=False).save_gpx(1)
+    secs = time.time() - start
+    Session.remove()
+    pragmas = get_pragmas(engine)
+    points = engine.execute('SELECT count(*) FROM segment_points').scalar()
+    engine.dispose()
+    return secs, points, pragmas
+
+
+def tile_keys(file):
+    f = open(file)
+    gpx = GpxXmlParser(f).parse()
+    f.close()
+    keys = set()
+    for t in gpx.tracks:
+        for s in t.segments:
+            for p in s.points[::50]:
+                x, y = cell_xy(float(p.lat), float(p.lon), 12)
+                keys.add((12, x // 64, y // 64))
+    return sorted(keys)
+
+
+def query_points(conn, device_id):
+    session = sessionmaker(bind=conn)()
+    total = 0
+    for batch in PointQuery(session).batches(device_id):
+        total += len(batch)
+    session.close()
+    return total
+
+
+def query_scan(conn, device_id):
+    return conn.execute('SELECT count(*), avg(CAST(ele AS REAL)) '
+                        'FROM segment_points WHERE device_id = ?',
+                        device_id).fetchone()
+
+
+def query_tile(conn, key):
+    session = sessionmaker(bind=conn)()
+    counts = HeatmapStore(session).tile(*key)
+    session.close()
+    return sum(counts)
+
+
+def run_queries(path, profile, tiles):
+    pool = ReadPool(path, 4, profile and READ_ONLY)
+    results = []
+    start = time.time()
+    for key in tiles:
+        pool.execute(query_tile, key)
+    results.append(('tiles serial', time.time() - start))
+    start = time.time()
+    pool.map(query_tile, tiles)
+    results.append(('tiles pool(4)', time.time() - start))
+    start = time.time()
+    for i in range(4):
+        pool.execute(query_points, 1)
+    results.append(('points serial x4', time.time() - start))
+    start = time.time()
+    pool.map(query_points, [1] * 4)
+    results.append(('points pool(4) x4', time.time() - start))
+    start = time.time()
+    for i in range(16):
+        pool.execute(query_scan, 1)
+    results.append(('scan serial x16', time.time() - start))
+    start = time.time()
+    pool.map(query_scan, [1] * 16)
+    results.append(('scan pool(4) x16', time.time() - start))
+    pool.dispose()
+    return results
+
+
+def main(file, imports):
+    tiles = tile_keys(file)
+    print('%s, %d imports, %d heatmap tiles' % (file, imports, len(tiles)))
+    directory = tempfile.mkdtemp()
+    try:
+        #None is plain SQLite defaults, for comparison
+        for profile in (None, BULK_LOAD, INTERACTIVE):
+            label = profile or 'default'
+            path = os.path.join(directory, label + '.db')
+            secs, points, pragmas = import_file(path, file, profile, imports)
+            print('%-12s import %8.1f ms %7d points  %s' % (label,
+                    secs * 1000, points,
+                    ' '.join('%s=%s' % p for p in sorted(pragmas.items()))))
+            for name, secs in run_queries(path, profile, tiles):
+                print('%-12s %-18s %8.1f ms' % ('', name, secs * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'Current.gpx',
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2)
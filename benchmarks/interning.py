@@ -0,0 +1,107 @@
+'''
+@author: Zack Townsend
+@license: MIT
+
+String interning benchmark: the memory taken by the strings of a parsed
+file with and without interning, and the database size with the repeated
+text fields stored as strings ids and as text. Run from the project root:
+    python -m benchmarks.interning [file.gpx]
+'''
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from backend.engine import create_engine, BULK_LOAD
+from backend.sqlite import create_tables
+from backend.strings import ENCODED_COLUMNS
+from importers.gpx import GPXImporter
+from parsers.gpx import GpxXmlParser
+
+
+def parse(file, intern):
+    f = open(file)
+    gpx = GpxXmlParser(f, intern=intern).parse()
+    f.close()
+    return gpx
+
+
+def string_fields(obj):
+    """Yield the string attributes of a point, track or link."""
+    for value in obj.__dict__.values():
+        if isinstance(value, (type(''), type(u''))):
+            yield value
+        elif hasattr(value, '__dict__') and not isinstance(value, list):
+            for v in string_fields(value):
+                yield v
+
+
+def string_memory(gpx):
+    """Get the number of string objects held by the points, waypoints and
+       tracks of a Gpx, and their total size in bytes."""
+    objects = [gpx, gpx.link] + gpx.waypoints
+    for t in gpx.tracks:
+        objects.append(t)
+        for s in t.segments:
+            objects.extend(s.points)
+    seen = {}
+    for obj in objects:
+        for value in string_fields(obj):
+            seen[id(value)] = value
+    return len(seen), sum(sys.getsizeof(v) for v in seen.values())
+
+
+def decode_columns(path):
+    """Turn a database back into the old layout, with the text of every
+       encoded field in its own column."""
+    conn = sqlite3.connect(path)
+    for table, name, id_name in ENCODED_COLUMNS:
+        conn.execute('UPDATE %s SET %s = (SELECT value FROM strings '
+                     'WHERE id = %s), %s = NULL WHERE %s IS NOT NULL' % (
+                         table.__tablename__, name, id_name, id_name,
+                         id_name))
+    conn.execute('DELETE FROM strings')
+    conn.commit()
+    conn.close()
+
+
+def vacuumed_size(path):
+    conn = sqlite3.connect(path)
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(path)
+
+
+def main(file):
+    print(file)
+    for intern in (False, True):
+        count, size = string_memory(parse(file, intern))
+        print('%-14s %8d strings %10d bytes' % (
+                'interned' if intern else 'not interned', count, size))
+    directory = tempfile.mkdtemp()
+    try:
+        encoded = os.path.join(directory, 'encoded.db')
+        engine = create_engine(encoded, BULK_LOAD)
+        create_tables(engine)
+        Session = scoped_session(sessionmaker(bind=engine))
+        GPXImporter(parse(file, True), Session).save_gpx(1)
+        values = engine.execute('SELECT count(*) FROM strings').scalar()
+        Session.remove()
+        engine.dispose()
+        text = os.path.join(directory, 'text.db')
+        shutil.copy(encoded, text)
+        decode_columns(text)
+        print('%-14s %8d values  %10d bytes' % ('strings ids', values,
+                                                vacuumed_size(encoded)))
+        print('%-14s %8s         %10d bytes' % ('text columns', '',
+                                                vacuumed_size(text)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'Current.gpx')
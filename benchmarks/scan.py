@@ -0,0 +1,36 @@
+'''
+@author: Zack Townsend
+@license: MIT
+
+Fast-path scanner benchmark: times GpxXmlParser and GpxScanParser on the
+same files. That both give the same result is checked by
+tests/test_gpx_scan.py. Run from the project root:
+    python -m benchmarks.scan [file.gpx ...]
+'''
+
+import sys
+import time
+
+from parsers.gpx import GpxXmlParser
+from parsers.gpx_scan import GpxScanParser
+
+
+def run(file):
+    start = time.time()
+    f = open(file, 'rb')
+    expected = GpxXmlParser(f).parse()
+    f.close()
+    xml_secs = time.time() - start
+    start = time.time()
+    parser = GpxScanParser(file)
+    parser.parse()
+    scan_secs = time.time() - start
+    print('%s: %d points, %d/%d segments scanned, xml %.3f s, scan %.3f s'
+          % (file, expected.get_num_points(), parser.fast_segments,
+             parser.fast_segments + parser.slow_segments, xml_secs,
+             scan_secs))
+
+
+if __name__ == '__main__':
+    for f in sys.argv[1:] or ['Current.gpx', 'test']:
+        run(f)
@@ -0,0 +1,53 @@
+'''
+@author: Zack Townsend
+@license: MIT
+
+Simplification benchmark. Run from the project root:
+    python -m benchmarks.simplify [file.gpx]
+'''
+
+import sys
+import time
+
+from parsers.gpx import GpxXmlParser
+from processing.simplify import simplify_points, stream_simplify, \
+                                DOUGLAS_PEUCKER, VISVALINGAM
+
+
+def load_segments(file):
+    f = open(file)
+    gpx = GpxXmlParser(f).parse()
+    f.close()
+    return [s.points for t in gpx.tracks for s in t.segments]
+
+
+def run(label, segments, func):
+    start = time.time()
+    kept = 0
+    for points in segments:
+        kept += len(func(points))
+    return label, kept, time.time() - start
+
+
+def main(file):
+    segments = load_segments(file)
+    total = sum(len(points) for points in segments)
+    print('%s: %d segments, %d points' % (file, len(segments), total))
+    results = []
+    for tol in (1, 5, 10, 25):
+        results.append(run('douglas-peucker %dm' % tol, segments,
+                lambda p: simplify_points(p, tol, method=DOUGLAS_PEUCKER)))
+        results.append(run('visvalingam %dm' % tol, segments,
+                lambda p: simplify_points(p, tol, method=VISVALINGAM)))
+        results.append(run('stream %dm' % tol, segments,
+                lambda p: list(stream_simplify(p, tol, chunk_size=256))))
+    for count in (10, 50):
+        results.append(run('visvalingam %d points' % count, segments,
+                lambda p: simplify_points(p, count=count)))
+    for label, kept, secs in results:
+        print('%-26s %7d points (%5.1f%%) %8.1f ms' % (
+                label, kept, 100.0 * kept / total, secs * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'Current.gpx')
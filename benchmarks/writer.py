@@ -0,0 +1,105 @@
+'''
+@author: Zack Townsend
+@license: MIT
+
+Single-writer check: imports a file by path into fresh databases directly,
+through a DbWriter, and through a DbWriter whose commit group is rolled
+back by a failing batch (so the import is written a second time), and
+compares the rows of every table. Exits with status 1 if they differ. Run
+from the project root:
+    python -m benchmarks.writer [file.gpx]
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from backend.engine import create_engine
+from backend.sqlite import Base, create_tables
+from backend.writer import DbWriter, WriteFailed
+from importers.gpx import GPXImporter
+
+
+def fail(connection):
+    raise ValueError('batch failed on purpose')
+
+
+def direct(engine, Session, file):
+    GPXImporter(file, Session).save_gpx(1)
+
+
+def through_writer(engine, Session, file):
+    writer = DbWriter(engine)
+    try:
+        GPXImporter(file, Session).save_to(writer, 1).wait()
+    finally:
+        writer.close()
+
+
+def with_retry(engine, Session, file):
+    #A long max_latency puts both batches in one commit group
+    writer = DbWriter(engine, max_latency=1.0)
+    try:
+        ticket = GPXImporter(file, Session).save_to(writer, 1)
+        failed = writer.call(fail)
+        ticket.wait()
+        try:
+            failed.wait()
+        except WriteFailed:
+            pass
+    finally:
+        writer.close()
+    return writer.stats
+
+
+def row_counts(engine):
+    conn = engine.connect()
+    try:
+        return dict((t.name, conn.execute('SELECT count(*) FROM %s' %
+                                          t.name).scalar())
+                    for t in Base.metadata.sorted_tables)
+    finally:
+        conn.close()
+
+
+def run(directory, file, label, method):
+    path = os.path.join(directory, label + '.db')
+    engine = create_engine(path)
+    create_tables(engine)
+    Session = scoped_session(sessionmaker(bind=engine))
+    start = time.time()
+    result = method(engine, Session, file)
+    secs = time.time() - start
+    Session.remove()
+    counts = row_counts(engine)
+    engine.dispose()
+    print('%-12s %8.1f ms %8d rows%s' % (label, secs * 1000,
+            sum(counts.values()), '  %s' % result if result else ''))
+    return counts
+
+
+def main(file):
+    directory = tempfile.mkdtemp()
+    try:
+        expected = run(directory, file, 'direct', direct)
+        ok = True
+        for label, method in (('writer', through_writer),
+                              ('retried', with_retry)):
+            counts = run(directory, file, label, method)
+            for name in sorted(expected):
+                if counts[name] != expected[name]:
+                    print('    %s: %d rows != %d' % (name, counts[name],
+                                                    expected[name]))
+                    ok = False
+    finally:
+        shutil.rmtree(directory)
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(sys.argv[1] if len(sys.argv) > 1
+                       else 'Current.gpx') else 1)
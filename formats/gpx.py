@@ -3,9 +3,104 @@
 @license: MIT
 '''
 
-from copy import deepcopy
+from copy import copy
 import math
 
+from processing.metrics import SegmentMetrics, combine
+from processing.summary import segment_summary, combine_summaries
+
+
+class SharedList(list):
+    """List of points or waypoints given to a clone, holding the same point
+       objects as the list it was made from. Each item is replaced with a
+       clone of it the first time it is read, and all of them are on the
+       first change to the list (setting, adding, removing or reordering
+       items). So a clone costs nothing per point until it is used, and
+       points read from it can be edited in place without changing the
+       original. The list it was made from is left as it is: points edited
+       in place there are also seen by clones that have not read them yet.
+       Pickled and copied as a plain list."""
+    def __init__(self, items=()):
+        list.__init__(self, items)
+        self.shared = True
+        #ids of the items that are already this list's own clones
+        self.owned = set()
+
+    def own(self):
+        """Replace the shared items with clones, if not done already."""
+        if self.shared:
+            owned = self.owned
+            list.__setitem__(self, slice(None, None),
+                             [item if id(item) in owned else item.clone()
+                              for item in list.__iter__(self)])
+            self.shared = False
+            self.owned = set()
+        return self
+
+    def __getitem__(self, index):
+        if not self.shared:
+            return list.__getitem__(self, index)
+        if isinstance(index, slice):
+            for i in range(*index.indices(len(self))):
+                self.__own_item(i)
+        else:
+            self.__own_item(index)
+        return list.__getitem__(self, index)
+
+    def __getslice__(self, i, j):
+        return self.__getitem__(slice(i, j))
+
+    def __iter__(self):
+        i = 0
+        while i < len(self):
+            yield self[i]
+            i += 1
+
+    def __reversed__(self):
+        i = len(self) - 1
+        while i >= 0:
+            yield self[i]
+            i -= 1
+
+    def __own_item(self, index):
+        """Replace one shared item with a clone, if not done already."""
+        item = list.__getitem__(self, index)
+        if id(item) not in self.owned:
+            item = item.clone()
+            list.__setitem__(self, index, item)
+            self.owned.add(id(item))
+            if len(self.owned) == len(self):
+                self.shared = False
+                self.owned = set()
+
+    def __add__(self, other):
+        return list.__add__(self[:], other)
+
+    def __mul__(self, n):
+        return list.__mul__(self[:], n)
+
+    __rmul__ = __mul__
+
+    def __reduce__(self):
+        return list, (self[:],)
+
+
+def _copy_on_write(name):
+    method = getattr(list, name)
+
+    def write(self, *args):
+        self.own()
+        return method(self, *args)
+    write.__name__ = name
+    return write
+
+for _name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__',
+              '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop',
+              'remove', 'reverse', 'sort'):
+    if hasattr(list, _name):
+        setattr(SharedList, _name, _copy_on_write(_name))
+
+
 class Link:
     """Class for Gpx linkType"""
     def __init__(self, href=None, text=None, type=None):
@@ -110,12 +205,20 @@ class Point:
         c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
         return height * c
 
+    def clone(self):
+        """Copy the point, without sharing any mutable members."""
+        point = copy(self)
+        point.link = copy(self.link)
+        return point
+
 
 class Path:
     """Base class for routes and track segments"""
     def __init__(self):
         self.id = None
         self.points = []
+        self._metrics = None
+        self._metrics_key = None
 
     def cleanup(self):
         """Loop through points, removing any with no data"""
@@ -226,8 +329,31 @@ class Path:
                 break
         return slat, slon, elat, elon
 
+    def get_metrics(self):
+        """Get the derived metrics (processing.metrics.SegmentMetrics). The
+           result is cached until the point list is replaced or changes
+           length; call clear_metrics after editing points in place."""
+        key = (id(self.points), len(self.points))
+        if self._metrics is None or self._metrics_key != key:
+            self._metrics = SegmentMetrics(self.points)
+            self._metrics_key = key
+        return self._metrics
+
+    def get_summary(self):
+        """Get the precomputable totals (processing.summary.Summary)."""
+        return segment_summary(self.get_metrics())
+
+    def clear_metrics(self):
+        """Drop the cached metrics."""
+        self._metrics = None
+        self._metrics_key = None
+
     def clone(self):
-        return deepcopy(self)
+        """Copy the path. The copy shares the points in a SharedList until
+           they are read, so cloning is cheap whatever the length."""
+        path = copy(self)
+        path.points = SharedList(self.points)
+        return path
 
 
 class GpsDevice:
@@ -339,7 +465,18 @@ class Gpx:
         return None, None
 
     def clone(self):
-        return deepcopy(self)
+        """Copy the instance. Only the track and segment objects are copied
+           up front, points and waypoints are shared until read."""
+        gpx = copy(self)
+        gpx.author = copy(self.author)
+        gpx.author.link = copy(self.author.link)
+        gpx.copyright = copy(self.copyright)
+        gpx.link = copy(self.link)
+        gpx.bounds = copy(self.bounds)
+        gpx.device = copy(self.device)
+        gpx.tracks = [track.clone() for track in self.tracks]
+        gpx.waypoints = SharedList(self.waypoints)
+        return gpx
 
 
 class Waypoint(Point):
@@ -355,6 +492,13 @@ class Waypoint(Point):
         self.gpxx_address = Address()
         self.gpxx_phonenumber = PhoneNumber()
 
+    def clone(self):
+        """Copy the waypoint, without sharing any mutable members."""
+        wpt = Point.clone(self)
+        wpt.gpxx_address = copy(self.gpxx_address)
+        wpt.gpxx_phonenumber = copy(self.gpxx_phonenumber)
+        return wpt
+
 
 class Track:
     """Class for GPX tracks"""
@@ -375,7 +519,7 @@ class Track:
         t = []
         for segment in self.segments:
             segment.cleanup()
-            if segment.points:
+            if segment.get_num_points():
                 t.append(segment)
         self.segments = t
 
@@ -462,8 +606,20 @@ class Track:
                 break
         return slat, slon, elat, elon
 
+    def get_metrics(self):
+        """Get the summary metrics of all segments combined."""
+        return combine([s.get_metrics() for s in self.segments])
+
+    def get_summary(self):
+        """Get the precomputable totals of all segments combined."""
+        return combine_summaries([s.get_summary() for s in self.segments])
+
     def clone(self):
-        return deepcopy(self)
+        """Copy the track. Segments are cloned, sharing their points."""
+        track = copy(self)
+        track.link = copy(self.link)
+        track.segments = [segment.clone() for segment in self.segments]
+        return track
 
 
 class TrackSegment(Path):
@@ -479,3 +635,55 @@ class SegmentPoint(Point):
         #GPXX
         self.gpxx_temperature = None
         self.gpxx_depth = None
+
+
+#Every field of a SegmentPoint
+POINT_FIELDS = frozenset(SegmentPoint().__dict__)
+
+
+class LazySegmentPoint(SegmentPoint):
+    """SegmentPoint whose fields are decoded only when first read, from
+       wherever the point is stored (a parsed XML node, shared columns...).
+       decode(key, name) gets the point identified by key and returns a
+       dict of field values that includes name (None if the point has
+       none, a Link for 'link'); it may decode other fields at the same
+       time. Decoded and assigned fields are plain attributes, so the point
+       behaves like a SegmentPoint; pickling decodes everything."""
+    def __init__(self, decode, key):
+        self._decode = decode
+        self._key = key
+
+    def __getattr__(self, name):
+        #Only called for fields not read yet
+        if name not in POINT_FIELDS or '_decode' not in self.__dict__:
+            raise AttributeError(name)
+        values = self._decode(self._key, name)
+        for field, value in values.items():
+            if field not in self.__dict__:
+                self.__dict__[field] = value
+        return self.__dict__[name]
+
+    def materialize(self):
+        """Decode every field, and drop the reference to the storage."""
+        if '_decode' in self.__dict__:
+            for name in POINT_FIELDS:
+                getattr(self, name)
+            del self._decode
+            del self._key
+        return self
+
+    def __getstate__(self):
+        return self.materialize().__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def clone(self):
+        """Copy the point; fields not read yet are still decoded lazily,
+           and separately, for each copy."""
+        point = LazySegmentPoint(None, None)
+        point.__dict__.clear()
+        point.__dict__.update(self.__dict__)
+        if 'link' in self.__dict__:
+            point.link = copy(self.link)
+        return point
@@ -3,42 +3,338 @@
 @license: MIT
 '''
 
+import hashlib
+import os
+import time
+
+from sqlalchemy.orm import Session
+
+from formats.gpx import Gpx
+from parsers.compressed import open_gpx, member_path
 from parsers.gpx import GpxXmlParser
+from parsers.gpx_scan import GpxScanParser
 from backend.sqlite import *
+from backend.dedup import DedupStore
+from backend.heatmap import HeatmapStore
+from backend.lod import LodStore
+from backend.similarity import SimilarityStore
+from backend.strings import StringDictionary
+from backend.summary import SummaryStore
+from processing.dedup import SegmentDigest
+from processing.geo import coordinate_columns, pack_doubles, to_timestamp, \
+                           to_timestring
+from processing.heatmap import merge_cells
+from processing.lod import LOD_TOLERANCES
+from processing.noise import NoiseReport
+from processing.stops import split_gpx
+from processing.summary import combine_summaries
+
+HASH_BLOCK = 1 << 20
+
+
+def file_hash(path, member=None):
+    """Get the SHA-1 hex digest of a file's content, after decompressing
+       it (see parsers.compressed.open_gpx), so a GPX file has the same
+       digest compressed or not."""
+    h = hashlib.sha1()
+    f = open_gpx(path, member)
+    try:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        f.close()
+    return h.hexdigest()
 
 
 class GPXImporter:
-    """Import data from GPX files. Currently supports v1.1 only."""
-    def __init__(self, file, sessionmaker):
+    """Import data from GPX files. Currently supports v1.1 only. file can
+       also be a Gpx instance, such as one from processing.merge.merge_gpx.
+
+       If a processing.simplify.Simplifier is given, track segments are
+       simplified before saving. With keep_original the full-resolution
+       points are still saved and the simplified copy is stored alongside
+       them, otherwise only the simplified points are saved.
+
+       A level-of-detail pyramid is saved for every segment, built with
+       lod_tolerances; pass None to skip it. Route fingerprints and the
+       heatmap cell counts are updated with every import.
+
+       A processing.noise.NoiseFilter is applied while parsing (or to the
+       segments of a Gpx instance), and the number of points it dropped is
+       kept in noise_report.
+
+       With a processing.stops.StopDetector, tracks are split into one
+       track per trip and the stops are saved as candidate waypoints.
+
+       progress is an importers.worker.ImportProgress, told about the bytes
+       read, points parsed and rows written; it may raise to cancel.
+
+       With dedup, the SHA-1 of the file is checked against imported_files
+       before parsing; a file seen before is not parsed and save_gpx writes
+       nothing (duplicate holds the earlier imported_files row). Segments
+       whose digest matches a stored segment are left out and counted in
+       duplicate_segments. For a Gpx instance, pass the path and sha1 it
+       came from to have them recorded.
+
+       Repeated text fields (sym, type, links, gpxx categories) are saved
+       as ids of strings rows, and fix, gpxx display mode and color as ids
+       of their lookup tables (see backend.strings).
+
+       With scan, files are read with parsers.gpx_scan.GpxScanParser, which
+       scans plain track points directly from the bytes of the file.
+
+       Files compressed with gzip, bzip2 or xz, and zip archives, are
+       decompressed as they are parsed. member names the GPX file to
+       import from a zip holding several (see
+       parsers.compressed.gpx_members); it is recorded as path/member."""
+    def __init__(self, file, sessionmaker, simplifier=None,
+                 keep_original=False, lod_tolerances=LOD_TOLERANCES,
+                 noise_filter=None, stop_detector=None, progress=None,
+                 dedup=True, path=None, sha1=None, scan=False, member=None):
         self.session = sessionmaker()
-        f = open(file)
-        parser = GpxXmlParser(f)
-        f.close()
-        self.gpx = parser.parse()
+        self.progress = progress
+        self.dedup = None
+        if dedup:
+            self.dedup = DedupStore(self.session)
+        self.path = path
+        self.sha1 = sha1
+        self.duplicate = None
+        self.duplicate_segments = 0
+        self.digests = {}
+        if not isinstance(file, Gpx):
+            self.path = member_path(file, member)
+            if self.dedup:
+                self.sha1 = file_hash(file, member)
+                self.duplicate = self.dedup.find_file(self.sha1)
+        if self.duplicate:
+            self.gpx = Gpx()
+            self.noise_report = NoiseReport()
+        elif isinstance(file, Gpx):
+            self.gpx = file
+            self.noise_report = NoiseReport()
+            if noise_filter:
+                for track in self.gpx.tracks:
+                    segments = []
+                    for segment in track.segments:
+                        segment, report = noise_filter.apply(segment)
+                        self.noise_report.add(report)
+                        segments.append(segment)
+                    track.segments = segments
+            if progress:
+                progress.parsed(sum(t.get_num_points()
+                                    for t in self.gpx.tracks))
+        else:
+            f = open(file, 'rb')
+            try:
+                if progress:
+                    f = progress.wrap(f)
+                stream = open_gpx(f, member)
+                try:
+                    if scan:
+                        parser = GpxScanParser(stream, noise_filter, progress)
+                    else:
+                        parser = GpxXmlParser(stream, noise_filter, progress)
+                    self.gpx = parser.parse()
+                finally:
+                    stream.close()
+            finally:
+                f.close()
+            self.noise_report = parser.noise_report
         self.gpx.cleanup()
+        self.stops = []
+        if stop_detector:
+            self.stops = split_gpx(self.gpx, stop_detector)
+        self.simplifier = simplifier
+        self.keep_original = keep_original
+        self.lod_tolerances = lod_tolerances
+        self.use_session(self.session)
+        if simplifier and not keep_original:
+            for track in self.gpx.tracks:
+                track.segments = [simplifier.simplify(s)
+                                  for s in track.segments]
         print self.gpx.link
 
+    def use_session(self, session):
+        """Write with a session, and give it to every store."""
+        self.session = session
+        if self.dedup:
+            self.dedup = DedupStore(session)
+        self.summaries = SummaryStore(session)
+        self.fingerprints = SimilarityStore(session)
+        self.heatmap = HeatmapStore(session)
+        self.strings = StringDictionary(session)
+        self.fixes = StringDictionary(session, TableFix)
+        self.displaymodes = StringDictionary(session, TableGpxxDisplayMode)
+        self.displaycolors = StringDictionary(session, TableGpxxDisplayColor)
+        self.lod = None
+        if self.lod_tolerances:
+            self.lod = LodStore(session, self.lod_tolerances)
+
+    def save_to(self, writer, device_id, callback=None):
+        """Save through a backend.writer.DbWriter, as one batch of its
+           commit group, instead of with our own session. Returns the
+           WriteTicket. The writer runs the save again if its group is
+           rolled back for another batch, so every run starts from a new
+           session and leaves nothing behind. Every run also starts from
+           the tracks and counters as they were before the first one, since
+           duplicate segments are dropped and counted while saving."""
+        written = 0
+        if self.progress:
+            written = self.progress.rows_written
+        tracks = [(t, t.segments) for t in self.gpx.tracks]
+
+        def save(connection):
+            #Our own session may already hold a connection of the calling
+            #thread (e.g. from the dedup check), so write with a new one
+            #bound to the writer's connection
+            own = self.session
+            self.use_session(Session(bind=connection))
+            if self.progress:
+                self.progress.rows_written = written
+            for track, segments in tracks:
+                track.segments = segments
+            self.gpx.tracks = [track for track, segments in tracks]
+            self.duplicate_segments = 0
+            try:
+                self.save_gpx(device_id)
+            except Exception:
+                self.session.rollback()
+                raise
+            finally:
+                self.session.close()
+                self.use_session(own)
+        return writer.call(save, callback)
+
     def save_gpx(self, device_id):
+        if self.duplicate:
+            return
+        self.clear_dictionaries()
+        if self.dedup:
+            self.drop_duplicate_segments()
+            if not self.gpx.tracks and not self.new_waypoints():
+                self.save_file_row()
+                self.session.commit()
+                return
+        g, summaries = self.save_header(device_id)
+        cells = {}
+        for track, segment_summaries in zip(self.gpx.tracks, summaries):
+            t = self.save_track(track, g.id, device_id, segment_summaries)
+            for segment, summary in zip(track.segments, segment_summaries):
+                self.save_segment(segment, t.id, summary, device_id, cells)
+        self.save_waypoints(g.id)
+        self.heatmap.merge(cells)
+        self.save_file_row()
+        self.session.commit()
+
+    def clear_dictionaries(self):
+        """Forget the cached string ids, which a rollback may have undone."""
+        for d in (self.strings, self.fixes, self.displaymodes,
+                  self.displaycolors):
+            d.clear()
+
+    def drop_duplicate_segments(self):
+        """Remove the segments already stored, or repeated in this file,
+           and any tracks left empty."""
+        seen = set()
+        for track in self.gpx.tracks:
+            segments = []
+            for segment in track.segments:
+                digest = self.get_digest(segment)
+                key = tuple(sorted(digest.as_dict().items()))
+                if key in seen or self.dedup.find_segment(digest):
+                    self.duplicate_segments += 1
+                else:
+                    seen.add(key)
+                    segments.append(segment)
+            track.segments = segments
+        self.gpx.tracks = [t for t in self.gpx.tracks if t.segments]
+
+    def get_digest(self, segment):
+        digest = self.digests.get(id(segment))
+        if digest is None:
+            digest = SegmentDigest(segment.points)
+            self.digests[id(segment)] = digest
+        return digest
+
+    def save_file_row(self):
+        """Record the content hash of the imported file, if known."""
+        if self.dedup and self.sha1:
+            size = None
+            if self.path and os.path.exists(self.path):
+                size = os.path.getsize(self.path)
+            self.session.add(self.dedup.create_file_row(self.path, self.sha1,
+                             size, to_timestring(time.time())))
+
+    def save_header(self, device_id):
+        """Add the gpx row. Returns it and the segment summaries of every
+           track."""
         g = self.create_new_gpx(self.gpx, device_id)
         print g.creator
+        summaries = [[segment.get_summary() for segment in track.segments]
+                     for track in self.gpx.tracks]
+        self.fill_bounds(g, summaries)
         self.session.add(g)
         self.session.flush()
-        for track in self.gpx.tracks:
-            t = self.create_new_track(track, g.id)
-            self.session.add(t)
-            self.session.flush()
-            for segment in track.segments:
-                s = self.create_new_segment(t.id, segment)
-                self.session.add(s)
-                self.session.flush()
-                for point in segment.points:
-                    p = self.create_new_segment_point(s.id, point)
-                    self.session.add(p)
+        return g, summaries
+
+    def save_track(self, track, gpxid, device_id, segment_summaries):
+        """Add the track row and its summary, without the segments."""
+        t = self.create_new_track(track, gpxid)
+        self.session.add(t)
+        self.session.flush()
+        self.session.add(self.summaries.create_track_row(t.id, gpxid,
+                device_id, combine_summaries(segment_summaries),
+                len(segment_summaries)))
+        return t
+
+    def save_segment(self, segment, trkid, summary, device_id, cells=None):
+        """Add a segment with its points and derived rows. The heatmap
+           counts are merged into cells if given, or written directly."""
+        s = self.create_new_segment(trkid, segment)
+        self.session.add(s)
+        self.session.flush()
+        self.session.add(
+            self.summaries.create_segment_row(s.id, trkid, summary))
+        for point in segment.points:
+            p = self.create_new_segment_point(s.id, point, device_id)
+            self.session.add(p)
+        if cells is None:
+            self.heatmap.add_points(segment.points)
+        else:
+            merge_cells(cells, self.heatmap.count_points(segment.points))
+        if self.simplifier and self.keep_original:
+            simple = self.simplifier.simplify(segment)
+            self.session.add(
+                self.create_new_simplification(s.id, simple))
+        if self.lod:
+            for lod in self.lod.create_levels(s.id, segment.points):
+                self.session.add(lod)
+        for row in self.fingerprints.create_rows(s.id, trkid,
+                                                 segment.points):
+            self.session.add(row)
+        if self.dedup:
+            self.session.add(self.dedup.create_segment_row(s.id,
+                             self.get_digest(segment)))
+        if self.progress:
+            self.progress.wrote(len(segment.points))
+        return s
+
+    def new_waypoints(self):
+        """Get the waypoints not already stored."""
+        return [w for w in self.gpx.waypoints
+                if self.session.query(TableWaypoint).filter(
+                    TableWaypoint.lat == w.lat).filter(
+                    TableWaypoint.lon == w.lon).first() is None]
+
+    def save_waypoints(self, gpxid):
+        """Add the waypoints not already stored."""
         for waypoint in self.gpx.waypoints:
             if self.session.query(TableWaypoint).filter(TableWaypoint.lat==waypoint.lat).filter(TableWaypoint.lon==waypoint.lon).first() is None:
-                w = self.create_new_waypoint(waypoint, g.id)
+                w = self.create_new_waypoint(waypoint, gpxid)
                 self.session.add(w)
-        self.session.commit()
 
     def create_new_gpx(self, gpx, device_id):
         t = TableGpx()
@@ -66,6 +362,19 @@ class GPXImporter:
         t.bounds_maxlon = gpx.bounds.maxlon
         return t
 
+    def fill_bounds(self, g, summaries):
+        """Use the bounds calculated from the points unless the file gave a
+           complete set."""
+        if g.bounds_minlat and g.bounds_minlon and \
+           g.bounds_maxlat and g.bounds_maxlon:
+            return
+        total = combine_summaries([s for track in summaries for s in track])
+        if total.minlat is not None:
+            g.bounds_minlat = str(total.minlat)
+            g.bounds_minlon = str(total.minlon)
+            g.bounds_maxlat = str(total.maxlat)
+            g.bounds_maxlon = str(total.maxlon)
+
     def create_new_track(self, track, gpxid):
         t = TableTrack()
         t.name = track.name
@@ -77,9 +386,9 @@ class GPXImporter:
         t.link_text = track.link.text
         t.link_type = track.link.type
         t.number = track.number
-        t.type = track.type
-        #TODO: Pull from Table
-        t.gpxx_display_color_id = None
+        t.type_id = self.strings.encode(track.type)
+        t.gpxx_displaycolor_id = self.displaycolors.encode(
+                track.gpxx_displaycolor)
         return t
 
     def create_new_segment(self, trkid, segment):
@@ -87,25 +396,36 @@ class GPXImporter:
         s.track_id = trkid
         return s
 
-    def create_new_segment_point(self, segid, point):
+    def create_new_simplification(self, segid, segment):
+        lats, lons = coordinate_columns(segment.points)
+        s = TableSegmentSimplification()
+        s.segment_id = segid
+        s.tolerance = self.simplifier.tolerance
+        s.num_points = len(segment.points)
+        s.lats = pack_doubles(lats)
+        s.lons = pack_doubles(lons)
+        return s
+
+    def create_new_segment_point(self, segid, point, device_id=None):
         p = TableSegmentPoint()
         p.segment_id = segid
+        p.device_id = device_id
         p.lat = point.lat
         p.lon = point.lon
         p.ele = point.ele
         p.time = point.time
+        p.timestamp = to_timestamp(point.time)
         p.magvar = point.magvar
         p.geoidheight = point.geoidheight
         p.name = point.name
         p.cmt = point.cmt
         p.desc = point.desc
-        p.link_href = point.link.href
-        p.link_name = point.link.text
-        p.link_type = point.link.type
-        p.sym = point.sym
-        p.type = point.type
-        #TODO: Pull from Table
-        p.fix_id = None
+        p.link_href_id = self.strings.encode(point.link.href)
+        p.link_text_id = self.strings.encode(point.link.text)
+        p.link_type_id = self.strings.encode(point.link.type)
+        p.sym_id = self.strings.encode(point.sym)
+        p.type_id = self.strings.encode(point.type)
+        p.fix_id = self.fixes.encode(point.fix)
         p.sat = point.sat
         p.hdop = point.hdop
         p.vdop = point.vdop
@@ -128,13 +448,12 @@ class GPXImporter:
         w.name = waypoint.name
         w.cmt = waypoint.cmt
         w.desc = waypoint.desc
-        w.link_href = waypoint.link.href
-        w.link_name = waypoint.link.text
-        w.link_type = waypoint.link.type
-        w.sym = waypoint.sym
-        w.type = waypoint.type
-        #TODO: Pull from Table
-        w.fix_id = None
+        w.link_href_id = self.strings.encode(waypoint.link.href)
+        w.link_text_id = self.strings.encode(waypoint.link.text)
+        w.link_type_id = self.strings.encode(waypoint.link.type)
+        w.sym_id = self.strings.encode(waypoint.sym)
+        w.type_id = self.strings.encode(waypoint.type)
+        w.fix_id = self.fixes.encode(waypoint.fix)
         w.sat = waypoint.sat
         w.hdop = waypoint.hdop
         w.vdop = waypoint.vdop
@@ -144,9 +463,9 @@ class GPXImporter:
         w.gpxx_temperature = waypoint.gpxx_temperature
         w.gpxx_depth = waypoint.gpxx_depth
         w.gpxx_proximity = waypoint.gpxx_proximity
-        #TODO: Pull from Table
-        w.gpxx_displaymode_id = None
-        w.gpxx_categories = waypoint.gpxx_categories
+        w.gpxx_displaymode_id = self.displaymodes.encode(
+                waypoint.gpxx_displaymode)
+        w.gpxx_categories_id = self.strings.encode(waypoint.gpxx_categories)
         w.gpxx_address_streetaddress = waypoint.gpxx_address.streetaddress
         w.gpxx_address_city = waypoint.gpxx_address.city
         w.gpxx_address_state = waypoint.gpxx_address.state
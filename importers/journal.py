@@ -0,0 +1,194 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import time
+import traceback
+import zlib
+
+from sqlalchemy import func
+
+from backend.sqlite import TableImportJournal, TableImportJournalSegment
+from importers.gpx import GPXImporter, file_hash
+from parsers.compressed import gpx_members, member_path
+from processing.geo import to_timestring
+
+PENDING = 'pending'
+WRITING = 'writing'
+DONE = 'done'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+
+
+def segment_checksum(points):
+    """Get a CRC-32 of the core fields of a list of points."""
+    crc = 0
+    for p in points:
+        crc = zlib.crc32(('%s,%s,%s,%s;' % (p.lat, p.lon, p.ele, p.time)
+                          ).encode('utf-8'), crc)
+    return crc & 0xffffffff
+
+
+class ImportJournal:
+    """Crash-safe import of a batch of files. Every file and every saved
+       segment is recorded in import_journal/import_journal_segments, and
+       each segment is committed together with its journal row, so after a
+       crash run() carries on from the first segment not committed. Files
+       already done are not opened again. A file whose content changed
+       after its import started, or whose saved segments no longer match
+       their checksums, is marked failed rather than mixed with the old
+       rows. Files and segments GPXImporter finds to be duplicates are
+       skipped. Every GPX file in a zip archive is journaled, and imported,
+       on its own. options are passed on to GPXImporter."""
+    def __init__(self, sessionmaker, batch, **options):
+        self.sessionmaker = sessionmaker
+        self.batch = batch
+        self.options = options
+
+    def add(self, paths, device_id):
+        """Add files to the batch, one entry per GPX file of a zip archive.
+           Files already in it are left alone."""
+        session = self.sessionmaker()
+        known = set(p for (p,) in session.query(TableImportJournal.path
+                    ).filter(TableImportJournal.batch == self.batch))
+        for path in paths:
+            try:
+                members = gpx_members(path)
+            except Exception:
+                #Journaled as it is, to fail with the error on import
+                members = [None]
+            for member in members:
+                name = member_path(path, member)
+                if name in known:
+                    continue
+                known.add(name)
+                j = TableImportJournal()
+                j.batch = self.batch
+                j.path = name
+                j.member = member
+                j.device_id = device_id
+                j.state = PENDING
+                j.segments_done = 0
+                j.updated = to_timestring(time.time())
+                session.add(j)
+        session.commit()
+
+    def status(self):
+        """Get {state: number of files} for the batch."""
+        session = self.sessionmaker()
+        j = TableImportJournal
+        return dict(session.query(j.state, func.count(j.id)).filter(
+                    j.batch == self.batch).group_by(j.state))
+
+    def run(self, retry_failed=False):
+        """Import every file of the batch that isn't done. Returns the
+           number of files imported."""
+        session = self.sessionmaker()
+        states = [PENDING, WRITING] + ([FAILED] if retry_failed else [])
+        ids = [i for (i,) in session.query(TableImportJournal.id).filter(
+               TableImportJournal.batch == self.batch).filter(
+               TableImportJournal.state.in_(states)).order_by(
+               TableImportJournal.id)]
+        session.close()
+        imported = 0
+        for journal_id in ids:
+            if self.import_file(journal_id):
+                imported += 1
+        return imported
+
+    def import_file(self, journal_id):
+        """Import, or finish importing, one file of the batch."""
+        importer = None
+        try:
+            path, member = self.__file(journal_id)
+            importer = GPXImporter(path, self.sessionmaker, member=member,
+                                   **self.options)
+            return self.__save(importer, journal_id)
+        except Exception:
+            error = traceback.format_exc().splitlines()[-1]
+            session = importer.session if importer else self.sessionmaker()
+            session.rollback()
+            j = session.query(TableImportJournal).get(journal_id)
+            j.state = FAILED
+            j.error = error
+            j.updated = to_timestring(time.time())
+            session.commit()
+            return False
+
+    def __file(self, journal_id):
+        """Get the path of the file to open for an entry, and the member."""
+        session = self.sessionmaker()
+        path, member = session.query(TableImportJournal.path,
+                TableImportJournal.member).filter(
+                TableImportJournal.id == journal_id).one()
+        if member is not None:
+            path = path[:-len(member) - 1]
+        return path, member
+
+    def __save(self, importer, journal_id):
+        session = importer.session
+        j = session.query(TableImportJournal).get(journal_id)
+        if importer.duplicate:
+            j.state = DUPLICATE
+            j.sha1 = importer.sha1
+            j.updated = to_timestring(time.time())
+            session.commit()
+            return False
+        sha1 = importer.sha1 or file_hash(*self.__file(journal_id))
+        if j.gpx_id is None:
+            g, summaries = importer.save_header(j.device_id)
+            j.gpx_id = g.id
+            j.sha1 = sha1
+            j.state = WRITING
+            j.error = None
+            j.num_segments = sum(len(s) for s in summaries)
+            j.updated = to_timestring(time.time())
+            session.commit()
+        else:
+            if sha1 != j.sha1:
+                raise ValueError('%s changed since its import started' %
+                                 j.path)
+            summaries = [[s.get_summary() for s in t.segments]
+                         for t in importer.gpx.tracks]
+        saved = dict(((s.track_index, s.segment_index), s)
+                     for s in j.segments)
+        track_ids = dict((s.track_index, s.track_id) for s in j.segments
+                         if s.track_id is not None)
+        for ti, track in enumerate(importer.gpx.tracks):
+            for si, segment in enumerate(track.segments):
+                checksum = segment_checksum(segment.points)
+                done = saved.get((ti, si))
+                if done is not None:
+                    if done.checksum != checksum:
+                        raise ValueError('Segment %d/%d of %s does not match '
+                                         'the saved one' % (ti, si, j.path))
+                    continue
+                js = TableImportJournalSegment()
+                if importer.dedup and importer.dedup.find_segment(
+                        importer.get_digest(segment)):
+                    #Already stored by another import, journal it as done
+                    importer.duplicate_segments += 1
+                else:
+                    if ti not in track_ids:
+                        track_ids[ti] = importer.save_track(track, j.gpx_id,
+                                j.device_id, summaries[ti]).id
+                    s = importer.save_segment(segment, track_ids[ti],
+                                              summaries[ti][si], j.device_id)
+                    js.track_id = track_ids[ti]
+                    js.segment_id = s.id
+                js.journal_id = j.id
+                js.track_index = ti
+                js.segment_index = si
+                js.num_points = len(segment.points)
+                js.checksum = checksum
+                session.add(js)
+                j.segments_done += 1
+                j.updated = to_timestring(time.time())
+                session.commit()
+        importer.save_waypoints(j.gpx_id)
+        importer.save_file_row()
+        j.state = DONE
+        j.updated = to_timestring(time.time())
+        session.commit()
+        return True
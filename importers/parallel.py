@@ -0,0 +1,277 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from array import array
+import glob
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import traceback
+
+from formats.gpx import Link, LazySegmentPoint, POINT_FIELDS
+from parsers.compressed import open_gpx
+from parsers.gpx import GpxXmlParser
+from processing.geo import to_timestamp, to_timestring
+
+#Shared memory on Linux; elsewhere the temp directory, which the OS caches
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+#Column files are named gpx-<owner pid>-*.cols, see remove_shared
+PREFIX = 'gpx-%d-'
+SUFFIX = '.cols'
+COLUMNS = ('lat', 'lon', 'ele', 'time')
+NAN = float('nan')
+
+
+def decimals(value):
+    """Get the number of digits after the decimal point of a string."""
+    dot = value.find('.')
+    return 0 if dot < 0 else len(value) - dot - 1
+
+
+def column_format(values):
+    """Get the %f format that reproduces every string in values exactly,
+       or None if there isn't one (mixed precision, exponents...)."""
+    fmt = None
+    for v in values:
+        if v is None:
+            continue
+        if fmt is None:
+            fmt = '%%.%df' % decimals(v)
+        try:
+            if fmt % float(v) != v:
+                return None
+        except ValueError:
+            return None
+    return fmt or '%f'
+
+
+def is_plain(point):
+    """Check a point has nothing besides lat, lon, ele and time."""
+    for name in POINT_FIELDS:
+        value = getattr(point, name)
+        if name == 'link':
+            if value.href or value.text or value.type:
+                return False
+        elif name not in COLUMNS and value is not None:
+            return False
+    return True
+
+
+class PointColumns:
+    """The points of a SharedGpx, for LazySegmentPoints keyed by index:
+       lat, lon, ele and time are formatted back into strings when first
+       read, and every other field is empty."""
+    def __init__(self, lats, lons, eles, times, formats):
+        self.lats = lats
+        self.lons = lons
+        self.eles = eles
+        self.times = times
+        self.lat_fmt, self.lon_fmt, self.ele_fmt = formats
+
+    def decode(self, i, name):
+        if name == 'lat':
+            return {name: self.lat_fmt % self.lats[i]}
+        if name == 'lon':
+            return {name: self.lon_fmt % self.lons[i]}
+        if name == 'ele':
+            ele = self.eles[i]
+            return {name: self.ele_fmt % ele if ele == ele else None}
+        if name == 'time':
+            t = self.times[i]
+            return {name: to_timestring(t) if t == t else None}
+        values = dict.fromkeys(POINT_FIELDS)
+        for c in COLUMNS:
+            del values[c]
+        values['link'] = Link()
+        return values
+
+
+class MappedColumn:
+    """A column of doubles read in place from a memory map, for Python
+       versions whose memoryview can't be cast (2)."""
+    def __init__(self, data, start, length):
+        self.data = data
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return struct.unpack_from('=d', self.data, self.start + i * 8)[0]
+
+
+class SharedGpx:
+    """A parsed Gpx whose track points are stored as float columns in a
+       shared memory file instead of as objects. Only this small descriptor
+       is pickled between processes; the reader maps the file and uses the
+       columns in place. The file is removed as soon as it is opened, and
+       the memory is freed once the points made by to_gpx are gone."""
+    def __init__(self, path, skeleton, lengths, formats):
+        self.path = path
+        #Pickled Gpx with empty segments
+        self.skeleton = skeleton
+        self.lengths = lengths
+        self.formats = formats
+        self.map = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['map'] = None
+        return state
+
+    def open(self):
+        if self.map is None:
+            f = open(self.path, 'rb')
+            try:
+                size = os.fstat(f.fileno()).st_size
+                self.map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+                os.unlink(self.path)
+        return self.map
+
+    def column(self, name):
+        """Get a column of all the points (lat, lon, ele or time as epoch
+           seconds; NaN where missing) as a sequence of floats read in
+           place from the shared memory."""
+        n = sum(self.lengths)
+        start = COLUMNS.index(name) * n * 8
+        data = self.open()
+        try:
+            return memoryview(data)[start:start + n * 8].cast('d')
+        except (AttributeError, TypeError):
+            return MappedColumn(data, start, n)
+
+    def to_gpx(self):
+        """Rebuild the Gpx. The points are LazySegmentPoints reading the
+           shared memory in place, so their strings are only made for the
+           fields that get used; the memory stays mapped while any of them
+           is alive. The file is removed even if this fails."""
+        try:
+            gpx = pickle.loads(self.skeleton)
+            lats, lons, eles, times = [self.column(c) for c in COLUMNS]
+            columns = PointColumns(lats, lons, eles, times, self.formats)
+        except Exception:
+            self.release()
+            raise
+        i = 0
+        lengths = iter(self.lengths)
+        for track in gpx.tracks:
+            for segment in track.segments:
+                n = next(lengths)
+                segment.points = [LazySegmentPoint(columns.decode, j)
+                                  for j in range(i, i + n)]
+                i += n
+        #The columns keep the map open, it is closed with the last of them
+        self.map = None
+        return gpx
+
+    def release(self):
+        """Remove the file, for a result that won't be loaded."""
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                #Columns of it are still in use
+                pass
+            self.map = None
+        elif os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def pack_shared(gpx, directory=SHM_DIR, owner=None):
+    """Move the track points of a Gpx into a SharedGpx, emptying its
+       segments. Returns None (leaving the Gpx alone) if any point has data
+       the columns can't hold exactly. owner is the process id the file is
+       named after (see remove_shared), by default this one."""
+    points = [p for t in gpx.tracks for s in t.segments for p in s.points]
+    if not all(is_plain(p) for p in points):
+        return None
+    formats = tuple(column_format([getattr(p, c) for p in points])
+                    for c in COLUMNS[:3])
+    if None in formats:
+        return None
+    times = []
+    for p in points:
+        t = to_timestamp(p.time)
+        if p.time is not None and (t is None or to_timestring(t) != p.time):
+            return None
+        times.append(NAN if t is None else t)
+    columns = [array('d', [float(p.lat) for p in points]),
+               array('d', [float(p.lon) for p in points]),
+               array('d', [NAN if p.ele is None else float(p.ele)
+                           for p in points]),
+               array('d', times)]
+    if owner is None:
+        owner = os.getpid()
+    fd, path = tempfile.mkstemp(SUFFIX, PREFIX % owner, directory)
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            for c in columns:
+                c.tofile(f)
+        finally:
+            f.close()
+        lengths = [len(s.points) for t in gpx.tracks for s in t.segments]
+        skeleton = gpx.clone()
+        for t in skeleton.tracks:
+            for s in t.segments:
+                s.points = []
+        shared = SharedGpx(path, pickle.dumps(skeleton, 2), lengths, formats)
+    except Exception:
+        os.unlink(path)
+        raise
+    for t in gpx.tracks:
+        for s in t.segments:
+            s.points = []
+    return shared
+
+
+def remove_shared(owner=None, directory=SHM_DIR):
+    """Remove the column files made for a process (by default this one)
+       that were never loaded, e.g. results a pool handed back after the
+       watcher stopped collecting them. Returns the number removed."""
+    if owner is None:
+        owner = os.getpid()
+    if directory is None:
+        directory = tempfile.gettempdir()
+    paths = glob.glob(os.path.join(directory, PREFIX % owner + '*' + SUFFIX))
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    return len(paths)
+
+
+def parse_shared(path, noise_filter=None, member=None):
+    """Parse a GPX file (or a member of a zip archive) in a worker
+       process, returning (result, None) or (None, error text). result is a
+       SharedGpx when the points fit in columns and the Gpx itself
+       otherwise; load_result gives a Gpx for either. The SharedGpx file is
+       named after the parent process, which can remove_shared what it
+       never loads. Compressed files are decompressed as they are
+       parsed."""
+    try:
+        f = open_gpx(path, member)
+        try:
+            gpx = GpxXmlParser(f, noise_filter).parse()
+        finally:
+            f.close()
+        return pack_shared(gpx, owner=os.getppid()) or gpx, None
+    except Exception:
+        return None, traceback.format_exc().splitlines()[-1]
+
+
+def load_result(result):
+    """Get the Gpx from a parse_shared result."""
+    if isinstance(result, SharedGpx):
+        return result.to_gpx()
+    return result
@@ -0,0 +1,354 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import fnmatch
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from backend.sqlite import TableImportedFile
+from importers.gpx import GPXImporter, file_hash
+from importers.parallel import parse_shared, load_result, remove_shared
+from parsers.compressed import gpx_members, member_path, open_gpx
+from parsers.gpx import GpxXmlParser
+from processing.geo import to_timestring
+
+#Plain and compressed GPX files, and zip archives of them
+PATTERNS = ('*.gpx', '*.gpx.gz', '*.gpx.bz2', '*.gpx.xz', '*.zip')
+#Seconds the writer thread waits for work before checking on the parses
+CHECK_INTERVAL = 1.0
+
+def parse_file(path, noise_filter=None, member=None):
+    """Parse a GPX file, returning (gpx, None) or (None, error text).
+       Module level so a multiprocessing pool can run it."""
+    try:
+        f = open_gpx(path, member)
+        try:
+            return GpxXmlParser(f, noise_filter).parse(), None
+        finally:
+            f.close()
+    except Exception:
+        return None, traceback.format_exc().splitlines()[-1]
+
+
+class WatchService:
+    """Long-running import of GPX files dropped into directories.
+
+       directories maps each watched directory to the device id its files
+       belong to. Directories are polled every interval seconds; a file is
+       picked up once its size and modification time have not changed for
+       settle seconds, so files still being copied are left alone. Files
+       whose SHA-1 is already in imported_files are skipped.
+
+       Files compressed with gzip, bzip2 or xz are decompressed as they are
+       parsed, and every GPX file in a zip archive is imported on its own,
+       as path/member. pattern is an fnmatch pattern, or a list of them;
+       the default, PATTERNS, picks these files up.
+
+       Parsing runs on a pool of worker processes (inline in the watch
+       thread with workers=0), which hand the points back through shared
+       memory (see importers.parallel), and every write goes through a
+       single writer thread. At most max_in_flight files are parsed or waiting to be
+       written at once; when that many are busy the watcher stops picking
+       up files until one is done. A parse that fails without a result
+       (its arguments or result can't be pickled, or its worker died) or
+       that takes longer than parse_timeout seconds counts as failed.
+
+       If status_file is set, the counters in stats are written to it as
+       JSON after every poll, for monitoring. With a backend.writer.DbWriter
+       the imports are written through it, sharing its commit groups with
+       other producers."""
+    def __init__(self, directories, sessionmaker, pattern=PATTERNS,
+                 interval=5.0, settle=10.0, workers=2, max_in_flight=4,
+                 status_file=None, writer=None, parse_timeout=600,
+                 **options):
+        self.directories = directories
+        self.sessionmaker = sessionmaker
+        self.pattern = pattern
+        self.interval = interval
+        self.settle = settle
+        self.workers = workers
+        self.parse_timeout = parse_timeout
+        self.status_file = status_file
+        self.writer = writer
+        #Passed on to GPXImporter
+        self.options = options
+        self.slots = threading.Semaphore(max_in_flight)
+        self.writes = queue.Queue(max_in_flight)
+        self.stopping = threading.Event()
+        self.pool = None
+        self.threads = []
+        #path: (size, mtime, time first seen with that size and mtime)
+        self.pending = {}
+        #path: (size, mtime) of files already handled, kept while the file
+        #is there so it isn't hashed again on every poll
+        self.handled = {}
+        #SHA-1s of the files in flight; imported ones are in imported_files
+        self.hashes = set()
+        #sha1: (name, AsyncResult, deadline) of the files in the pool
+        self.parsing = {}
+        #Whether a parse ran out of time; the pool then has to be
+        #terminated, as it never forgets the task
+        self.timed_out = False
+        self.lock = threading.Lock()
+        self.stats = {'started': None, 'polls': 0, 'seen': 0,
+                      'duplicates': 0, 'in_flight': 0, 'imported': 0,
+                      'points': 0, 'failed': 0, 'last_error': None,
+                      'last_import': None}
+
+    def start(self):
+        """Start the watch and writer threads."""
+        self.stats['started'] = to_timestring(time.time())
+        if self.workers:
+            self.pool = multiprocessing.Pool(self.workers)
+        for target in (self.__watch, self.__write):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        """Stop watching, let the files in flight finish and wait for the
+           threads."""
+        self.stopping.set()
+        self.threads[0].join()
+        if self.pool:
+            self.pool.close()
+            while self.parsing:
+                time.sleep(CHECK_INTERVAL)
+            if self.timed_out:
+                self.pool.terminate()
+            else:
+                self.pool.join()
+        self.writes.put(None)
+        self.threads[1].join()
+        #Column files of results that never reached the writer
+        remove_shared()
+        self.write_status()
+
+    def run(self):
+        """Run until interrupted, e.g. from main.py."""
+        self.start()
+        try:
+            while not self.stopping.is_set():
+                self.stopping.wait(1.0)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def poll(self):
+        """Get the files that are ready to import, as (path, device_id).
+           Files that are gone are forgotten."""
+        now = time.time()
+        ready = []
+        present = set()
+        unlisted = []
+        for directory, device_id in sorted(self.directories.items()):
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                unlisted.append(os.path.join(directory, ''))
+                continue
+            patterns = self.pattern
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            for name in sorted(set(n for p in patterns
+                                   for n in fnmatch.filter(names, p))):
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                present.add(path)
+                key = (st.st_size, st.st_mtime)
+                if self.handled.get(path) == key:
+                    continue
+                self.handled.pop(path, None)
+                seen = self.pending.get(path)
+                if seen is None or seen[:2] != key:
+                    self.pending[path] = key + (now,)
+                elif now - seen[2] >= self.settle:
+                    del self.pending[path]
+                    self.handled[path] = key
+                    ready.append((path, device_id))
+        #Keep the entries of directories that couldn't be listed this time
+        unlisted = tuple(unlisted)
+        for entries in (self.pending, self.handled):
+            for path in list(entries):
+                if path not in present and not path.startswith(unlisted):
+                    del entries[path]
+        return ready
+
+    def is_imported(self, sha1):
+        session = self.sessionmaker()
+        try:
+            return session.query(TableImportedFile.id).filter(
+                    TableImportedFile.sha1 == sha1).first() is not None
+        finally:
+            session.close()
+
+    def write_status(self):
+        if not self.status_file:
+            return
+        with self.lock:
+            data = json.dumps(self.stats, indent=1, sort_keys=True)
+        tmp = self.status_file + '.tmp'
+        f = open(tmp, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmp, self.status_file)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def __watch(self):
+        while not self.stopping.is_set():
+            for path, device_id in self.poll():
+                try:
+                    members = gpx_members(path)
+                except Exception as e:
+                    self.count('seen')
+                    self.__failed(path, str(e))
+                    continue
+                for member in members:
+                    self.__start(path, member, device_id)
+                    if self.stopping.is_set():
+                        break
+                if self.stopping.is_set():
+                    break
+            self.count('polls')
+            self.write_status()
+            self.stopping.wait(self.interval)
+
+    def __start(self, path, member, device_id):
+        """Hash a file, or a member of an archive, and dispatch it unless
+           it was imported before."""
+        name = member_path(path, member)
+        self.count('seen')
+        try:
+            sha1 = file_hash(path, member)
+        except Exception as e:
+            self.__failed(name, str(e))
+            return
+        if sha1 in self.hashes or self.is_imported(sha1):
+            self.count('duplicates')
+            return
+        self.hashes.add(sha1)
+        #Blocks while max_in_flight files are busy
+        self.slots.acquire()
+        self.count('in_flight')
+        self.__dispatch(path, member, sha1, device_id)
+
+    def __dispatch(self, path, member, sha1, device_id):
+        noise_filter = self.options.get('noise_filter')
+        name = member_path(path, member)
+
+        def parsed(result):
+            if self.pool is not None:
+                with self.lock:
+                    if self.parsing.pop(sha1, None) is None:
+                        #Given up on by __check_parsing
+                        return
+            gpx, error = result
+            if gpx is None:
+                self.__done(name, sha1, error)
+            else:
+                self.writes.put((name, sha1, device_id, gpx))
+        if self.pool is None:
+            parsed(parse_file(path, noise_filter, member))
+        else:
+            deadline = time.time() + self.parse_timeout
+            with self.lock:
+                self.parsing[sha1] = (name, None, deadline)
+            result = self.pool.apply_async(parse_shared,
+                                           (path, noise_filter, member),
+                                           callback=parsed)
+            with self.lock:
+                if sha1 in self.parsing:
+                    self.parsing[sha1] = (name, result, deadline)
+
+    def __check_parsing(self):
+        """Release the slots of parses that failed without calling back, or
+           ran out of time."""
+        now = time.time()
+        failed = []
+        with self.lock:
+            for sha1, (name, result, deadline) in list(self.parsing.items()):
+                if result is None:
+                    continue
+                if result.ready():
+                    #A successful result has been passed to the callback
+                    if result.successful():
+                        continue
+                    try:
+                        result.get(0)
+                    except Exception as e:
+                        error = str(e) or e.__class__.__name__
+                elif now >= deadline:
+                    error = 'not parsed after %s s' % self.parse_timeout
+                    self.timed_out = True
+                else:
+                    continue
+                del self.parsing[sha1]
+                failed.append((name, sha1, error))
+        for name, sha1, error in failed:
+            self.__done(name, sha1, error)
+
+    def __write(self):
+        options = dict((k, v) for k, v in self.options.items()
+                       if k != 'noise_filter')
+        while True:
+            self.__check_parsing()
+            try:
+                item = self.writes.get(True, CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            path, sha1, device_id, gpx = item
+            importer = None
+            try:
+                gpx = load_result(gpx)
+                importer = GPXImporter(gpx, self.sessionmaker, path=path,
+                                       sha1=sha1, **options)
+                if self.writer:
+                    importer.save_to(self.writer, device_id).wait()
+                else:
+                    importer.save_gpx(device_id)
+            except Exception:
+                if importer is not None:
+                    importer.session.rollback()
+                self.__done(path, sha1,
+                            traceback.format_exc().splitlines()[-1])
+                continue
+            self.count('points', sum(t.get_num_points() for t in gpx.tracks))
+            with self.lock:
+                self.stats['last_import'] = path
+            self.__done(path, sha1)
+
+    def __done(self, path, sha1, error=None):
+        self.hashes.discard(sha1)
+        if error:
+            self.__failed(path, error)
+        else:
+            self.count('imported')
+        self.count('in_flight', -1)
+        self.slots.release()
+
+    def __failed(self, path, error):
+        with self.lock:
+            self.stats['failed'] += 1
+            self.stats['last_error'] = '%s: %s' % (path, error)
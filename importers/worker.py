@@ -0,0 +1,227 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import os
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from importers.gpx import GPXImporter
+
+STARTED = 'started'
+PROGRESS = 'progress'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+class ImportCancelled(Exception):
+    """Raised inside an import when its job has been cancelled"""
+    pass
+
+
+class ImportEvent:
+    """A notification about an ImportJob. The counts are a snapshot taken
+       when the event was sent, so handlers on other threads can read them
+       freely. error holds the traceback text of a FAILED job."""
+    def __init__(self, kind, job, error=None):
+        self.kind = kind
+        self.job = job
+        self.bytes_read = job.progress.bytes_read
+        self.total_bytes = job.progress.total_bytes
+        self.points_parsed = job.progress.points_parsed
+        self.rows_written = job.progress.rows_written
+        self.error = error
+
+    def get_fraction(self):
+        """Get a rough 0-1 completion estimate. Reading the file counts for
+           the first half, writing the points for the second."""
+        read = 0.0
+        if self.total_bytes:
+            read = min(1.0, float(self.bytes_read) / self.total_bytes)
+        elif self.points_parsed:
+            read = 1.0
+        written = 0.0
+        if self.points_parsed:
+            written = min(1.0, float(self.rows_written) / self.points_parsed)
+        return (read + written) / 2
+
+    def __repr__(self):
+        return "IMPORT - %s: %s, %s/%s bytes, %s points, %s rows" % (
+                    self.kind, self.job.file, self.bytes_read,
+                    self.total_bytes, self.points_parsed, self.rows_written)
+
+
+class ImportProgress:
+    """Counters an import updates as it goes. Every update checks for
+       cancellation and sends a PROGRESS event at most every interval
+       seconds."""
+    def __init__(self, job, interval=0.2):
+        self.job = job
+        self.interval = interval
+        self.bytes_read = 0
+        self.total_bytes = None
+        self.points_parsed = 0
+        self.rows_written = 0
+        self.last_sent = 0
+
+    def wrap(self, f):
+        """Count the bytes read from a file while it is parsed."""
+        try:
+            self.total_bytes = os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError):
+            pass
+        return ProgressFile(f, self)
+
+    def read(self, count):
+        self.bytes_read += count
+        self.update()
+
+    def parsed(self, count):
+        self.points_parsed += count
+        self.update()
+
+    def wrote(self, count):
+        self.rows_written += count
+        self.update()
+
+    def update(self):
+        if self.job.cancelled.is_set():
+            raise ImportCancelled()
+        now = time.time()
+        if now - self.last_sent >= self.interval:
+            self.last_sent = now
+            self.job.send(PROGRESS)
+
+
+class ProgressFile:
+    """File wrapper reporting reads to an ImportProgress"""
+    def __init__(self, f, progress):
+        self.f = f
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.progress.read(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class ImportJob:
+    """One file queued on an ImportWorker. options are passed on to
+       GPXImporter."""
+    def __init__(self, worker, file, device_id, options):
+        self.worker = worker
+        self.file = file
+        self.device_id = device_id
+        self.options = options
+        self.progress = ImportProgress(self)
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.state = None
+
+    def cancel(self):
+        """Ask the job to stop. A queued job is skipped; a running one stops
+           at its next progress update and rolls back."""
+        self.cancelled.set()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished, failed or been cancelled."""
+        self.done.wait(timeout)
+        return self.state
+
+    def send(self, kind, error=None):
+        self.worker.deliver(ImportEvent(kind, self, error))
+
+    def run(self, sessionmaker):
+        if self.cancelled.is_set():
+            self.finish(CANCELLED)
+            return
+        self.send(STARTED)
+        importer = None
+        try:
+            importer = GPXImporter(self.file, sessionmaker,
+                                   progress=self.progress, **self.options)
+            importer.save_gpx(self.device_id)
+        except ImportCancelled:
+            if importer is not None:
+                importer.session.rollback()
+            self.finish(CANCELLED)
+        except Exception:
+            if importer is not None:
+                importer.session.rollback()
+            self.finish(FAILED, traceback.format_exc())
+        else:
+            self.finish(FINISHED)
+
+    def finish(self, state, error=None):
+        self.state = state
+        self.send(state, error)
+        self.done.set()
+
+
+class ImportWorker:
+    """Run imports one at a time on a background thread so a GUI stays
+       responsive. At most max_pending jobs wait in the queue; submit blocks
+       (or raises queue.Full with block=False) when it is full.
+
+       Events go to notify, called on the worker thread; wrap a GUI handler
+       with wx_notify to have it run on the UI thread instead. Without
+       notify, events are put on the events queue for the UI to poll, e.g.
+       from a wx.Timer."""
+    def __init__(self, sessionmaker, notify=None, max_pending=8):
+        self.sessionmaker = sessionmaker
+        self.notify = notify
+        self.events = queue.Queue()
+        self.jobs = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, file, device_id, block=True, **options):
+        """Queue a file (or Gpx instance) for import, returning its
+           ImportJob."""
+        job = ImportJob(self, file, device_id, options)
+        self.jobs.put(job, block)
+        return job
+
+    def stop(self, wait=True):
+        """Let the queued jobs finish and end the worker thread."""
+        self.jobs.put(None)
+        if wait:
+            self.thread.join()
+
+    def deliver(self, event):
+        if self.notify is None:
+            self.events.put(event)
+        else:
+            self.notify(event)
+
+    def __run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            job.run(self.sessionmaker)
+            if hasattr(self.sessionmaker, 'remove'):
+                #scoped_session keeps a session per thread, close it
+                self.sessionmaker.remove()
+
+
+def wx_notify(handler):
+    """Get a notify function that calls handler(event) on the wx UI
+       thread."""
+    import wx
+
+    def notify(event):
+        wx.CallAfter(handler, event)
+    return notify
@@ -4,7 +4,8 @@
 @license: MIT
 '''
 
-import sqlalchemy
+import argparse
+
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 import wxversion
@@ -12,9 +13,37 @@ wxversion.select('2.9')
 import wx
 
 from importers.gpx import GPXImporter
+from importers.watch import WatchService
+from parsers.compressed import gpx_members
+from backend.engine import create_engine, BULK_LOAD, INTERACTIVE
+from backend.sqlite import create_tables
 
 if __name__ == '__main__':
-    engine = sqlalchemy.create_engine('sqlite:///records_v03', echo=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', default=['Current.gpx'])
+    parser.add_argument('--db', default='records_v03')
+    parser.add_argument('--device', type=int, default=1)
+    parser.add_argument('--watch', action='append', default=[],
+                        help='directory to import new files from')
+    parser.add_argument('--status', help='JSON status file for --watch')
+    parser.add_argument('--profile', choices=(BULK_LOAD, INTERACTIVE),
+                        default=INTERACTIVE,
+                        help='SQLite settings, default %s. %s is faster, '
+                             'but a power loss can corrupt the database' % (
+                            INTERACTIVE, BULK_LOAD))
+    parser.add_argument('--echo', action='store_true', help='log SQL')
+    parser.add_argument('--scan', action='store_true',
+                        help='scan plain track points without an XML parser')
+    args = parser.parse_args()
+    engine = create_engine(args.db, args.profile, echo=args.echo)
+    create_tables(engine)
     Sessionmaker = scoped_session(sessionmaker(bind=engine))
-    imp = GPXImporter('Current.gpx', Sessionmaker)
-    imp.save_gpx(1)
+    if args.watch:
+        WatchService(dict((d, args.device) for d in args.watch),
+                     Sessionmaker, status_file=args.status).run()
+    else:
+        for f in args.files:
+            for member in gpx_members(f):
+                imp = GPXImporter(f, Sessionmaker, scan=args.scan,
+                                  member=member)
+                imp.save_gpx(args.device)
@@ -1,8 +1,16 @@
 from xml.dom import minidom
 
+from parsers.compressed import open_gpx
+
 
 class BaseXmlParser:
-    """Base class for parsing XML data"""
+    """Base class for parsing XML data. Compressed files are read through
+       parsers.compressed.open_gpx."""
 
     def __init__(self, file):
-        self.raw_xml = minidom.parse(file)
+        f = open_gpx(file)
+        try:
+            self.raw_xml = minidom.parse(f)
+        finally:
+            if f is not file:
+                f.close()
@@ -0,0 +1,174 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import bz2
+import gzip
+import zipfile
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+GZIP = 'gzip'
+BZIP2 = 'bzip2'
+XZ = 'xz'
+ZIP = 'zip'
+#First bytes of each format
+MAGIC = ((b'\x1f\x8b', GZIP), (b'BZh', BZIP2), (b'\xfd7zXZ\x00', XZ),
+         (b'PK\x03\x04', ZIP))
+CHUNK = 1 << 16
+
+
+def compression(f):
+    """Get the compression of a seekable file from its first bytes, or None
+       for a plain file. The position is left at the start."""
+    head = f.read(6)
+    f.seek(0)
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def gpx_names(archive):
+    """Get the names of the GPX files in a zipfile.ZipFile."""
+    return [name for name in archive.namelist()
+            if name.lower().endswith('.gpx')
+            and not name.startswith('__MACOSX/')]
+
+
+def gpx_members(path):
+    """Get the names of the GPX files inside a zip archive, or [None] for
+       any other file."""
+    f = open(path, 'rb')
+    try:
+        if compression(f) != ZIP:
+            return [None]
+        archive = zipfile.ZipFile(f)
+        try:
+            return gpx_names(archive)
+        finally:
+            archive.close()
+    finally:
+        f.close()
+
+
+def member_path(path, member):
+    """Get the name to record for a file, or a member of an archive."""
+    if member is None:
+        return path
+    return '%s/%s' % (path, member)
+
+
+class DecompressedFile:
+    """Read-only file giving the decompressed content of another, for the
+       formats only available as one-shot decompressor objects (bz2 on
+       Python 2, xz). Concatenated streams are read one after another."""
+    def __init__(self, f, decompressor):
+        self.f = f
+        self.decompressor = decompressor
+        self.d = decompressor()
+        #Decompressed data, read up to pos; only the unread part is moved
+        #when more is added
+        self.buffer = bytearray()
+        self.pos = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or
+                                len(self.buffer) - self.pos < size):
+            if self.pos:
+                del self.buffer[:self.pos]
+                self.pos = 0
+            data = self.f.read(CHUNK)
+            if not data:
+                self.eof = True
+            while data:
+                try:
+                    self.buffer += self.d.decompress(data)
+                except EOFError:
+                    #Data after the end of a stream starts the next one
+                    self.d = self.decompressor()
+                    continue
+                data = self.d.unused_data
+                if data:
+                    self.d = self.decompressor()
+        if size < 0:
+            size = len(self.buffer) - self.pos
+        data = bytes(self.buffer[self.pos:self.pos + size])
+        self.pos += size
+        if self.pos >= len(self.buffer):
+            self.buffer = bytearray()
+            self.pos = 0
+        return data
+
+    def close(self):
+        self.buffer = bytearray()
+        self.pos = 0
+
+
+class GpxStream:
+    """The decompressed content of a GPX file or archive member, as a
+       read-only file. Closing it closes whatever open_gpx opened for it."""
+    def __init__(self, stream, name, opened):
+        self.stream = stream
+        self.name = name
+        self.opened = opened
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        for f in [self.stream] + self.opened:
+            f.close()
+
+
+def open_gpx(file, member=None):
+    """Open a path or seekable file for parsing. Compressed files (gzip,
+       bzip2, xz, zip) are detected by their first bytes and read through
+       a GpxStream that decompresses as it goes, without temporary files.
+       member is the name of a zip member; without one a zip must hold a
+       single GPX file. A plain file is returned as it is (opened, for a
+       path), as is a GpxStream."""
+    if isinstance(file, GpxStream):
+        return file
+    f = file
+    opened = []
+    if not hasattr(f, 'read'):
+        f = open(file, 'rb')
+        opened.append(f)
+    try:
+        kind = compression(f)
+        name = getattr(f, 'name', None)
+        if kind is None and member is None:
+            return f
+        elif kind == GZIP:
+            stream = gzip.GzipFile(fileobj=f, mode='rb')
+        elif kind == BZIP2:
+            stream = DecompressedFile(f, bz2.BZ2Decompressor)
+        elif kind == XZ:
+            if lzma is None:
+                raise IOError('%s is xz compressed, which needs the lzma '
+                              'module' % name)
+            stream = DecompressedFile(f, lzma.LZMADecompressor)
+        elif kind == ZIP:
+            archive = zipfile.ZipFile(f)
+            opened.insert(0, archive)
+            if member is None:
+                members = gpx_names(archive)
+                if len(members) != 1:
+                    raise ValueError('%s holds %d GPX files, choose one' % (
+                                     name, len(members)))
+                member = members[0]
+            stream = archive.open(member)
+            name = member_path(name, member)
+        else:
+            raise ValueError('%s is not an archive' % name)
+        return GpxStream(stream, name, opened)
+    except Exception:
+        for o in opened:
+            o.close()
+        raise
@@ -1,13 +1,48 @@
 from parsers.base import BaseXmlParser
+from processing.noise import NoiseReport
 import formats.gpx as GPX
 
+#Elements whose text repeats from point to point, kept as one shared string
+INTERNED = frozenset(['ele', 'sym', 'type', 'fix', 'sat', 'hdop', 'vdop',
+                      'pdop', 'src', 'text', 'gpxx:DisplayColor',
+                      'gpxx:DisplayMode', 'gpxx:Categories',
+                      'gpxx:Temperature', 'gpxx:Depth'])
+
 class GpxXmlParser(BaseXmlParser):
-    """Parser for GPX-formatted XML"""
+    """Parser for GPX-formatted XML. If a processing.noise.NoiseFilter is
+       given, every track segment is filtered as it is parsed and the totals
+       are kept in noise_report. A progress object (see
+       importers.worker.ImportProgress) is told how many points each parsed
+       segment had.
+
+       Equal values of the INTERNED elements, link hrefs and the creator
+       are all the same string object. strings is the dict used for this;
+       pass one in to share it between parsers, or intern=False to keep
+       every value separate.
+
+       With lazy, track points are formats.gpx.LazySegmentPoints that read
+       their fields from the XML only when first used. This saves most of
+       the work for code that only needs a few fields, but keeps the whole
+       document in memory while any point is not fully read.
+
+       segment_points is an iterator giving the points of every trkseg, in
+       document order, already parsed some other way (see
+       parsers.gpx_scan); a None from it means the trkseg's trkpt nodes are
+       parsed as usual."""
     data = None
 
-    def __init__(self,  file):
+    def __init__(self,  file, noise_filter=None, progress=None, strings=None,
+                 intern=True, lazy=False, segment_points=None):
         BaseXmlParser.__init__(self, file)
         self.gpx = GPX.Gpx()
+        self.noise_filter = noise_filter
+        self.progress = progress
+        self.noise_report = NoiseReport()
+        self.lazy = lazy
+        self.segment_points = segment_points
+        self.strings = None
+        if intern:
+            self.strings = {} if strings is None else strings
 
     def parse(self):
         """Currently only parses a .gpx file."""
@@ -25,7 +60,7 @@ class GpxXmlParser(BaseXmlParser):
         """Parse the top-level 'gpx' node."""
         #version and creator are attributes, not child nodes
         if root.hasAttribute('creator'):
-            self.gpx.creator = root.getAttribute('creator')
+            self.gpx.creator = self.__intern(root.getAttribute('creator'))
         if root.hasAttribute('version'):
             self.gpx.version = root.getAttribute('version')
         for node in root.childNodes:
@@ -47,7 +82,25 @@ class GpxXmlParser(BaseXmlParser):
                 self.__parse_bounds(node, self.gpx)
             #Failing all special cases, check attr against Gpx attr list
             elif hasattr(self.gpx, node.nodeName):
-                setattr(self.gpx, node.nodeName, node.nodeValue)
+                setattr(self.gpx, node.nodeName, self.__get_text(node))
+
+    def __get_text(self, node):
+        """Get the text content of an element node."""
+        return ''.join(c.data for c in node.childNodes
+                       if c.nodeType in (c.TEXT_NODE, c.CDATA_SECTION_NODE))
+
+    def __get_value(self, node):
+        """Get the text content of an element node, interned if it is one
+           of the INTERNED elements."""
+        if node.nodeName in INTERNED:
+            return self.__intern(self.__get_text(node))
+        return self.__get_text(node)
+
+    def __intern(self, value):
+        """Get the shared copy of a string."""
+        if self.strings is None:
+            return value
+        return self.strings.setdefault(value, value)
 
     def __parse_bounds(self, node, obj):
         """Parse a bounds node."""
@@ -61,10 +114,10 @@ class GpxXmlParser(BaseXmlParser):
         """Parse a link node."""
         link = GPX.Link()
         if node.hasAttribute('href'):
-            link.href = node.getAttribute('href')
+            link.href = self.__intern(node.getAttribute('href'))
         for n in node.childNodes:
             if hasattr(link, n.nodeName):
-                setattr(link, n.nodeName, n.nodeValue)
+                setattr(link, n.nodeName, self.__get_value(n))
         obj.link = link
 
     def __parse_copyright(self, node, obj):
@@ -74,7 +127,7 @@ class GpxXmlParser(BaseXmlParser):
             copyright.author = node.getAttribute('author')
         for n in node.childNodes:
             if hasattr(copyright, n.nodeName):
-                setattr(copyright, n.nodeName, n.nodeValue)
+                setattr(copyright, n.nodeName, self.__get_text(n))
         obj.copyright = copyright
 
     def __parse_email(self, node, obj):
@@ -93,7 +146,7 @@ class GpxXmlParser(BaseXmlParser):
         author = GPX.Author()
         for n in node.childNodes:
             if n.nodeName == 'name':
-                author.name = n.nodeValue
+                author.name = self.__get_text(n)
             elif n.nodeName == 'email':
                 self.__parse_email(author, n)
             elif n.nodeName == 'link':
@@ -114,7 +167,7 @@ class GpxXmlParser(BaseXmlParser):
                 self.__parse_bounds(n, obj)
             #Failing all special cases, check attr against Gpx attr list
             elif hasattr(obj, n.nodeName):
-                setattr(obj, n.nodeName, n.nodeValue)
+                setattr(obj, n.nodeName, self.__get_text(n))
 
     def __parse_wpt(self, node):
         """Parse waypoint node."""
@@ -129,7 +182,7 @@ class GpxXmlParser(BaseXmlParser):
             elif n.nodeName == 'extensions':
                 self.__parse_wpt_extensions(n, wpt)
             elif hasattr(wpt, n.nodeName):
-                setattr(wpt, n.nodeName, n.nodeValue)
+                setattr(wpt, n.nodeName, self.__get_value(n))
         if wpt.lat and wpt.lon:
             self.gpx.waypoints.append(wpt)
 
@@ -144,29 +197,31 @@ class GpxXmlParser(BaseXmlParser):
         """Parse GPXX-specific waypoint extensions."""
         for n in node.childNodes:
             if n.nodeName == 'gpxx:Proximity':
-                wpt.gpxx_proximity = n.nodeValue
+                wpt.gpxx_proximity = self.__get_text(n)
             elif n.nodeName == 'gpxx:Temperature':
-                wpt.gpxx_temperature = n.nodeValue
+                wpt.gpxx_temperature = self.__get_value(n)
             elif n.nodeName == 'gpxx:Depth':
-                wpt.gpxx_depth = n.nodeValue
+                wpt.gpxx_depth = self.__get_value(n)
             elif n.nodeName == 'gpxx:DisplayMode':
-                wpt.gpxx_displaymode = n.nodeValue
+                wpt.gpxx_displaymode = self.__get_value(n)
             elif n.nodeName == 'gpxx:Categories':
-                wpt.gpxx_categories = n.nodeValue
+                wpt.gpxx_categories = self.__get_value(n)
             elif n.nodeName == 'gpxx:Address':
                 address = GPX.Address()
                 if n.childNodes:
                     for c in n.childNodes:
+                        if c.nodeType != c.ELEMENT_NODE:
+                            continue
                         #Get text following 'gpxx:' in lowercase format
-                        name = c.nodeName.split(':')[1].lower()
+                        name = c.nodeName.split(':')[-1].lower()
                         if hasattr(address, name):
-                            setattr(address, name, c.nodeValue)
+                            setattr(address, name, self.__get_text(c))
                     wpt.gpxx_address = address
             elif n.nodeName == 'gpxx:PhoneNumber':
                 phone = GPX.PhoneNumber()
                 if n.hasAttribute('Category'):
                     phone.category = n.getAttribute('Category')
-                phone.number = n.nodeValue
+                phone.number = self.__get_text(n)
                 wpt.gpxx_phonenumber = phone
 
     def __parse_trk(self, node):
@@ -180,7 +235,7 @@ class GpxXmlParser(BaseXmlParser):
             elif n.nodeName == 'trkseg':
                 self.__parse_trkseg(n, track)
             elif hasattr(track, n.nodeName):
-                setattr(track, n.nodeName, n.nodeValue)
+                setattr(track, n.nodeName, self.__get_value(n))
         track.cleanup()
         if track.segments:
             self.gpx.tracks.append(track)
@@ -196,29 +251,48 @@ class GpxXmlParser(BaseXmlParser):
         """Parse GPXX-specific track extensions."""
         for n in node.childNodes:
             if n.nodeName == 'gpxx:DisplayColor':
-                track.gpxx_displaycolor = n.nodeValue
+                track.gpxx_displaycolor = self.__get_value(n)
 
     def __parse_trkseg(self, node, track):
         """Parse track segment"""
         trkseg = GPX.TrackSegment()
+        points = None
+        if self.segment_points is not None:
+            points = next(self.segment_points)
         for n in node.childNodes:
             if n.nodeName == 'trkpt':
                 self.__parse_trkseg_pt(n, trkseg)
             elif n.nodeName == 'extensions':
                 self.__parse_trkseg_extensions(n, trkseg)
             elif hasattr(trkseg, n.nodeName):
-                setattr(trkseg, n.nodeName, n.nodeValue)
+                setattr(trkseg, n.nodeName, self.__get_text(n))
+        if points is not None:
+            trkseg.points = points
+        if self.noise_filter:
+            trkseg, report = self.noise_filter.apply(trkseg)
+            self.noise_report.add(report)
         track.segments.append(trkseg)
+        if self.progress:
+            self.progress.parsed(len(trkseg.points))
 
     def __parse_trkseg_extensions(self, node, trkseg):
         """Parse track segment extensions"""
         for c in node.childNodes:
             if hasattr(trkseg, c.nodeName):
-                setattr(trkseg, c.nodeName, c.nodeValue)
+                setattr(trkseg, c.nodeName, self.__get_text(c))
 
     def __parse_trkseg_pt(self, node, trkseg):
         """Parse track segment point."""
-        trkpt = GPX.SegmentPoint()
+        if self.lazy:
+            trkpt = GPX.LazySegmentPoint(self.__decode_trkseg_pt, node)
+        else:
+            trkpt = GPX.SegmentPoint()
+            self.__fill_trkseg_pt(node, trkpt)
+        if trkpt.lat and trkpt.lon:
+            trkseg.points.append(trkpt)
+
+    def __fill_trkseg_pt(self, node, trkpt):
+        """Set the fields of a track point from its node."""
         if node.hasAttribute('lat'):
             trkpt.lat = node.getAttribute('lat')
         if node.hasAttribute('lon'):
@@ -229,9 +303,24 @@ class GpxXmlParser(BaseXmlParser):
             elif n.nodeName == 'extensions':
                 self.__parse_trkseg_pt_extensions(n, trkpt)
             elif hasattr(trkpt, n.nodeName):
-                setattr(trkpt, n.nodeName, n.nodeValue)
-        if trkpt.lat and trkpt.lon:
-            trkseg.points.append(trkpt)
+                setattr(trkpt, n.nodeName, self.__get_value(n))
+
+    def __decode_trkseg_pt(self, node, name):
+        """Decode fields of a lazy track point. lat, lon, ele and time are
+           read on their own; any other field fills in all of them."""
+        if name in ('lat', 'lon'):
+            if node.hasAttribute(name):
+                return {name: node.getAttribute(name)}
+            return {name: None}
+        if name in ('ele', 'time'):
+            value = None
+            for n in node.childNodes:
+                if n.nodeName == name:
+                    value = self.__get_value(n)
+            return {name: value}
+        trkpt = GPX.SegmentPoint()
+        self.__fill_trkseg_pt(node, trkpt)
+        return trkpt.__dict__
 
     def __parse_trkseg_pt_extensions(self, node, trkpt):
         """Parse track point extensions node."""
@@ -244,6 +333,6 @@ class GpxXmlParser(BaseXmlParser):
         """Parse GPXX-specific track point extensions."""
         for n in node.childNodes:
             if n.nodeName == 'gpxx:Temperature':
-                trkpt.gpxx_temperature = n.nodeValue
+                trkpt.gpxx_temperature = self.__get_value(n)
             elif n.nodeName == 'gpxx:Depth':
-                trkpt.gpxx_depth = n.nodeValue
+                trkpt.gpxx_depth = self.__get_value(n)
@@ -0,0 +1,162 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from io import BytesIO
+import mmap
+import os
+import re
+
+import formats.gpx as GPX
+from parsers.compressed import open_gpx, GpxStream
+from parsers.gpx import GpxXmlParser
+
+#Numbers and times as GPS devices write them; anything else is left to the
+#XML parser
+NUMBER = br'([-+]?[0-9]+(?:\.[0-9]+)?)'
+TIME = br'([0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(?:\.[0-9]+)?Z)'
+TRKPT = re.compile(br'\s*<trkpt lat="' + NUMBER + br'" lon="' + NUMBER +
+                   br'">(?:\s*<ele>' + NUMBER + br'</ele>)?(?:\s*<time>' +
+                   TIME + br'</time>)?\s*</trkpt>')
+TRKSEG = re.compile(br'<trkseg>(.*?)</trkseg>', re.S)
+TRKSEG_TAG = re.compile(br'<trkseg[\s/>]')
+#Markup that could hide elements from the scan, or add ones it can't see
+UNSAFE = (b'<!--', b'<![CDATA[', b'<!DOCTYPE', b'<!ENTITY')
+
+
+class GpxScanParser:
+    """Parser for GPX files that reads track points of the common
+       <trkpt lat=".." lon=".."><ele>..</ele><time>..</time></trkpt> shape
+       with a byte-level scan of a memory map of the file, and everything
+       else with GpxXmlParser, which then only has to build a document
+       without those points. A trkseg with any other kind of trkpt (more
+       fields, extensions, other number formats...) is left to
+       GpxXmlParser as a whole, and so is the whole file if it has
+       comments, CDATA or a DTD, or if the scanned trksegs don't match the
+       ones GpxXmlParser finds. fast_segments and slow_segments count the
+       trksegs read each way. A compressed file is decompressed into
+       memory and scanned there. The options are as for GpxXmlParser."""
+    def __init__(self, file, noise_filter=None, progress=None, strings=None,
+                 intern=True):
+        self.file = file
+        self.noise_filter = noise_filter
+        self.progress = progress
+        self.strings = None
+        if intern:
+            self.strings = {} if strings is None else strings
+        self.noise_report = None
+        self.fast_segments = 0
+        self.slow_segments = 0
+
+    def parse(self):
+        f = open_gpx(self.file)
+        try:
+            if isinstance(f, GpxStream):
+                data = f.read()
+            else:
+                data = self.__map(f)
+        finally:
+            if f is not self.file:
+                f.close()
+        parsed = 0
+        if self.progress:
+            parsed = self.progress.points_parsed
+        try:
+            scanned = self.__scan(data)
+            if scanned is not None:
+                segments, skeleton = scanned
+                gpx = self.__parse_xml(skeleton, segments)
+                if gpx is not None:
+                    return gpx
+            #The failed pass has reported the segments it parsed
+            if self.progress:
+                self.progress.points_parsed = parsed
+            self.fast_segments = 0
+            self.slow_segments = len(TRKSEG_TAG.findall(data))
+            return self.__parse_xml(data[:], None)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def __map(self, f):
+        """Map the file into memory, or read it if it can't be mapped."""
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if self.progress:
+                    self.progress.read(size)
+                return data
+        except (AttributeError, ValueError, EnvironmentError):
+            pass
+        return f.read()
+
+    def __parse_xml(self, data, segments):
+        """Parse with GpxXmlParser, given the scanned points of every
+           trkseg. Returns None if the trksegs don't match."""
+        points = None
+        if segments is not None:
+            points = iter(segments)
+        parser = GpxXmlParser(BytesIO(data), self.noise_filter, self.progress,
+                              self.strings, self.strings is not None,
+                              segment_points=points)
+        try:
+            gpx = parser.parse()
+        except StopIteration:
+            return None
+        if points is not None and list(points):
+            return None
+        self.noise_report = parser.noise_report
+        return gpx
+
+    def __scan(self, data):
+        """Scan the trksegs. Returns the points of each (None for those
+           left to the XML parser) and the file without them, or None if the
+           file can't be scanned."""
+        for marker in UNSAFE:
+            if data.find(marker) >= 0:
+                return None
+        segments = []
+        pieces = []
+        last = 0
+        for m in TRKSEG.finditer(data):
+            start, end = m.span(1)
+            points, stop = self.__scan_points(data, start, end)
+            segments.append(points)
+            if points is None:
+                self.slow_segments += 1
+            else:
+                self.fast_segments += 1
+                pieces.append(data[last:start])
+                last = stop
+        if len(segments) != len(TRKSEG_TAG.findall(data)):
+            return None
+        pieces.append(data[last:])
+        return segments, b''.join(pieces)
+
+    def __scan_points(self, data, start, end):
+        """Read the trkpts at the start of a trkseg's content. Returns them
+           and where they end, or None if there are others."""
+        points = []
+        pos = start
+        match = TRKPT.match
+        m = match(data, pos, end)
+        while m is not None:
+            lat, lon, ele, time = m.groups()
+            p = GPX.SegmentPoint(lat.decode('ascii'), lon.decode('ascii'))
+            if ele is not None:
+                p.ele = self.__intern(ele.decode('ascii'))
+            if time is not None:
+                p.time = time.decode('ascii')
+            points.append(p)
+            pos = m.end()
+            m = match(data, pos, end)
+        if data.find(b'<trkpt', pos, end) >= 0:
+            return None, start
+        return points, pos
+
+    def __intern(self, value):
+        if self.strings is None:
+            return value
+        return self.strings.setdefault(value, value)
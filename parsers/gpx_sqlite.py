@@ -1,12 +1,16 @@
 from backend.sqlite import *
+from backend.strings import StringDictionary
 from parsers.base_db import BaseDbParser
-from formats.gpx import Gpx
+from formats.gpx import Gpx, Waypoint, Track, TrackSegment, SegmentPoint
 
 class GpxSqliteParser(BaseDbParser):
-    """Populate GPX instance from am SQLite database"""
+    """Populate GPX instance from am SQLite database. Text stored as ids
+       of strings rows is decoded; rows from older versions keep it in the
+       text columns."""
     def __init__(self, session):
         BaseDbParser.__init__(self, session)
         self.gpxs = []
+        self.strings = StringDictionary(session)
 
     def parse(self):
         self.__parse()
@@ -16,8 +20,14 @@ class GpxSqliteParser(BaseDbParser):
         gpxs = self.session.query(TableGpx)
         if gpxs is None:
             return None
+        self.strings.load()
         for g in gpxs:
-            self.__parse_gpx(g)
+            self.gpxs.append(self.__parse_gpx(g))
+
+    def __decode(self, row, name):
+        """Get a text field stored either as a strings id or as text."""
+        return self.strings.decode(getattr(row, name + '_id'),
+                                   getattr(row, name))
 
     def __parse_gpx(self, g):
         gpx = Gpx()
@@ -43,13 +53,14 @@ class GpxSqliteParser(BaseDbParser):
         gpx.bounds.minlon = g.bounds_minlon
         gpx.bounds.maxlat = g.bounds_maxlat
         gpx.bounds.maxlon = g.bounds_maxlon
-        gpx.device.id = g.device.id
-        gpx.device.make = g.device.make
-        gpx.device.model = g.device.model
-        gpx.device.serial = g.device.serial
-        gpx.device.purchase_date = g.device.purchase_date
-        gpx.device.is_active = g.device.is_active
-        gpx.device.data_type = g.device.data_type
+        gpx.device.id = g.device_id
+        if g.device:
+            gpx.device.make = g.device.make
+            gpx.device.model = g.device.model
+            gpx.device.serial = g.device.serial
+            gpx.device.purchase_date = g.device.purchase_date
+            gpx.device.is_active = g.device.is_active
+            gpx.device.data_type = g.device.data_type
         for w in g.waypoints:
             gpx.waypoints.append(self.__parse_waypoint(g.id, w))
         for t in g.tracks:
@@ -58,7 +69,7 @@ class GpxSqliteParser(BaseDbParser):
         return gpx
 
     def __parse_waypoint(self, gpx_id, w):
-        wpt = WayPoint()
+        wpt = Waypoint()
         wpt.id = w.id
         wpt.gpx_id = w.gpx_id
         wpt.lat = w.lat
@@ -70,12 +81,12 @@ class GpxSqliteParser(BaseDbParser):
         wpt.name = w.name
         wpt.cmt = w.cmt
         wpt.desc = w.desc
-        wpt.link.href = w.link_href
-        wpt.link.text = w.link_text
-        wpt.link.type = w.link_type
-        wpt.sym = w.sym
-        wpt.type = w.type
-        wpt.fix = w.fix.value
+        wpt.link.href = self.__decode(w, 'link_href')
+        wpt.link.text = self.__decode(w, 'link_text')
+        wpt.link.type = self.__decode(w, 'link_type')
+        wpt.sym = self.__decode(w, 'sym')
+        wpt.type = self.__decode(w, 'type')
+        wpt.fix = w.fix.value if w.fix else None
         wpt.sat = w.sat
         wpt.hdop = w.hdop
         wpt.vdop = w.vdop
@@ -85,8 +96,8 @@ class GpxSqliteParser(BaseDbParser):
         wpt.gpxx_proximity = w.gpxx_proximity
         wpt.gpxx_temperature = w.gpxx_temperature
         wpt.gpxx_depth = w.gpxx_depth
-        wpt.gpxx_displaymode = w.displaymode.value
-        wpt.gpxx_categories = w.gpxx_categories
+        wpt.gpxx_displaymode = w.displaymode.value if w.displaymode else None
+        wpt.gpxx_categories = self.__decode(w, 'gpxx_categories')
         wpt.gpxx_address.streetaddress = w.gpxx_address_streetaddress
         wpt.gpxx_address.city = w.gpxx_address_city
         wpt.gpxx_address.state = w.gpxx_address_state
@@ -97,6 +108,52 @@ class GpxSqliteParser(BaseDbParser):
         return wpt
 
     def __parse_tracks(self, gpx_id, t):
-        trk = Track()
-
+        trk = Track(t.name)
+        trk.id = t.id
+        trk.desc = t.desc
+        trk.cmt = t.cmt
+        trk.src = t.src
+        trk.number = t.number
+        trk.link.href = t.link_href
+        trk.link.text = t.link_text
+        trk.link.type = t.link_type
+        trk.type = self.__decode(t, 'type')
+        if t.displaycolor:
+            trk.gpxx_displaycolor = t.displaycolor.value
+        for s in sorted(t.segments, key=lambda s: s.id):
+            trk.segments.append(self.__parse_segment(s))
         return trk
+
+    def __parse_segment(self, s):
+        seg = TrackSegment()
+        seg.id = s.id
+        points = self.session.query(TableSegmentPoint).filter(
+                TableSegmentPoint.segment_id == s.id).order_by(
+                TableSegmentPoint.id)
+        seg.points = [self.__parse_point(p) for p in points]
+        return seg
+
+    def __parse_point(self, p):
+        pt = SegmentPoint(p.lat, p.lon, p.ele)
+        pt.id = p.id
+        pt.time = p.time
+        pt.magvar = p.magvar
+        pt.geoidheight = p.geoidheight
+        pt.name = p.name
+        pt.cmt = p.cmt
+        pt.desc = p.desc
+        pt.link.href = self.__decode(p, 'link_href')
+        pt.link.text = self.__decode(p, 'link_text')
+        pt.link.type = self.__decode(p, 'link_type')
+        pt.sym = self.__decode(p, 'sym')
+        pt.type = self.__decode(p, 'type')
+        pt.fix = p.fix.value if p.fix else None
+        pt.sat = p.sat
+        pt.hdop = p.hdop
+        pt.vdop = p.vdop
+        pt.pdop = p.pdop
+        pt.ageofdgpsdata = p.ageofdgpsdata
+        pt.dgpsid = p.dgpsid
+        pt.gpxx_temperature = p.gpxx_temperature
+        pt.gpxx_depth = p.gpxx_depth
+        return pt
@@ -0,0 +1,45 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from processing.geo import to_timestamp
+
+#Mersenne prime modulus and base of the rolling coordinate hash
+PRIME = (1 << 61) - 1
+BASE = 1000003
+
+
+def rolling_hash(points):
+    """Hash the coordinates of a list of points, in order, rounded to
+       micro-degrees so formatting differences don't matter."""
+    h = 0
+    for p in points:
+        for value in (p.lat, p.lon):
+            h = (h * BASE + int(round(float(value) * 1e6)) % PRIME) % PRIME
+    return h
+
+
+class SegmentDigest:
+    """What identifies a segment for deduplication: the point count, the
+       first and last time and position, and a rolling hash of all the
+       coordinates."""
+    def __init__(self, points):
+        self.num_points = len(points)
+        first = points[0] if points else None
+        last = points[-1] if points else None
+        self.first_time = to_timestamp(first.time) if first else None
+        self.last_time = to_timestamp(last.time) if last else None
+        self.first_lat = float(first.lat) if first else None
+        self.first_lon = float(first.lon) if first else None
+        self.last_lat = float(last.lat) if last else None
+        self.last_lon = float(last.lon) if last else None
+        self.coord_hash = rolling_hash(points)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return "DIGEST - points: %s, from %s to %s, hash: %x" % (
+                    self.num_points, self.first_time, self.last_time,
+                    self.coord_hash)
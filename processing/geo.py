@@ -0,0 +1,139 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from array import array
+import calendar
+import math
+import time
+
+#WGS84 mean value for earth's radius, same as Point.distance_to_point
+EARTH_RADIUS = 6371009
+
+
+def to_float(value):
+    """Convert a stored coordinate (usually a string) to a float, or None."""
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+#Epoch seconds of each date seen by to_timestamp, points share a handful
+_days = {}
+
+
+def to_timestamp(value):
+    """Convert a GPX time string (e.g. 2011-06-25T16:14:05Z, or with
+       fractional seconds and a +hh:mm/-hh:mm offset) to seconds since the
+       epoch, or None if it is missing or malformed. A time without a zone
+       is taken as UTC."""
+    if not value:
+        return None
+    try:
+        day = _days.get(value[:10])
+        if day is None:
+            day = calendar.timegm((int(value[0:4]), int(value[5:7]),
+                                   int(value[8:10]), 0, 0, 0, 0, 0, 0))
+            _days[value[:10]] = day
+        seconds = (day + int(value[11:13]) * 3600 + int(value[14:16]) * 60 +
+                   int(value[17:19]))
+    except (ValueError, TypeError):
+        return None
+    zone = value[19:]
+    if zone[:1] == '.':
+        end = 1
+        while end < len(zone) and zone[end].isdigit():
+            end += 1
+        if end == 1:
+            return None
+        seconds += float('0' + zone[:end])
+        zone = zone[end:]
+    if zone in ('', 'Z'):
+        return seconds
+    if (len(zone) == 6 and zone[0] in '+-' and zone[3] == ':' and
+            zone[1:3].isdigit() and zone[4:6].isdigit()):
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        if zone[0] == '+':
+            return seconds - offset
+        return seconds + offset
+    return None
+
+
+def to_timestring(seconds):
+    """Convert seconds since the epoch to a GPX time string."""
+    whole = int(math.floor(seconds))
+    text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(whole))
+    fraction = seconds - whole
+    if fraction >= 0.0005:
+        text += ('%.3f' % fraction)[1:]
+    return text + 'Z'
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between two lat/lon pairs (degrees)."""
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    d_lat = lat2 - lat1
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat/2) * math.sin(d_lat/2) +
+         math.cos(lat1) * math.cos(lat2) *
+         math.sin(d_lon/2) * math.sin(d_lon/2))
+    return EARTH_RADIUS * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+
+def coordinate_columns(points):
+    """Get the lat and lon of a list of points as two float arrays."""
+    lats = array('d', [float(p.lat) for p in points])
+    lons = array('d', [float(p.lon) for p in points])
+    return lats, lons
+
+
+def project(lats, lons, ref_lat=None):
+    """Project lat/lon columns onto a local plane measured in metres. Uses an
+       equirectangular projection around ref_lat, which is accurate enough
+       for the few kilometres that separate neighbouring track points."""
+    if ref_lat is None:
+        ref_lat = (min(lats) + max(lats)) / 2 if lats else 0.0
+    kx = math.radians(1) * EARTH_RADIUS * math.cos(math.radians(ref_lat))
+    ky = math.radians(1) * EARTH_RADIUS
+    xs = array('d', [lon * kx for lon in lons])
+    ys = array('d', [lat * ky for lat in lats])
+    return xs, ys
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    """Distance from point p to the line segment a-b on the projected plane."""
+    dx = bx - ax
+    dy = by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+    if t < 0:
+        t = 0
+    elif t > 1:
+        t = 1
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def triangle_area(ax, ay, bx, by, cx, cy):
+    """Area of the triangle between three projected points."""
+    return abs((bx - ax) * (cy - ay) - (cx - ax) * (by - ay)) / 2.0
+
+
+def pack_doubles(values):
+    """Pack a sequence of floats into a byte string for BLOB columns."""
+    a = array('d', values)
+    if hasattr(a, 'tobytes'):
+        return a.tobytes()
+    return a.tostring()
+
+
+def unpack_doubles(data):
+    """Unpack a byte string created by pack_doubles."""
+    a = array('d')
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    return a
@@ -0,0 +1,82 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from array import array
+import math
+
+#Web Mercator zoom levels kept in the heatmap grid
+HEATMAP_ZOOMS = (4, 8, 12, 16)
+#Cells along each side of a 256 pixel tile
+TILE_CELLS = 64
+#Mercator stops making sense past this latitude
+MAX_LAT = 85.0511287798
+
+
+def cell_xy(lat, lon, zoom, tile_cells=TILE_CELLS):
+    """Get the global (x, y) heatmap cell of a location at a zoom level.
+       Cell (x, y) lies in tile (x // tile_cells, y // tile_cells)."""
+    size = (1 << zoom) * tile_cells
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    s = math.sin(math.radians(lat))
+    x = int((lon + 180.0) / 360.0 * size)
+    y = int((0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * size)
+    return min(max(x, 0), size - 1), min(max(y, 0), size - 1)
+
+
+def count_cells(rows, zooms=HEATMAP_ZOOMS, tile_cells=TILE_CELLS):
+    """Aggregate (lat, lon, time) rows into {(zoom, x, y): [count, last]}
+       where last is the latest time string seen in the cell."""
+    cells = {}
+    for lat, lon, time in rows:
+        try:
+            lat = float(lat)
+            lon = float(lon)
+        except (TypeError, ValueError):
+            continue
+        for zoom in zooms:
+            key = (zoom,) + cell_xy(lat, lon, zoom, tile_cells)
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [1, time]
+            else:
+                cell[0] += 1
+                if time is not None and (cell[1] is None or time > cell[1]):
+                    cell[1] = time
+    return cells
+
+
+def merge_cells(cells, other):
+    """Fold the counts of another count_cells result into cells."""
+    for key, (count, last) in other.items():
+        cell = cells.get(key)
+        if cell is None:
+            cells[key] = [count, last]
+        else:
+            cell[0] += count
+            if last is not None and (cell[1] is None or last > cell[1]):
+                cell[1] = last
+    return cells
+
+
+def shade(counts, max_count=None):
+    """Turn tile counts into RGB bytes, ready for wx.ImageFromBuffer. The
+       colour is log scaled so a few busy cells don't wash out the rest;
+       empty cells are black."""
+    if max_count is None:
+        max_count = max(counts) if counts else 0
+    scale = math.log(max_count + 1) if max_count > 0 else 1.0
+    data = bytearray(3 * len(counts))
+    for i, c in enumerate(counts):
+        if c:
+            v = min(1.0, math.log(c + 1) / scale)
+            data[3 * i] = int(255 * min(1.0, 2 * v))
+            data[3 * i + 1] = int(255 * max(0.0, 2 * v - 1))
+            data[3 * i + 2] = int(64 * (1 - v))
+    return data
+
+
+def empty_tile(tile_cells=TILE_CELLS):
+    """Get a zeroed row-major count array for one tile."""
+    return array('I', [0]) * (tile_cells * tile_cells)
@@ -0,0 +1,66 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from processing.geo import coordinate_columns, haversine
+from processing.simplify import simplify_points
+
+#Tolerance in metres for each level of detail, finest first. Each level is
+#built from the one before it, so every level is a subset of the previous,
+#and no level is further than its tolerance from the full-resolution points.
+LOD_TOLERANCES = (2, 8, 32, 128, 512, 2048)
+
+
+class LodLevel:
+    """One simplified level of a segment's LOD pyramid. The bounding box is
+       the one of the points the level was built from (given as
+       full_lats/full_lons), not of the level's own points, so a coarse level
+       is found by the same viewports as the segment it stands for."""
+    def __init__(self, level, tolerance, lats, lons, full_lats=None,
+                 full_lons=None):
+        self.level = level
+        self.tolerance = tolerance
+        self.lats = lats
+        self.lons = lons
+        if full_lats is None:
+            full_lats, full_lons = lats, lons
+        self.minlat = min(full_lats) if full_lats else None
+        self.maxlat = max(full_lats) if full_lats else None
+        self.minlon = min(full_lons) if full_lons else None
+        self.maxlon = max(full_lons) if full_lons else None
+
+    def get_extent(self):
+        """Get the larger side of the bounding box, in metres."""
+        if self.minlat is None:
+            return 0
+        mid_lat = (self.minlat + self.maxlat) / 2
+        return max(haversine(self.minlat, self.minlon,
+                             self.maxlat, self.minlon),
+                   haversine(mid_lat, self.minlon, mid_lat, self.maxlon))
+
+
+def build_pyramid(points, tolerances=LOD_TOLERANCES):
+    """Get the LOD levels for a list of points. Each level is simplified from
+       the previous one with what is left of its tolerance, so the errors of
+       the levels don't add up."""
+    full_lats, full_lons = coordinate_columns(points)
+    levels = []
+    error = 0
+    for level, tolerance in enumerate(tolerances):
+        points = simplify_points(points, max(tolerance - error, 0))
+        error = max(tolerance, error)
+        lats, lons = coordinate_columns(points)
+        levels.append(LodLevel(level, tolerance, lats, lons,
+                               full_lats, full_lons))
+    return levels
+
+
+def choose_level(metres_per_pixel, tolerances=LOD_TOLERANCES):
+    """Get the coarsest level whose error stays under half a pixel, or None
+       if the view needs the full-resolution points."""
+    best = None
+    for level, tolerance in enumerate(tolerances):
+        if tolerance <= metres_per_pixel / 2.0:
+            best = level
+    return best
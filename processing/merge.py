@@ -0,0 +1,138 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import heapq
+
+from formats.gpx import Gpx, Track, TrackSegment
+from processing.geo import to_timestamp
+
+
+class MergeReport:
+    """Counts of the points read and dropped by merge_points"""
+    def __init__(self):
+        self.total = 0
+        self.duplicates = 0
+        self.untimed = 0
+        self.late = 0
+
+    def __repr__(self):
+        return "MERGE - total: %s, duplicates: %s, untimed: %s, late: %s" % (
+                    self.total, self.duplicates, self.untimed, self.late)
+
+
+def timestamped(points, report):
+    """Yield (timestamp, point) pairs, leaving out points without a time."""
+    for p in points:
+        report.total += 1
+        t = to_timestamp(p.time)
+        if t is None:
+            report.untimed += 1
+            continue
+        yield t, p
+
+
+def timed_points(points, report=None):
+    """Yield (timestamp, point) pairs in time order, reading points only as
+       they are needed. Points without a time are left out. Segments are
+       nearly always in order already, so nothing is buffered until a point
+       goes back in time; the rest of the segment is then read and sorted.
+       Points earlier than one already yielded are left out as late."""
+    if report is None:
+        report = MergeReport()
+    points = timestamped(points, report)
+    pending = None
+    last = None
+    for t, p in points:
+        if pending is not None and t < pending[0]:
+            rest = [pending, (t, p)]
+            rest.extend(points)
+            rest.sort(key=lambda tp: tp[0])
+            for tp in rest:
+                if last is not None and tp[0] < last:
+                    report.late += 1
+                else:
+                    yield tp
+            return
+        if pending is not None:
+            yield pending
+            last = pending[0]
+        pending = (t, p)
+    if pending is not None:
+        yield pending
+
+
+def merge_points(streams, report=None):
+    """Yield the points of several time-ordered iterables of points as one
+       time-ordered stream, in O(n log k) for k streams. Each stream is read
+       one point at a time as the merge reaches it. A point at the same time
+       and position as one already yielded is a duplicate and dropped. Ties
+       keep the order of the streams."""
+    if report is None:
+        report = MergeReport()
+    heap = []
+    for k, points in enumerate(streams):
+        timed = timed_points(points, report)
+        for t, p in timed:
+            heap.append((t, k, p, timed))
+            break
+    heapq.heapify(heap)
+    current = None
+    seen = set()
+    while heap:
+        t, k, p, timed = heap[0]
+        following = next(timed, None)
+        if following is not None:
+            heapq.heapreplace(heap, (following[0], k, following[1], timed))
+        else:
+            heapq.heappop(heap)
+        if t != current:
+            current = t
+            seen = set()
+        key = (round(float(p.lat), 6), round(float(p.lon), 6))
+        if key in seen:
+            report.duplicates += 1
+            continue
+        seen.add(key)
+        yield p
+
+
+def merge_tracks(tracks, report=None):
+    """Yield the points of several Tracks as one time-ordered stream, one
+       stream per segment."""
+    return merge_points([s.points for t in tracks for s in t.segments],
+                        report)
+
+
+def merge_gpx(gpxs, name=None, max_gap=None, report=None):
+    """Merge the tracks of several Gpx instances into a new Gpx with a
+       single track, e.g. for GPXImporter. Points more than max_gap seconds
+       apart start a new segment. Waypoints are concatenated, leaving out
+       repeats of the same name and position."""
+    merged = Gpx()
+    if gpxs:
+        merged.creator = gpxs[0].creator
+        merged.version = gpxs[0].version
+        merged.device = gpxs[0].device
+    merged.name = name
+    track = Track(name)
+    segment = None
+    last = None
+    for p in merge_tracks([t for g in gpxs for t in g.tracks], report):
+        t = to_timestamp(p.time)
+        if segment is None or (max_gap is not None and t - last > max_gap):
+            segment = TrackSegment()
+            track.segments.append(segment)
+        segment.points.append(p)
+        last = t
+    merged.tracks = [track]
+    seen = set()
+    for g in gpxs:
+        for w in g.waypoints:
+            key = (w.name, w.lat, w.lon)
+            if key not in seen:
+                seen.add(key)
+                merged.waypoints.append(w)
+    merged.cleanup()
+    return merged
@@ -0,0 +1,195 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from array import array
+import math
+
+from processing.geo import EARTH_RADIUS, to_float, to_timestamp
+
+NAN = float('nan')
+#Slower than this (m/s) counts as stopped for moving time
+MIN_MOVING_SPEED = 0.5
+#Number of points in the elevation moving average
+ELEVATION_WINDOW = 5
+#Elevation has to change this much (metres) to count as ascent/descent
+ELEVATION_THRESHOLD = 2.0
+#Grades over shorter steps (metres) are mostly elevation noise
+MIN_GRADE_DISTANCE = 5.0
+
+
+def point_columns(points):
+    """Get the times (epoch seconds), lats, lons and elevations of a list of
+       points as float arrays, with NaN for missing times and elevations."""
+    times = array('d', [NAN if t is None else t for t in
+                        [to_timestamp(p.time) for p in points]])
+    lats = array('d', [float(p.lat) for p in points])
+    lons = array('d', [float(p.lon) for p in points])
+    eles = array('d', [NAN if e is None else e for e in
+                       [to_float(p.ele) for p in points]])
+    return times, lats, lons, eles
+
+
+def steps(lats, lons):
+    """Get the great-circle distance and initial heading (degrees) from each
+       point to the next, computed column by column."""
+    rlat = [math.radians(v) for v in lats]
+    rlon = [math.radians(v) for v in lons]
+    cos_lat = [math.cos(v) for v in rlat]
+    sin_lat = [math.sin(v) for v in rlat]
+    d_lat = [b - a for a, b in zip(rlat, rlat[1:])]
+    d_lon = [b - a for a, b in zip(rlon, rlon[1:])]
+    a = [math.sin(dy/2) ** 2 + c1 * c2 * math.sin(dx/2) ** 2
+         for dy, dx, c1, c2 in zip(d_lat, d_lon, cos_lat, cos_lat[1:])]
+    distances = [2 * EARTH_RADIUS * math.atan2(math.sqrt(v), math.sqrt(1-v))
+                 for v in a]
+    headings = [math.degrees(math.atan2(math.sin(dx) * c2,
+                                        c1 * s2 - s1 * c2 * math.cos(dx)))
+                % 360 if d else NAN
+                for dx, c1, c2, s1, s2, d in zip(d_lon, cos_lat, cos_lat[1:],
+                                                 sin_lat, sin_lat[1:],
+                                                 distances)]
+    return distances, headings
+
+
+def smooth(values, window=ELEVATION_WINDOW):
+    """Centred moving average that skips NaN values, using running sums."""
+    sums = [0.0]
+    counts = [0]
+    for v in values:
+        if v == v:
+            sums.append(sums[-1] + v)
+            counts.append(counts[-1] + 1)
+        else:
+            sums.append(sums[-1])
+            counts.append(counts[-1])
+    n = len(values)
+    half = window // 2
+    result = array('d')
+    for i in range(n):
+        lo = max(0, i - half)
+        hi = min(n, i + half + 1)
+        c = counts[hi] - counts[lo]
+        result.append((sums[hi] - sums[lo]) / c if c else NAN)
+    return result
+
+
+class Metrics:
+    """Summary statistics for a track or segment"""
+    def __init__(self):
+        self.num_points = 0
+        self.distance = 0.0
+        self.start_time = None
+        self.end_time = None
+        self.elapsed_time = 0.0
+        self.moving_time = 0.0
+        self.max_speed = 0.0
+        self.ascent = 0.0
+        self.descent = 0.0
+        self.min_ele = None
+        self.max_ele = None
+        self.min_grade = None
+        self.max_grade = None
+
+    def get_avg_speed(self):
+        """Get the average speed over the elapsed time, in m/s."""
+        if self.elapsed_time:
+            return self.distance / self.elapsed_time
+        return 0.0
+
+    def get_avg_moving_speed(self):
+        """Get the average speed while moving, in m/s."""
+        if self.moving_time:
+            return self.distance / self.moving_time
+        return 0.0
+
+    def add(self, other):
+        """Fold the statistics of another segment into this instance. The
+           elapsed time runs from the earliest start to the latest end, gaps
+           between segments included, as in processing.summary.Summary."""
+        self.num_points += other.num_points
+        self.distance += other.distance
+        self.moving_time += other.moving_time
+        self.ascent += other.ascent
+        self.descent += other.descent
+        self.max_speed = max(self.max_speed, other.max_speed)
+        for name, pick in (('start_time', min), ('end_time', max),
+                           ('min_ele', min), ('max_ele', max),
+                           ('min_grade', min), ('max_grade', max)):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            if theirs is not None:
+                setattr(self, name,
+                        theirs if mine is None else pick(mine, theirs))
+        if self.start_time is not None and self.end_time is not None:
+            self.elapsed_time = self.end_time - self.start_time
+
+
+class SegmentMetrics(Metrics):
+    """Per-point series and summary statistics for one segment. Every series
+       has one value per point; values describing the step from the previous
+       point are NaN for the first point, or where data is missing."""
+    def __init__(self, points, min_moving_speed=MIN_MOVING_SPEED,
+                 window=ELEVATION_WINDOW, threshold=ELEVATION_THRESHOLD):
+        Metrics.__init__(self)
+        times, lats, lons, eles = point_columns(points)
+        distances, headings = steps(lats, lons)
+        self.num_points = len(times)
+        self.times = times
+        self.lats = lats
+        self.lons = lons
+        self.raw_elevations = eles
+        self.time_deltas = array('d', [NAN] + [b - a for a, b in
+                                               zip(times, times[1:])])
+        self.distances = array('d', [NAN] + distances)
+        self.headings = array('d', [NAN] + headings)
+        self.speeds = array('d', [d / t if t > 0 else NAN for d, t in
+                                  zip(self.distances, self.time_deltas)])
+        self.elevations = smooth(eles, window)
+        self.grades = array('d', [NAN] + [
+                (b - a) / d if d >= MIN_GRADE_DISTANCE else NAN
+                for a, b, d in zip(self.elevations, self.elevations[1:],
+                                   distances)])
+        self.__summarize(min_moving_speed, threshold)
+
+    def __summarize(self, min_moving_speed, threshold):
+        """Reduce the series to the summary statistics."""
+        self.distance = sum(self.distances[1:])
+        valid = [t for t in self.times if t == t]
+        if valid:
+            self.start_time = min(valid)
+            self.end_time = max(valid)
+            self.elapsed_time = self.end_time - self.start_time
+        speeds = [s for s in self.speeds if s == s]
+        if speeds:
+            self.max_speed = max(speeds)
+        self.moving_time = sum(t for s, t in zip(self.speeds,
+                                                 self.time_deltas)
+                               if s == s and s >= min_moving_speed)
+        grades = [g for g in self.grades if g == g]
+        if grades:
+            self.min_grade = min(grades)
+            self.max_grade = max(grades)
+        eles = [e for e in self.elevations if e == e]
+        if not eles:
+            return
+        self.min_ele = min(eles)
+        self.max_ele = max(eles)
+        #Only count a climb or descent once it passes the threshold, so the
+        #remaining jitter doesn't add up over long segments.
+        ref = eles[0]
+        for e in eles:
+            if e - ref >= threshold:
+                self.ascent += e - ref
+                ref = e
+            elif ref - e >= threshold:
+                self.descent += ref - e
+                ref = e
+
+
+def combine(metrics):
+    """Get the combined summary statistics of several segments."""
+    total = Metrics()
+    for m in metrics:
+        total.add(m)
+    return total
@@ -0,0 +1,233 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from array import array
+from copy import copy
+import math
+
+from processing.geo import coordinate_columns, haversine, project, to_float, \
+                           to_timestamp, EARTH_RADIUS
+
+NAN = float('nan')
+#Rough user-equivalent range error in metres, scaled by hdop for smoothing
+UERE = 5.0
+
+DOP = 'dop'
+SATELLITES = 'sat'
+SPEED = 'speed'
+ACCELERATION = 'acceleration'
+#Points in a row that, if plausible between themselves, overrule the point
+#they all fail against
+REANCHOR = 3
+
+
+def float_column(points, name):
+    """Get an attribute of every point as a float array, NaN if missing."""
+    return array('d', [NAN if v is None else v for v in
+                       [to_float(getattr(p, name)) for p in points]])
+
+
+class NoiseReport:
+    """Counts of the points seen and dropped by a NoiseFilter"""
+    def __init__(self):
+        self.total = 0
+        self.dropped = {DOP: 0, SATELLITES: 0, SPEED: 0, ACCELERATION: 0}
+
+    def get_num_dropped(self):
+        """Get the number of points dropped for any reason."""
+        return sum(self.dropped.values())
+
+    def add(self, other):
+        """Fold another report into this one."""
+        self.total += other.total
+        for reason, count in other.dropped.items():
+            self.dropped[reason] += count
+
+    def __repr__(self):
+        return "NOISE - total: %s, dropped: %s %s" % (
+                    self.total, self.get_num_dropped(), self.dropped)
+
+
+class NoiseFilter:
+    """Drop implausible GPS fixes from a segment. Thresholds left as None are
+       not checked. Points failing the DOP or satellite limits are masked out
+       column by column first; the remaining points are then checked in one
+       pass for speed and acceleration against the last point kept. With
+       smooth, a constant-velocity Kalman filter weighted by hdop is run
+       over the kept points (points are copied, not modified);
+       process_noise is the expected acceleration in m/s^2."""
+    def __init__(self, max_hdop=None, max_vdop=None, max_pdop=None,
+                 min_sat=None, max_speed=None, max_acceleration=None,
+                 smooth=False, process_noise=2.0):
+        self.max_dop = (('hdop', max_hdop), ('vdop', max_vdop),
+                        ('pdop', max_pdop))
+        self.min_sat = min_sat
+        self.max_speed = max_speed
+        self.max_acceleration = max_acceleration
+        self.smooth = smooth
+        self.process_noise = process_noise
+
+    def filter(self, points):
+        """Get the points to keep and a NoiseReport."""
+        report = NoiseReport()
+        report.total = len(points)
+        keep = [True] * len(points)
+        for name, limit in self.max_dop:
+            if limit is not None:
+                for i, v in enumerate(float_column(points, name)):
+                    if keep[i] and v > limit:
+                        keep[i] = False
+                        report.dropped[DOP] += 1
+        if self.min_sat is not None:
+            for i, v in enumerate(float_column(points, 'sat')):
+                if keep[i] and v < self.min_sat:
+                    keep[i] = False
+                    report.dropped[SATELLITES] += 1
+        points = [p for p, k in zip(points, keep) if k]
+        if self.max_speed is not None or self.max_acceleration is not None:
+            points = self.__check_motion(points, report)
+        if self.smooth and len(points) > 1:
+            points = self.__smooth(points)
+        return points, report
+
+    def apply(self, path):
+        """Get a filtered copy of a Path and the NoiseReport."""
+        points, report = self.filter(path.points)
+        result = copy(path)
+        result.points = points
+        return result, report
+
+    def __check_motion(self, points, report):
+        """Drop points that imply an impossible speed or acceleration from
+           the last point kept (the anchor). If REANCHOR points in a row
+           fail against the anchor but not against each other, the anchor
+           is the odd one out: they are kept and the last of them becomes
+           the anchor, and the old anchor is dropped as well unless a
+           point had already passed against it (e.g. a bad first fix).
+           Points without a time are kept, and points with no time
+           progress are only kept if they are where the anchor is; neither
+           becomes the anchor."""
+        times = [to_timestamp(p.time) for p in points]
+        lats, lons = coordinate_columns(points)
+        keep = [False] * len(points)
+        anchor = None
+        confirmed = False
+        last_speed = None
+        #(index, reason) of the points failing in a row, and the speed
+        #between the last two of them
+        run = []
+        run_speed = None
+        for i, t in enumerate(times):
+            if t is None:
+                keep[i] = True
+                continue
+            if anchor is None:
+                keep[i] = True
+                anchor = i
+                continue
+            dt = t - times[anchor]
+            if dt <= 0:
+                if lats[i] == lats[anchor] and lons[i] == lons[anchor]:
+                    keep[i] = True
+                else:
+                    report.dropped[SPEED] += 1
+                continue
+            speed = haversine(lats[anchor], lons[anchor],
+                              lats[i], lons[i]) / dt
+            reason = self.__reject(speed, last_speed, dt)
+            if reason is None:
+                self.__drop(run, report)
+                run = []
+                keep[i] = True
+                anchor = i
+                confirmed = True
+                last_speed = speed
+                continue
+            if run:
+                j = run[-1][0]
+                dt = t - times[j]
+                if dt > 0:
+                    step = haversine(lats[j], lons[j], lats[i], lons[i]) / dt
+                if dt <= 0 or self.__reject(step, run_speed, dt):
+                    self.__drop(run, report)
+                    run = []
+                else:
+                    run_speed = step
+            if not run:
+                run_speed = None
+            run.append((i, reason))
+            if len(run) >= REANCHOR:
+                if not confirmed:
+                    keep[anchor] = False
+                    report.dropped[SPEED] += 1
+                for j, reason in run:
+                    keep[j] = True
+                run = []
+                anchor = j
+                confirmed = True
+                last_speed = run_speed
+        self.__drop(run, report)
+        return [p for p, k in zip(points, keep) if k]
+
+    def __reject(self, speed, last_speed, dt):
+        """Get why a step is implausible, or None if it isn't."""
+        if self.max_speed is not None and speed > self.max_speed:
+            return SPEED
+        if self.max_acceleration is not None and last_speed is not None \
+           and abs(speed - last_speed) / dt > self.max_acceleration:
+            return ACCELERATION
+        return None
+
+    def __drop(self, run, report):
+        """Count the points of a run as dropped."""
+        for i, reason in run:
+            report.dropped[reason] += 1
+
+    def __smooth(self, points):
+        """Smooth the projected coordinates, one axis at a time."""
+        lats, lons = coordinate_columns(points)
+        ref_lat = (min(lats) + max(lats)) / 2
+        xs, ys = project(lats, lons, ref_lat)
+        hdops = float_column(points, 'hdop')
+        variances = [(UERE * (h if h == h else 1)) ** 2 for h in hdops]
+        times = [to_timestamp(p.time) for p in points]
+        dts = [1.0] + [b - a if a is not None and b is not None else 1.0
+                       for a, b in zip(times, times[1:])]
+        q = self.process_noise ** 2
+        xs = kalman(xs, variances, dts, q)
+        ys = kalman(ys, variances, dts, q)
+        kx = math.radians(1) * EARTH_RADIUS * math.cos(math.radians(ref_lat))
+        ky = math.radians(1) * EARTH_RADIUS
+        result = []
+        for p, x, y in zip(points, xs, ys):
+            p = p.clone()
+            p.lat = '%.6f' % (y / ky)
+            p.lon = '%.6f' % (x / kx)
+            result.append(p)
+        return result
+
+
+def kalman(values, variances, dts, q):
+    """Constant-velocity Kalman filter over one axis. variances are the
+       measurement variances, dts the time since the previous value and q
+       the acceleration variance."""
+    pos, vel = values[0], 0.0
+    #Covariance matrix [[a, b], [b, c]]
+    a, b, c = variances[0], 0.0, 100.0
+    result = [pos]
+    for z, r, dt in zip(values[1:], variances[1:], dts[1:]):
+        dt = max(dt, 0)
+        pos += vel * dt
+        a += dt * (2 * b + dt * c) + q * dt ** 4 / 4
+        b += dt * c + q * dt ** 3 / 2
+        c += q * dt ** 2
+        k0 = a / (a + r)
+        k1 = b / (a + r)
+        y = z - pos
+        pos += k0 * y
+        vel += k1 * y
+        a, b, c = (1 - k0) * a, (1 - k0) * b, c - k1 * b
+        result.append(pos)
+    return result
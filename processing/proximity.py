@@ -0,0 +1,121 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import math
+
+from processing.geo import haversine, to_float
+from processing.spatial import METRES_PER_DEGREE, metres_per_degree_lon
+
+ENTER = 'enter'
+EXIT = 'exit'
+
+
+class ProximityEvent:
+    """A track entering or leaving a waypoint's proximity radius"""
+    def __init__(self, kind, waypoint, point, index, distance):
+        self.kind = kind
+        self.waypoint = waypoint
+        self.point = point
+        self.index = index
+        self.time = point.time
+        self.distance = distance
+
+    def __repr__(self):
+        return "PROXIMITY - %s: %s, time: %s, distance: %.1f" % (
+                    self.kind, self.waypoint.name, self.time, self.distance)
+
+
+def proximity_radius(wpt, default_radius=None):
+    """Get a waypoint's proximity radius in metres. default_radius is used
+       if it has none, or if it isn't a positive number."""
+    try:
+        radius = to_float(wpt.gpxx_proximity)
+    except ValueError:
+        return default_radius
+    if radius is None or not 0 < radius < float('inf'):
+        return default_radius
+    return radius
+
+
+class ProximityIndex:
+    """Waypoints bucketed by the grid cells their proximity circle covers.
+       Each track point then only has to be tested against the few waypoints
+       registered in its own cell, rather than against every waypoint."""
+    def __init__(self, waypoints, default_radius=None, cell_size=None):
+        circles = []
+        for wpt in waypoints:
+            radius = proximity_radius(wpt, default_radius)
+            if radius:
+                circles.append((float(wpt.lat), float(wpt.lon), radius, wpt))
+        if cell_size is None:
+            #Cells about the size of a typical circle keep both the number
+            #of cells per circle and the waypoints per cell small.
+            radii = sorted(c[2] for c in circles)
+            median = radii[len(radii) // 2] if radii else 100
+            cell_size = max(2 * median / METRES_PER_DEGREE, 0.001)
+        self.cell_size = cell_size
+        self.cells = {}
+        self.size = len(circles)
+        for circle in circles:
+            self.__insert(circle)
+
+    def __insert(self, circle):
+        lat, lon, radius, wpt = circle
+        dlat = radius / METRES_PER_DEGREE
+        dlon = radius / metres_per_degree_lon(abs(lat) + dlat)
+        lo = self.cell(lat - dlat, lon - dlon)
+        hi = self.cell(lat + dlat, lon + dlon)
+        for x in range(lo[0], hi[0] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                self.cells.setdefault((x, y), []).append(circle)
+
+    def cell(self, lat, lon):
+        """Get the key of the cell containing a location."""
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lon / self.cell_size)))
+
+    def containing(self, lat, lon):
+        """Get (distance, waypoint) pairs whose radius contains a location."""
+        result = []
+        for wlat, wlon, radius, wpt in self.cells.get(self.cell(lat, lon), ()):
+            d = haversine(lat, lon, wlat, wlon)
+            if d <= radius:
+                result.append((d, wpt))
+        return result
+
+    def sweep(self, points):
+        """Yield ProximityEvents for one time-ordered segment in a single
+           pass. Waypoints still entered at the end of the segment get an
+           exit event at its last point, so events always come in pairs."""
+        inside = {}
+        last = None
+        index = -1
+        for index, point in enumerate(points):
+            last = point
+            lat, lon = float(point.lat), float(point.lon)
+            if not inside and not self.cells.get(self.cell(lat, lon)):
+                continue
+            now = {}
+            for d, wpt in self.containing(lat, lon):
+                now[id(wpt)] = (d, wpt)
+                if id(wpt) not in inside:
+                    yield ProximityEvent(ENTER, wpt, point, index, d)
+            for key, (d, wpt) in inside.items():
+                if key not in now:
+                    yield ProximityEvent(EXIT, wpt, point, index,
+                            haversine(lat, lon, float(wpt.lat),
+                                      float(wpt.lon)))
+            inside = now
+        for d, wpt in inside.values():
+            yield ProximityEvent(EXIT, wpt, last, index,
+                    haversine(float(last.lat), float(last.lon),
+                              float(wpt.lat), float(wpt.lon)))
+
+
+def track_events(index, track):
+    """Get the events of every segment in a track, as (segment, event)."""
+    for segment in track.segments:
+        for event in index.sweep(segment.points):
+            yield segment, event
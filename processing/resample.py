@@ -0,0 +1,88 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from copy import copy
+
+from formats.gpx import SegmentPoint
+from processing.geo import haversine, to_float, to_timestamp, to_timestring
+
+
+def samples(points):
+    """Yield (time, lat, lon, ele) for points with a time, in the order
+       given. ele is None where missing."""
+    for p in points:
+        t = to_timestamp(p.time)
+        if t is not None:
+            yield t, float(p.lat), float(p.lon), to_float(p.ele)
+
+
+def with_distance(samples):
+    """Prefix each sample with the distance travelled so far."""
+    total = 0.0
+    last = None
+    for s in samples:
+        if last is not None:
+            total += haversine(last[1], last[2], s[1], s[2])
+        last = s
+        yield (total,) + s
+
+
+def interpolate(keyed, step):
+    """Walk samples sorted by their first element and yield one interpolated
+       (time, lat, lon, ele) at every multiple of step from the first key.
+       Only the current pair of samples is held, so any length works."""
+    target = None
+    prev = None
+    for cur in keyed:
+        if prev is None:
+            target = cur[0]
+        elif cur[0] <= prev[0]:
+            #Out of order or no progress, can't interpolate across it
+            continue
+        else:
+            span = cur[0] - prev[0]
+            while target <= cur[0]:
+                f = (target - prev[0]) / span
+                ele = None
+                if prev[4] is not None and cur[4] is not None:
+                    ele = prev[4] + (cur[4] - prev[4]) * f
+                yield (prev[1] + (cur[1] - prev[1]) * f,
+                       prev[2] + (cur[2] - prev[2]) * f,
+                       prev[3] + (cur[3] - prev[3]) * f, ele)
+                target += step
+        prev = cur
+    if prev is not None and target is not None and target == prev[0]:
+        yield prev[1:]
+
+
+def stream_resample(points, time_step=None, distance_step=None):
+    """Yield new SegmentPoints every time_step seconds or distance_step
+       metres along time-ordered points. Memory use doesn't grow with the
+       length of the input."""
+    if (time_step is None) == (distance_step is None):
+        raise ValueError('Exactly one of time_step or distance_step is needed')
+    if time_step is not None:
+        keyed = ((s[0],) + s for s in samples(points))
+        step = float(time_step)
+    else:
+        keyed = with_distance(samples(points))
+        step = float(distance_step)
+    if step <= 0:
+        raise ValueError('Step must be positive')
+    for t, lat, lon, ele in interpolate(keyed, step):
+        p = SegmentPoint('%.6f' % lat, '%.6f' % lon,
+                         None if ele is None else '%.2f' % ele)
+        p.time = to_timestring(t)
+        yield p
+
+
+def resample(path, time_step=None, distance_step=None):
+    """Get a copy of a Path resampled at a fixed time or distance step.
+       Points are sorted by time first; points without a time are left out."""
+    timed = [p for p in path.points if to_timestamp(p.time) is not None]
+    timed.sort(key=lambda p: to_timestamp(p.time))
+    result = copy(path)
+    result.points = list(stream_resample(timed, time_step, distance_step))
+    return result
@@ -0,0 +1,155 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import math
+import struct
+import zlib
+
+from processing.geo import coordinate_columns, project
+
+#Cell size in degrees for fingerprints, roughly 200m north-south
+CELL_SIZE = 0.002
+NUM_HASHES = 64
+#Rows per LSH band; NUM_HASHES / BAND_ROWS bands. Routes with a Jaccard
+#similarity J share at least one band with probability
+#1 - (1 - J ** BAND_ROWS) ** (NUM_HASHES / BAND_ROWS): about 73% at J = 0.2
+#and 87% at J = 0.25, and practically always from J = 0.4. Stored bands
+#must be rebuilt (backend.similarity.SimilarityStore.rebuild) after a change.
+BAND_ROWS = 2
+#Mersenne prime for the MinHash permutations
+PRIME = (1 << 61) - 1
+
+
+def _splitmix64(count, seed=1309018445):
+    """Get count pseudo-random 64-bit integers. Hand rolled rather than
+       random.Random so fingerprints are identical on every Python version."""
+    mask = (1 << 64) - 1
+    x = seed
+    values = []
+    for i in range(count):
+        x = (x + 0x9E3779B97F4A7C15) & mask
+        z = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & mask
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+        values.append(z ^ (z >> 31))
+    return values
+
+_values = _splitmix64(2 * NUM_HASHES)
+#(a, b) pairs of the MinHash permutations (a * x + b) % PRIME
+HASHES = [(_values[2 * i] % (PRIME - 1) + 1, _values[2 * i + 1] % PRIME)
+          for i in range(NUM_HASHES)]
+
+
+def route_cells(points, cell_size=CELL_SIZE):
+    """Get the set of grid cells a route passes through, as integers. Gaps
+       between points longer than a cell are filled in, so sparse and dense
+       recordings of the same road give the same cells."""
+    lats, lons = coordinate_columns(points)
+    cells = set()
+    last = None
+    for lat, lon in zip(lats, lons):
+        if last is not None:
+            steps = int(max(abs(lat - last[0]), abs(lon - last[1])) /
+                        cell_size)
+            for i in range(1, steps + 1):
+                f = float(i) / (steps + 1)
+                cells.add(cell_key(last[0] + (lat - last[0]) * f,
+                                   last[1] + (lon - last[1]) * f, cell_size))
+        cells.add(cell_key(lat, lon, cell_size))
+        last = (lat, lon)
+    return cells
+
+
+def cell_key(lat, lon, cell_size=CELL_SIZE):
+    """Pack the grid cell of a location into one integer."""
+    x = int(math.floor(lat / cell_size)) & 0xffffffff
+    y = int(math.floor(lon / cell_size)) & 0xffffffff
+    return (x << 32) | y
+
+
+def minhash(cells):
+    """Get the MinHash signature of a set of cells, or None for an empty
+       set, which has nothing to compare."""
+    if not cells:
+        return None
+    return [min((a * c + b) % PRIME for c in cells) for a, b in HASHES]
+
+
+def combine_signatures(signatures):
+    """Get the signature of the union of several cell sets (e.g. the
+       segments of a track) from their signatures, skipping None."""
+    signatures = [s for s in signatures if s is not None]
+    if not signatures:
+        return None
+    return [min(values) for values in zip(*signatures)]
+
+
+def similarity(sig1, sig2):
+    """Estimate the Jaccard similarity of two routes from their signatures."""
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / float(len(sig1))
+
+
+def band_buckets(signature, rows=BAND_ROWS):
+    """Get (band, bucket) keys for locality-sensitive hashing."""
+    return [(i // rows, zlib.crc32(struct.pack('<%dQ' % rows,
+                                               *signature[i:i + rows]))
+                        & 0xffffffff)
+            for i in range(0, len(signature), rows)]
+
+
+def pack_signature(signature):
+    """Pack a signature into a byte string for BLOB columns."""
+    return struct.pack('<%dQ' % len(signature), *signature)
+
+
+def unpack_signature(data):
+    """Unpack a byte string created by pack_signature."""
+    return list(struct.unpack('<%dQ' % (len(data) // 8), data))
+
+
+def _plane(points_a, points_b):
+    """Project two point lists onto the same local plane."""
+    lats_a, lons_a = coordinate_columns(points_a)
+    lats_b, lons_b = coordinate_columns(points_b)
+    ref = (min(min(lats_a), min(lats_b)) + max(max(lats_a), max(lats_b))) / 2
+    xa, ya = project(lats_a, lons_a, ref)
+    xb, yb = project(lats_b, lons_b, ref)
+    return list(zip(xa, ya)), list(zip(xb, yb))
+
+
+def hausdorff(points_a, points_b):
+    """Get the symmetric Hausdorff distance in metres between two routes.
+       O(n*m), meant for refining a few candidates."""
+    a, b = _plane(points_a, points_b)
+
+    def directed(p, q):
+        worst = 0.0
+        for x, y in p:
+            best = min((x - u) ** 2 + (y - v) ** 2 for u, v in q)
+            if best > worst:
+                worst = best
+        return worst
+    return math.sqrt(max(directed(a, b), directed(b, a)))
+
+
+def frechet(points_a, points_b):
+    """Get the discrete Frechet distance in metres between two routes,
+       which unlike Hausdorff also respects the direction of travel. O(n*m)
+       time, O(m) memory."""
+    a, b = _plane(points_a, points_b)
+    prev = None
+    for i, (x, y) in enumerate(a):
+        row = []
+        for j, (u, v) in enumerate(b):
+            d = math.hypot(x - u, y - v)
+            if i == 0 and j == 0:
+                row.append(d)
+            elif i == 0:
+                row.append(max(row[j - 1], d))
+            elif j == 0:
+                row.append(max(prev[0], d))
+            else:
+                row.append(max(min(prev[j], prev[j - 1], row[j - 1]), d))
+        prev = row
+    return prev[-1]
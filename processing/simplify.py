@@ -0,0 +1,171 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import heapq
+
+from processing.geo import coordinate_columns, project, segment_distance, \
+                           triangle_area
+
+DOUGLAS_PEUCKER = 'douglas-peucker'
+VISVALINGAM = 'visvalingam'
+
+
+def douglas_peucker(xs, ys, tolerance):
+    """Get the indexes of the points kept by Douglas-Peucker. Iterative, so
+       long segments can't blow the stack, but still O(n^2) in the worst case
+       (a slowly curving path). Use visvalingam for a guaranteed bound."""
+    n = len(xs)
+    if n < 3:
+        return list(range(n))
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay, bx, by = xs[first], ys[first], xs[last], ys[last]
+        max_dist = -1
+        index = None
+        for i in range(first + 1, last):
+            d = segment_distance(xs[i], ys[i], ax, ay, bx, by)
+            if d > max_dist:
+                max_dist = d
+                index = i
+        if index is not None and max_dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i in range(n) if keep[i]]
+
+
+def visvalingam(xs, ys, tolerance=None, count=None):
+    """Get the indexes of the points kept by a heap-based Visvalingam-Whyatt
+       pass. Each point is ranked by its effective area, the area of the
+       triangle it forms with its current neighbours, and points are removed
+       smallest area first until only count points are left. O(n log n) in
+       all cases.
+
+       With a tolerance (metres) instead of a count, a point is only removed
+       if every point dropped so far between its neighbours stays within
+       tolerance of the line joining them. The distance of the dropped
+       points is bounded, not measured, so this keeps a few more points than
+       douglas_peucker does but never leaves one further away."""
+    n = len(xs)
+    if n < 3 or (count is not None and count >= n):
+        return list(range(n))
+    if count is not None and count < 2:
+        count = 2
+    prev = list(range(-1, n - 1))
+    next = list(range(1, n + 1))
+    version = [0] * n
+    removed = [False] * n
+    #Upper bound on the distance of the dropped points between i and next[i]
+    #from the line between them
+    error = [0.0] * n
+
+    def rank(i):
+        p, q = prev[i], next[i]
+        return triangle_area(xs[p], ys[p], xs[i], ys[i], xs[q], ys[q])
+
+    heap = [(rank(i), i, 0) for i in range(1, n - 1)]
+    heapq.heapify(heap)
+    remaining = n
+    last_rank = 0
+    while heap:
+        r, i, v = heapq.heappop(heap)
+        if removed[i] or v != version[i]:
+            continue
+        p, q = prev[i], next[i]
+        if count is not None:
+            #Areas never drop below the last removed one, so a point can't
+            #slip out just because its neighbour was removed first.
+            if r < last_rank:
+                r = last_rank
+            if remaining <= count:
+                break
+            last_rank = r
+        else:
+            #A point dropped between p and i is within error[p] of p-i, and
+            #p-i is within d of p-q, so it is within error[p] + d of p-q.
+            d = segment_distance(xs[i], ys[i], xs[p], ys[p], xs[q], ys[q])
+            bound = max(error[p], error[i]) + d
+            if bound > tolerance:
+                #Kept for now; checked again if a neighbour is removed
+                continue
+            error[p] = bound
+        removed[i] = True
+        remaining -= 1
+        next[p] = q
+        prev[q] = p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                version[j] += 1
+                heapq.heappush(heap, (rank(j), j, version[j]))
+    return [i for i in range(n) if not removed[i]]
+
+
+def simplify_indexes(points, tolerance=None, count=None, method=VISVALINGAM):
+    """Get the indexes of the points to keep. Either tolerance (metres) or
+       count (number of points to keep) must be given. With a tolerance, no
+       dropped point is further than tolerance from the simplified line."""
+    if tolerance is None and count is None:
+        raise ValueError('Either a tolerance or a point count is required')
+    if len(points) < 3:
+        return list(range(len(points)))
+    lats, lons = coordinate_columns(points)
+    xs, ys = project(lats, lons)
+    if method == DOUGLAS_PEUCKER:
+        if tolerance is None:
+            raise ValueError('Douglas-Peucker only supports a tolerance')
+        return douglas_peucker(xs, ys, tolerance)
+    elif method == VISVALINGAM:
+        return visvalingam(xs, ys, tolerance, count)
+    raise ValueError('Unknown simplification method: %s' % method)
+
+
+def simplify_points(points, tolerance=None, count=None, method=VISVALINGAM):
+    """Get a new list with only the significant points."""
+    return [points[i] for i in
+            simplify_indexes(points, tolerance, count, method)]
+
+
+def stream_simplify(points, tolerance, chunk_size=1000, method=VISVALINGAM):
+    """Simplify any iterable of points without holding it all in memory.
+       Points are simplified one chunk at a time, with the last kept point
+       carried over as the anchor of the next chunk, so memory use and cost
+       per point stay constant however long the input is."""
+    buf = []
+    for point in points:
+        buf.append(point)
+        if len(buf) >= chunk_size:
+            kept = simplify_points(buf, tolerance, method=method)
+            for p in kept[:-1]:
+                yield p
+            buf = [kept[-1]]
+    for p in simplify_points(buf, tolerance, method=method):
+        yield p
+
+
+def reduce_for_display(points, metres_per_pixel, chunk_size=1000):
+    """Yield (lat, lon) pairs for drawing at the given scale. Points closer
+       than half a pixel to the drawn line are dropped."""
+    for p in stream_simplify(points, metres_per_pixel / 2.0, chunk_size):
+        yield float(p.lat), float(p.lon)
+
+
+class Simplifier:
+    """Reusable simplification settings, e.g. for GPXImporter"""
+    def __init__(self, tolerance=None, count=None, method=VISVALINGAM):
+        if tolerance is None and count is None:
+            raise ValueError('Either a tolerance or a point count is required')
+        self.tolerance = tolerance
+        self.count = count
+        self.method = method
+
+    def simplify(self, path):
+        """Get a copy of a Path with the insignificant points removed."""
+        simple = path.clone()
+        simple.points = simplify_points(path.points, self.tolerance,
+                                        self.count, self.method)
+        return simple
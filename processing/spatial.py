@@ -0,0 +1,272 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import heapq
+import math
+
+from processing.geo import EARTH_RADIUS, haversine
+
+#Metres per degree of latitude
+METRES_PER_DEGREE = math.radians(1) * EARTH_RADIUS
+#Default grid cell size in degrees, roughly 1km north-south
+CELL_SIZE = 0.01
+
+
+def metres_per_degree_lon(lat):
+    """Metres per degree of longitude at a latitude, never quite zero."""
+    return METRES_PER_DEGREE * max(math.cos(math.radians(min(abs(lat), 89.9))),
+                                   1e-6)
+
+
+class GridIndex:
+    """Uniform lat/lon grid over points or waypoints. Items are bucketed by
+       cell, so bbox and radius queries only look at the cells they overlap
+       and nearest-neighbour queries search outward ring by ring. Items can be
+       added at any time; add_path/update keep an index in step with paths
+       that are still being appended to."""
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.size = 0
+        self.paths = []
+        self.min_cell = None
+        self.max_cell = None
+
+    def __len__(self):
+        return self.size
+
+    def cell(self, lat, lon):
+        """Get the key of the cell containing a location."""
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lon / self.cell_size)))
+
+    def insert(self, lat, lon, item):
+        """Add an item at a location (degrees)."""
+        lat = float(lat)
+        lon = float(lon)
+        key = self.cell(lat, lon)
+        self.cells.setdefault(key, []).append((lat, lon, item))
+        self.size += 1
+        if self.min_cell is None:
+            self.min_cell = self.max_cell = key
+        else:
+            self.min_cell = (min(self.min_cell[0], key[0]),
+                             min(self.min_cell[1], key[1]))
+            self.max_cell = (max(self.max_cell[0], key[0]),
+                             max(self.max_cell[1], key[1]))
+
+    def add_points(self, points):
+        """Add points (anything with lat/lon) as their own items."""
+        for p in points:
+            self.insert(p.lat, p.lon, p)
+
+    def add_path(self, path):
+        """Index the points of a path, and keep track of it so update() can
+           pick up points appended later."""
+        self.paths.append([path, None, []])
+        self.update()
+
+    def update(self):
+        """Index any points appended to tracked paths since the last call.
+           Only the new points are visited, unless the path's point list was
+           replaced (e.g. by cleanup), shortened, or had its points copied
+           (by a formats.gpx.SharedList), in which case the path is indexed
+           again from scratch."""
+        for entry in self.paths:
+            path, points, indexed = entry
+            if (path.points is not points or len(points) < len(indexed) or
+                    (indexed and points[len(indexed) - 1] is not indexed[-1])):
+                self.remove_points(indexed)
+                points = path.points
+                indexed = []
+            if len(points) > len(indexed):
+                new = points[len(indexed):]
+                self.add_points(new)
+                indexed.extend(new)
+            entry[1:] = [points, indexed]
+
+    def remove_points(self, points):
+        """Remove points added with add_points."""
+        ids = {}
+        for p in points:
+            key = self.cell(float(p.lat), float(p.lon))
+            ids.setdefault(key, set()).add(id(p))
+        for key, remove in ids.items():
+            bucket = self.cells.get(key, [])
+            kept = [e for e in bucket if id(e[2]) not in remove]
+            self.size -= len(bucket) - len(kept)
+            if kept:
+                self.cells[key] = kept
+            else:
+                self.cells.pop(key, None)
+
+    def bbox(self, minlat, minlon, maxlat, maxlon):
+        """Get the items inside a bounding box."""
+        lo = self.cell(minlat, minlon)
+        hi = self.cell(maxlat, maxlon)
+        result = []
+        for x in range(lo[0], hi[0] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                for lat, lon, item in self.cells.get((x, y), ()):
+                    if minlat <= lat <= maxlat and minlon <= lon <= maxlon:
+                        result.append(item)
+        return result
+
+    def radius(self, lat, lon, metres):
+        """Get (distance, item) pairs within a great-circle distance of a
+           location, closest first."""
+        dlat = metres / METRES_PER_DEGREE
+        dlon = metres / metres_per_degree_lon(abs(lat) + dlat)
+        lo = self.cell(lat - dlat, lon - dlon)
+        hi = self.cell(lat + dlat, lon + dlon)
+        result = []
+        for x in range(lo[0], hi[0] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                for plat, plon, item in self.cells.get((x, y), ()):
+                    d = haversine(lat, lon, plat, plon)
+                    if d <= metres:
+                        result.append((d, item))
+        result.sort(key=lambda r: r[0])
+        return result
+
+    def nearest(self, lat, lon, k=1, max_distance=None):
+        """Get up to k (distance, item) pairs closest to a location, closest
+           first. Rings of cells are searched outward until no unsearched
+           cell can hold anything closer than the k-th best so far."""
+        if not self.size:
+            return []
+        cx, cy = self.cell(lat, lon)
+        max_ring = max(abs(cx - self.min_cell[0]), abs(cx - self.max_cell[0]),
+                       abs(cy - self.min_cell[1]), abs(cy - self.max_cell[1]))
+        best = []
+        ring = 0
+        while ring <= max_ring:
+            if 8 * ring > len(self.cells):
+                #Sparse data far away: cheaper to check the remaining
+                #occupied cells than to walk empty rings
+                keys = [key for key in self.cells
+                        if max(abs(key[0] - cx), abs(key[1] - cy)) >= ring]
+                max_ring = ring
+            else:
+                keys = self.__ring(cx, cy, ring)
+            for key in keys:
+                for plat, plon, item in self.cells.get(key, ()):
+                    d = haversine(lat, lon, plat, plon)
+                    if max_distance is not None and d > max_distance:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, id(item), item))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, id(item), item))
+            #Anything in the next ring is at least a full ring away
+            edge = ring * self.cell_size
+            bound = edge * min(METRES_PER_DEGREE,
+                               metres_per_degree_lon(abs(lat) + edge))
+            if max_distance is not None and bound > max_distance:
+                break
+            if len(best) == k and bound > -best[0][0]:
+                break
+            ring += 1
+        return sorted([(-d, item) for d, i, item in best],
+                      key=lambda r: r[0])
+
+    def __ring(self, cx, cy, ring):
+        """Get the cell keys at Chebyshev distance ring from a cell."""
+        if ring == 0:
+            return [(cx, cy)]
+        keys = []
+        for x in range(cx - ring, cx + ring + 1):
+            keys.append((x, cy - ring))
+            keys.append((x, cy + ring))
+        for y in range(cy - ring + 1, cy + ring):
+            keys.append((cx - ring, y))
+            keys.append((cx + ring, y))
+        return keys
+
+
+class KDTree:
+    """Static k-d tree over points on the unit sphere. Straight-line (chord)
+       distance in 3D orders points the same way as great-circle distance,
+       so nearest-neighbour searches are exact at any scale. Unlike the grid
+       its cost doesn't depend on picking a cell size, which suits data
+       spread very unevenly; it can't be appended to."""
+    def __init__(self, items):
+        """items is a list of (lat, lon, item) tuples."""
+        nodes = []
+        for lat, lon, item in items:
+            rlat = math.radians(float(lat))
+            rlon = math.radians(float(lon))
+            nodes.append(((math.cos(rlat) * math.cos(rlon),
+                           math.cos(rlat) * math.sin(rlon),
+                           math.sin(rlat)), float(lat), float(lon), item))
+        self.size = len(nodes)
+        self.root = self.__build(nodes, 0)
+
+    def __len__(self):
+        return self.size
+
+    def __build(self, nodes, depth):
+        if not nodes:
+            return None
+        axis = depth % 3
+        nodes.sort(key=lambda n: n[0][axis])
+        mid = len(nodes) // 2
+        return (nodes[mid], axis, self.__build(nodes[:mid], depth + 1),
+                self.__build(nodes[mid + 1:], depth + 1))
+
+    def nearest(self, lat, lon, k=1, max_distance=None):
+        """Get up to k (distance, item) pairs closest to a location."""
+        rlat = math.radians(lat)
+        rlon = math.radians(lon)
+        q = (math.cos(rlat) * math.cos(rlon), math.cos(rlat) * math.sin(rlon),
+             math.sin(rlat))
+        limit = None
+        if max_distance is not None:
+            limit = (2 * math.sin(min(max_distance / EARTH_RADIUS, math.pi)
+                                  / 2)) ** 2
+        best = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (p, plat, plon, item), axis, left, right = node
+            d = sum((a - b) ** 2 for a, b in zip(p, q))
+            if limit is None or d <= limit:
+                if len(best) < k:
+                    heapq.heappush(best, (-d, id(item), plat, plon, item))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, id(item), plat, plon, item))
+            diff = q[axis] - p[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            worst = -best[0][0] if len(best) == k else limit
+            if worst is None or diff * diff <= worst:
+                stack.append(far)
+            stack.append(near)
+        return sorted([(haversine(lat, lon, plat, plon), item)
+                       for d, i, plat, plon, item in best],
+                      key=lambda r: r[0])
+
+    def radius(self, lat, lon, metres):
+        """Get (distance, item) pairs within a distance, closest first."""
+        return self.nearest(lat, lon, self.size, metres)
+
+
+def index_gpx(gpx, waypoints=True, points=True, cell_size=CELL_SIZE):
+    """Build a GridIndex over a Gpx instance's waypoints and/or track points.
+       Segments are tracked, so update() picks up appended points."""
+    return index_tracks(gpx.tracks, gpx.waypoints if waypoints else (),
+                        points, cell_size)
+
+
+def index_tracks(tracks, waypoints=(), points=True, cell_size=CELL_SIZE):
+    """Build a GridIndex over a set of loaded tracks and waypoints."""
+    index = GridIndex(cell_size)
+    index.add_points(waypoints)
+    if points:
+        for track in tracks:
+            for segment in track.segments:
+                index.add_path(segment)
+    return index
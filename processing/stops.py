@@ -0,0 +1,203 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+from copy import copy
+
+from formats.gpx import Waypoint
+from processing.geo import coordinate_columns, haversine, to_timestamp, \
+                           to_timestring
+
+GAP = 'gap'
+DWELL = 'dwell'
+#Waypoint type given to detected stops
+STOP_TYPE = 'Stop'
+
+
+class Stop:
+    """A place a segment stopped at. Points start to end (inclusive) belong
+       to the stop; trips end at start and resume at end. A gap between two
+       segments starts at the last point of the first segment and ends at a
+       point of the next one."""
+    def __init__(self, kind, start, end, lat, lon, start_time, end_time):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.lat = lat
+        self.lon = lon
+        self.start_time = start_time
+        self.end_time = end_time
+
+    def get_duration(self):
+        """Get the length of the stop in seconds, if known."""
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def __repr__(self):
+        return "STOP - %s, lat/lon: %.6f/%.6f, duration: %s" % (
+                    self.kind, self.lat, self.lon, self.get_duration())
+
+
+class StopDetector:
+    """Find stops in a time-ordered segment in a single pass. A stop is
+       either a gap of at least max_gap seconds between two points, or the
+       points staying within radius metres of an anchor point for at least
+       min_duration seconds."""
+    def __init__(self, radius=50, min_duration=300, max_gap=300):
+        self.radius = radius
+        self.min_duration = min_duration
+        self.max_gap = max_gap
+
+    def detect(self, points):
+        """Get the Stops in a list of points, in order."""
+        n = len(points)
+        if n < 2:
+            return []
+        times = [to_timestamp(p.time) for p in points]
+        lats, lons = coordinate_columns(points)
+
+        def dwells(first, last):
+            return (times[first] is not None and times[last] is not None and
+                    times[last] - times[first] >= self.min_duration)
+
+        def stop(kind, first, last, until):
+            count = until - first + 1
+            return Stop(kind, first, last,
+                        sum(lats[first:until + 1]) / count,
+                        sum(lons[first:until + 1]) / count,
+                        times[first], times[last])
+
+        stops = []
+        anchor = 0
+        for i in range(1, n):
+            if times[i] is not None and times[i - 1] is not None and \
+               times[i] - times[i - 1] >= self.max_gap:
+                first = anchor if dwells(anchor, i - 1) else i - 1
+                stops.append(stop(GAP, first, i, i - 1))
+                anchor = i
+            elif haversine(lats[anchor], lons[anchor],
+                           lats[i], lons[i]) > self.radius:
+                if dwells(anchor, i - 1):
+                    stops.append(stop(DWELL, anchor, i - 1, i - 1))
+                anchor = i
+        if dwells(anchor, n - 1):
+            stops.append(stop(DWELL, anchor, n - 1, n - 1))
+        return stops
+
+    def split(self, points):
+        """Get the trips (lists of points) between the stops, and the stops.
+           Trips with fewer than two points are left out."""
+        stops = self.detect(points)
+        trips = []
+        begin = 0
+        for s in stops:
+            trips.append(points[begin:s.start + 1])
+            begin = s.end
+        trips.append(points[begin:])
+        return [t for t in trips if len(t) > 1], stops
+
+
+def split_track(track, detector):
+    """Split a Track into one Track per trip. Segments stay in the same trip
+       unless there is a stop between them, i.e. a gap of at least the
+       detector's max_gap from the end of one to the start of the next.
+       A stop at the very end or start of a segment is merged into such a
+       gap. Returns (tracks, stops)."""
+    pieces = []
+    all_stops = []
+    current = []
+    last = tail = None
+    for segment in track.segments:
+        points = segment.points
+        if not points:
+            continue
+        stops = detector.detect(points)
+        begin = 0
+        gap = last and segment_gap(last, points, detector.max_gap)
+        if gap:
+            if tail:
+                #The previous segment ended with a stop: it lasts until now
+                tail.kind = GAP
+                tail.end = 0
+                tail.end_time = gap.end_time
+                gap = tail
+            else:
+                all_stops.append(gap)
+            if stops and stops[0].start == 0:
+                gap.end = begin = stops[0].end
+                gap.end_time = stops[0].end_time
+                stops = stops[1:]
+            if current:
+                pieces.append(current)
+                current = []
+        all_stops.extend(stops)
+        for stop in stops:
+            if stop.start > begin:
+                s = copy(segment)
+                s.points = points[begin:stop.start + 1]
+                current.append(s)
+            if current:
+                pieces.append(current)
+                current = []
+            begin = stop.end
+        if len(points) - begin > 1:
+            s = copy(segment)
+            s.points = points[begin:]
+            current.append(s)
+        last = points
+        ends = ([gap] if gap else []) + stops
+        tail = None
+        if ends and ends[-1].end == len(points) - 1:
+            tail = ends[-1]
+    if current:
+        pieces.append(current)
+    tracks = []
+    for i, segments in enumerate(pieces):
+        t = copy(track)
+        t.link = copy(track.link)
+        t.segments = segments
+        if len(pieces) > 1 and track.name:
+            t.name = '%s (%d)' % (track.name, i + 1)
+        tracks.append(t)
+    return tracks, all_stops
+
+
+def segment_gap(last, points, max_gap):
+    """Get a GAP Stop for the time between the points of one segment and the
+       points of the next, or None if it is shorter than max_gap or not
+       known."""
+    end = last[-1]
+    start_time = to_timestamp(end.time)
+    end_time = to_timestamp(points[0].time)
+    if start_time is None or end_time is None or \
+       end_time - start_time < max_gap:
+        return None
+    return Stop(GAP, len(last) - 1, 0, float(end.lat), float(end.lon),
+                start_time, end_time)
+
+
+def stop_waypoint(stop, name=None):
+    """Get a candidate Waypoint for a stop."""
+    wpt = Waypoint('%.6f' % stop.lat, '%.6f' % stop.lon)
+    wpt.name = name
+    wpt.type = STOP_TYPE
+    if stop.start_time is not None:
+        wpt.time = to_timestring(stop.start_time)
+    return wpt
+
+
+def split_gpx(gpx, detector):
+    """Split every track of a Gpx instance into trips and add the stops as
+       candidate waypoints. Returns the stops found."""
+    tracks = []
+    stops = []
+    for track in gpx.tracks:
+        t, s = split_track(track, detector)
+        tracks.extend(t)
+        stops.extend(s)
+    gpx.tracks = tracks
+    for i, stop in enumerate(stops):
+        gpx.waypoints.append(stop_waypoint(stop, 'Stop %d' % (i + 1)))
+    return stops
@@ -0,0 +1,95 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import math
+
+#Summary fields, in the order used by the summary tables
+FIELDS = ('num_points', 'length2d', 'length3d', 'start_time', 'end_time',
+          'elapsed_time', 'start_lat', 'start_lon', 'end_lat', 'end_lon',
+          'minlat', 'minlon', 'maxlat', 'maxlon', 'minele', 'maxele',
+          'moving_time', 'max_speed', 'ascent', 'descent', 'min_grade',
+          'max_grade')
+
+
+class Summary:
+    """Precomputed totals for a track or segment, as anticipated by the
+       GpxTrack/GpxTrackSegment fields in formats/gpx-v2.py, plus the moving
+       statistics of processing.metrics"""
+    def __init__(self):
+        for name in FIELDS:
+            setattr(self, name, None)
+        self.num_points = 0
+        self.length2d = 0.0
+        self.length3d = 0.0
+        self.moving_time = 0.0
+        self.max_speed = 0.0
+        self.ascent = 0.0
+        self.descent = 0.0
+
+    def add(self, other):
+        """Extend this summary with one that follows it (the next segment)."""
+        self.num_points += other.num_points
+        self.length2d += other.length2d
+        self.length3d += other.length3d
+        self.moving_time += other.moving_time
+        self.ascent += other.ascent
+        self.descent += other.descent
+        self.max_speed = max(self.max_speed, other.max_speed)
+        if self.start_lat is None:
+            self.start_lat = other.start_lat
+            self.start_lon = other.start_lon
+        if other.end_lat is not None:
+            self.end_lat = other.end_lat
+            self.end_lon = other.end_lon
+        for name, pick in (('start_time', min), ('end_time', max),
+                           ('minlat', min), ('minlon', min), ('minele', min),
+                           ('maxlat', max), ('maxlon', max), ('maxele', max),
+                           ('min_grade', min), ('max_grade', max)):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            if theirs is not None:
+                setattr(self, name,
+                        theirs if mine is None else pick(mine, theirs))
+        if self.start_time is not None and self.end_time is not None:
+            self.elapsed_time = self.end_time - self.start_time
+
+    def as_dict(self):
+        """Get the fields as a dict, e.g. for a table row."""
+        return dict((name, getattr(self, name)) for name in FIELDS)
+
+
+def segment_summary(metrics):
+    """Get the Summary of a segment from its SegmentMetrics."""
+    s = Summary()
+    s.num_points = metrics.num_points
+    if not metrics.num_points:
+        return s
+    s.length2d = metrics.distance
+    eles = metrics.raw_elevations
+    s.length3d = sum(math.hypot(d, b - a) if a == a and b == b else d
+                     for d, a, b in zip(metrics.distances[1:], eles,
+                                        eles[1:]))
+    s.start_time = metrics.start_time
+    s.end_time = metrics.end_time
+    if s.start_time is not None:
+        s.elapsed_time = metrics.elapsed_time
+    s.start_lat, s.start_lon = metrics.lats[0], metrics.lons[0]
+    s.end_lat, s.end_lon = metrics.lats[-1], metrics.lons[-1]
+    s.minlat, s.maxlat = min(metrics.lats), max(metrics.lats)
+    s.minlon, s.maxlon = min(metrics.lons), max(metrics.lons)
+    valid = [e for e in eles if e == e]
+    if valid:
+        s.minele, s.maxele = min(valid), max(valid)
+    for name in ('moving_time', 'max_speed', 'ascent', 'descent',
+                 'min_grade', 'max_grade'):
+        setattr(s, name, getattr(metrics, name))
+    return s
+
+
+def combine_summaries(summaries):
+    """Get the Summary of consecutive segments combined."""
+    total = Summary()
+    for s in summaries:
+        total.add(s)
+    return total
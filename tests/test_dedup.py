@@ -0,0 +1,66 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from backend.dedup import DedupStore
+from backend.sqlite import create_tables, TableSegmentDigest
+from formats.gpx import Gpx, SegmentPoint, Track, TrackSegment
+from importers.gpx import GPXImporter
+from processing.geo import to_timestring
+
+START = 1300000000
+
+
+def sample_gpx():
+    """Get a Gpx with one track of two short segments."""
+    gpx = Gpx()
+    track = Track('Sample')
+    for s in range(2):
+        segment = TrackSegment()
+        for i in range(5):
+            p = SegmentPoint('%.6f' % (45 + s + i * 0.001), '7.000000')
+            p.time = to_timestring(START + s * 1000 + i * 10)
+            segment.points.append(p)
+        track.segments.append(segment)
+    gpx.tracks.append(track)
+    return gpx
+
+
+class DuplicateDigestTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        create_tables(engine)
+        self.Session = scoped_session(sessionmaker(bind=engine))
+        self.gpx = sample_gpx()
+
+    def tearDown(self):
+        self.Session.remove()
+
+    def test_rebuild_over_segments_stored_twice(self):
+        for i in range(2):
+            GPXImporter(self.gpx.clone(), self.Session,
+                        dedup=False).save_gpx(1)
+        session = self.Session()
+        DedupStore(session).rebuild()
+        self.assertEqual(session.query(TableSegmentDigest).count(), 4)
+        importer = GPXImporter(self.gpx.clone(), self.Session)
+        importer.save_gpx(1)
+        self.assertEqual(importer.duplicate_segments, 2)
+
+    def test_rebuild_keeps_existing_digests(self):
+        GPXImporter(self.gpx.clone(), self.Session).save_gpx(1)
+        GPXImporter(self.gpx.clone(), self.Session, dedup=False).save_gpx(1)
+        session = self.Session()
+        DedupStore(session).rebuild()
+        DedupStore(session).rebuild()
+        self.assertEqual(session.query(TableSegmentDigest).count(), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
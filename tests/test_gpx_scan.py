@@ -0,0 +1,132 @@
+'''
+@author: Zack Townsend
+@license: MIT
+
+Differential test of GpxScanParser against GpxXmlParser. Run from the
+project root:
+    python -m unittest discover tests
+'''
+
+from io import BytesIO
+import re
+import unittest
+
+from formats.gpx import POINT_FIELDS, SegmentPoint
+from parsers.gpx import GpxXmlParser
+from parsers.gpx_scan import GpxScanParser
+
+FIXTURES = ('Current.gpx', 'test')
+
+
+def fields(obj):
+    """Get the comparable state of a Gpx object: nested objects become
+       dicts of their fields (leaving out cached metrics), lists are
+       compared item by item."""
+    if isinstance(obj, list):
+        return [fields(o) for o in obj]
+    if isinstance(obj, SegmentPoint):
+        names = POINT_FIELDS
+    elif hasattr(obj, '__dict__'):
+        names = [n for n in obj.__dict__ if not n.startswith('_metrics')]
+    else:
+        return obj
+    return dict((n, fields(getattr(obj, n))) for n in names)
+
+
+def differences(a, b, path='gpx'):
+    """List where two field trees differ."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        diffs = []
+        for key in sorted(set(a) | set(b)):
+            diffs.extend(differences(a.get(key), b.get(key),
+                                     '%s.%s' % (path, key)))
+        return diffs
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return ['%s: %d items != %d' % (path, len(a), len(b))]
+        diffs = []
+        for i, (x, y) in enumerate(zip(a, b)):
+            diffs.extend(differences(x, y, '%s[%d]' % (path, i)))
+        return diffs
+    if a != b:
+        return ['%s: %r != %r' % (path, a, b)]
+    return []
+
+
+class Progress:
+    """Stand-in for importers.worker.ImportProgress"""
+    def __init__(self):
+        self.points_parsed = 0
+
+    def read(self, count):
+        pass
+
+    def parsed(self, count):
+        self.points_parsed += count
+
+
+def read(name):
+    f = open(name, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class ScanTest(unittest.TestCase):
+    def compare(self, data):
+        """Parse data both ways, check the results match, and return the
+           scan parser and its progress."""
+        expected = GpxXmlParser(BytesIO(data)).parse()
+        progress = Progress()
+        parser = GpxScanParser(BytesIO(data), progress=progress)
+        actual = parser.parse()
+        self.assertEqual(differences(fields(expected), fields(actual)), [])
+        self.assertEqual(progress.points_parsed, expected.get_num_points())
+        return parser
+
+    def test_fixtures(self):
+        for name in FIXTURES:
+            data = read(name)
+            parser = self.compare(data)
+            self.assertEqual(parser.fast_segments, data.count(b'<trkseg>'))
+            self.assertEqual(parser.slow_segments, 0)
+
+    def test_segment_fallback(self):
+        for name in FIXTURES:
+            data = read(name)
+            #Every point with its attributes swapped
+            data = re.sub(br'<trkpt lat="([^"]*)" lon="([^"]*)">',
+                          br'<trkpt lon="\2" lat="\1">', data)
+            parser = self.compare(data)
+            self.assertEqual(parser.fast_segments, 0)
+            self.assertEqual(parser.slow_segments, data.count(b'<trkseg>'))
+
+    def test_single_segment_fallback(self):
+        data = read('test')
+        data = re.sub(br'(<trkpt lat="[^"]*" lon="[^"]*">)',
+                      br'\1<hdop>1.5</hdop>', data, 1)
+        parser = self.compare(data)
+        self.assertEqual(parser.slow_segments, 1)
+        self.assertEqual(parser.fast_segments, data.count(b'<trkseg>') - 1)
+
+    def test_empty_segment(self):
+        data = read('test').replace(b'</trk>', b'<trkseg/></trk>', 1)
+        self.compare(data)
+
+    def test_file_fallback(self):
+        for name in FIXTURES:
+            data = read(name)
+            #A comment, and a trkseg the XML parser doesn't see as one
+            for i, extra in enumerate((b'<!-- comment -->',
+                    b'<extensions><trkseg><trkpt lat="1" lon="2"></trkpt>'
+                    b'</trkseg></extensions>')):
+                changed = data.replace(b'<trk>', extra + b'<trk>', 1)
+                parser = self.compare(changed)
+                self.assertEqual(parser.fast_segments, 0)
+                self.assertEqual(parser.slow_segments,
+                                 data.count(b'<trkseg>') + i)
+
+
+if __name__ == '__main__':
+    unittest.main()
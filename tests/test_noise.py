@@ -0,0 +1,51 @@
+'''
+@author: Zack Townsend
+@license: MIT
+'''
+
+import unittest
+
+from formats.gpx import SegmentPoint
+from processing.geo import to_timestring
+from processing.noise import NoiseFilter, SPEED
+
+START = 1300000000
+
+
+def walk(n):
+    """Get n points a second apart, moving north at about 1 m/s."""
+    points = []
+    for i in range(n):
+        p = SegmentPoint('%.6f' % (45 + i * 0.00001), '7.000000')
+        p.time = to_timestring(START + i)
+        points.append(p)
+    return points
+
+
+class CheckMotionTest(unittest.TestCase):
+    def setUp(self):
+        self.filter = NoiseFilter(max_speed=50)
+
+    def test_outlier_first_point(self):
+        points = walk(100)
+        points[0].lat = '45.500000'
+        kept, report = self.filter.filter(points)
+        self.assertEqual(kept, points[1:])
+        self.assertEqual(report.dropped[SPEED], 1)
+
+    def test_outlier_in_the_middle(self):
+        points = walk(100)
+        points[40].lat = '45.500000'
+        kept, report = self.filter.filter(points)
+        self.assertEqual(kept, points[:40] + points[41:])
+
+    def test_no_time_progress(self):
+        points = walk(10)
+        points[5].time = points[4].time
+        points[5].lat = '46.000000'
+        kept, report = self.filter.filter(points)
+        self.assertEqual(kept, points[:5] + points[6:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+'''
+@author: Zack Townsend
+@license: MIT
+
+Run from the project root:
+    python -m unittest discover tests
+'''
+
+import unittest
+
+from formats.gpx import SegmentPoint, Track, TrackSegment
+from processing.geo import to_timestring
+from processing.stops import GAP, StopDetector, split_track
+
+START = 1300000000
+
+
+def segment(times, lat=45.0, step=0.001):
+    """Get a segment moving north by step degrees per point."""
+    s = TrackSegment()
+    for i, t in enumerate(times):
+        p = SegmentPoint('%.6f' % (lat + i * step), '7.000000')
+        p.time = to_timestring(START + t)
+        s.points.append(p)
+    return s
+
+
+class SplitTrackTest(unittest.TestCase):
+    def setUp(self):
+        self.detector = StopDetector(max_gap=300)
+
+    def test_gap_between_segments(self):
+        track = Track('Commute')
+        track.segments = [segment(range(0, 100, 10)),
+                          segment(range(4000, 4100, 10), lat=45.01)]
+        tracks, stops = split_track(track, self.detector)
+        self.assertEqual(len(tracks), 2)
+        self.assertEqual([t.name for t in tracks],
+                         ['Commute (1)', 'Commute (2)'])
+        self.assertEqual([len(t.segments[0].points) for t in tracks],
+                         [10, 10])
+        self.assertEqual(len(stops), 1)
+        self.assertEqual(stops[0].kind, GAP)
+        self.assertEqual(stops[0].get_duration(), 4000 - 90)
+        self.assertAlmostEqual(stops[0].lat, 45.009)
+
+    def test_short_gap_keeps_one_trip(self):
+        track = Track()
+        track.segments = [segment(range(0, 100, 10)),
+                          segment(range(200, 300, 10), lat=45.01)]
+        tracks, stops = split_track(track, self.detector)
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual(len(tracks[0].segments), 2)
+        self.assertEqual(stops, [])
+
+    def test_stop_before_gap_is_merged(self):
+        track = Track()
+        #Moves, then waits 400 s in place before the logger is switched off
+        first = segment(range(0, 100, 10))
+        wait = segment(range(100, 500, 10), lat=45.009, step=0)
+        first.points.extend(wait.points)
+        track.segments = [first, segment(range(5000, 5100, 10), lat=45.01)]
+        tracks, stops = split_track(track, self.detector)
+        self.assertEqual(len(tracks), 2)
+        self.assertEqual(len(stops), 1)
+        self.assertEqual(stops[0].kind, GAP)
+        self.assertEqual(stops[0].start_time, START + 90)
+        self.assertEqual(stops[0].end_time, START + 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()